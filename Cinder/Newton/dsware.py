@@ -13,6 +13,7 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import functools
 import json
 import time
 import uuid
@@ -25,7 +26,6 @@ from oslo_utils import excutils
 from oslo_utils import units
 from oslo_service import loopingcall
 
-from cinder import coordination
 from cinder import exception
 from cinder.i18n import _
 from cinder import interface
@@ -35,6 +35,7 @@ from cinder.volume.drivers.fusionstorage import constants
 from cinder.volume.drivers.fusionstorage import fs_client
 from cinder.volume.drivers.fusionstorage import fs_conf
 from cinder.volume.drivers.fusionstorage import fs_flow
+from cinder.volume.drivers.fusionstorage import fs_metrics
 from cinder.volume.drivers.fusionstorage import fs_qos
 from cinder.volume.drivers.fusionstorage import fs_utils
 from cinder.volume.drivers.san import san
@@ -50,8 +51,9 @@ volume_opts = [
                      'config form, manager_ips = host1:ip1, host2:ip2...'),
     cfg.StrOpt('dsware_rest_url',
                default='',
-               help='The address of FusionStorage array. For example, '
-                    '"dsware_rest_url=xxx"'),
+               help='The address of FusionStorage array, the semicolon(;) '
+                    'is used to split several management addresses of the '
+                    'same array. For example, "dsware_rest_url=xxx1; xxx2"'),
     cfg.StrOpt('dsware_storage_pools',
                default="",
                help='The list of pools on the FusionStorage array, the '
@@ -110,12 +112,208 @@ volume_opts = [
     cfg.BoolOpt('full_clone',
                 default=False,
                 help='Whether use full clone.'),
+    cfg.IntOpt('rest_connection_pool_size',
+               default=10,
+               min=1,
+               help='Number of FusionStorage management addresses whose '
+                    'connection pools are kept by the REST client.'),
+    cfg.IntOpt('rest_connection_pool_maxsize',
+               default=10,
+               min=1,
+               help='Maximum number of connections kept in the pool of one '
+                    'FusionStorage management address.'),
+    cfg.BoolOpt('rest_connection_pool_block',
+                default=False,
+                help='Whether to wait for a free pooled connection instead '
+                     'of opening a temporary one when the pool is full.'),
+    cfg.IntOpt('rest_connection_idle_timeout',
+               default=0,
+               min=0,
+               help='Seconds a pooled connection may stay idle before it is '
+                    'closed and re-established. 0 means never.'),
+    cfg.IntOpt('rest_connection_prewarm_count',
+               default=0,
+               min=0,
+               help='Number of connections opened to the FusionStorage in '
+                    'advance when the driver starts.'),
+    cfg.IntOpt('rest_endpoint_failure_threshold',
+               default=3,
+               min=1,
+               help='Number of consecutive failures after which a '
+                    'FusionStorage management address is considered down '
+                    'and mutating calls move to a standby address.'),
+    cfg.IntOpt('rest_keep_alive_interval',
+               default=300,
+               min=0,
+               help='Interval in seconds at which the FusionStorage session '
+                    'is kept alive in the background. 0 means the session '
+                    'is only kept alive when volume stats are updated.'),
+    cfg.BoolOpt('rest_cache_enabled',
+                default=False,
+                help='Whether to cache the results of slowly changing '
+                     'FusionStorage queries such as the host, host group, '
+                     'initiator, iSCSI portal and storage pool lists.'),
+    cfg.DictOpt('rest_cache_ttl',
+                default={},
+                help='TTL in seconds of cached FusionStorage queries by URL '
+                     'path, overriding the built-in values. For example: '
+                     '"rest_cache_ttl = /host/list:30, /storagePool:5"'),
+    cfg.IntOpt('rest_retry_max_attempts',
+               default=3,
+               min=1,
+               help='Maximum number of attempts of one FusionStorage REST '
+                    'call which failed with a retryable error.'),
+    cfg.FloatOpt('rest_retry_base_interval',
+                 default=1,
+                 min=0,
+                 help='Base interval in seconds of the exponential backoff '
+                      'between two attempts of a FusionStorage REST call.'),
+    cfg.FloatOpt('rest_retry_max_interval',
+                 default=10,
+                 min=0,
+                 help='Maximum interval in seconds between two attempts of '
+                      'a FusionStorage REST call.'),
+    cfg.IntOpt('rest_retry_deadline',
+               default=120,
+               min=0,
+               help='Time in seconds after which a failed FusionStorage '
+                    'REST call is no longer retried.'),
+    cfg.ListOpt('rest_retry_error_codes',
+                default=[],
+                help='Additional FusionStorage error codes meaning that the '
+                     'array is busy and the request can be sent again. '
+                     'For example: "rest_retry_error_codes = code1, code2"'),
+    cfg.IntOpt('rest_circuit_failure_threshold',
+               default=5,
+               min=1,
+               help='Number of consecutive connection or server errors '
+                    'after which FusionStorage REST calls fail fast.'),
+    cfg.IntOpt('rest_circuit_reset_timeout',
+               default=30,
+               min=1,
+               help='Seconds after which a probe call is sent to check '
+                    'whether an unreachable FusionStorage has recovered.'),
+    cfg.ListOpt('rest_metrics_exporters',
+                default=[],
+                help='Exporters of the FusionStorage REST call metrics, '
+                     'the supported exporters are "log" and "prometheus". '
+                     'For example: "rest_metrics_exporters = log, prometheus"'),
+    cfg.StrOpt('rest_metrics_file',
+               help='File to which the prometheus exporter writes the '
+                    'FusionStorage REST call metrics in the Prometheus '
+                    'text format.'),
+    cfg.IntOpt('rest_metrics_interval',
+               default=60,
+               min=1,
+               help='Seconds between two exports of the FusionStorage REST '
+                    'call metrics.'),
+    cfg.BoolOpt('rest_adaptive_timeout_enabled',
+                default=True,
+                help='Whether the timeout of the FusionStorage REST queries '
+                     'is learned from their observed latency.'),
+    cfg.IntOpt('rest_adaptive_timeout_percentile',
+               default=99,
+               min=50,
+               max=100,
+               help='Latency percentile from which the timeout of the '
+                    'FusionStorage REST queries is learned.'),
+    cfg.IntOpt('rest_adaptive_timeout_floor',
+               default=5,
+               min=1,
+               help='Lower bound in seconds of the learned timeout of the '
+                    'FusionStorage REST queries.'),
+    cfg.IntOpt('rest_adaptive_timeout_ceiling',
+               default=50,
+               min=1,
+               help='Upper bound in seconds of the learned timeout of the '
+                    'FusionStorage REST queries.'),
+    cfg.IntOpt('rest_operation_deadline',
+               default=0,
+               min=0,
+               help='Seconds within which the FusionStorage REST calls of a '
+                    'volume, snapshot or connection operation must finish, '
+                    '0 means no deadline.'),
+    cfg.IntOpt('rest_list_page_size',
+               default=1000,
+               min=1,
+               max=1000,
+               help='Number of records requested per page when listing '
+                    'FusionStorage volumes and snapshots.'),
+    cfg.BoolOpt('rest_list_prefetch',
+                default=False,
+                help='Whether the next page of a FusionStorage list is '
+                     'requested in the background while the current page '
+                     'is scanned.'),
+    cfg.IntOpt('rest_list_concurrency',
+               default=1,
+               min=1,
+               help='Maximum number of pages of FusionStorage lists that '
+                    'are requested at the same time. Pages are requested '
+                    'concurrently once the total number of records is '
+                    'known.'),
+    cfg.BoolOpt('rest_list_streaming',
+                default=False,
+                help='Decode the records of the FusionStorage volume, '
+                     'snapshot and LUN host lists one at a time while they '
+                     'are received instead of loading whole responses. '
+                     'Pages are then requested one after the other.'),
+    cfg.FloatOpt('rest_batch_window',
+                 default=0,
+                 min=0,
+                 help='Seconds during which concurrent volume deletions, '
+                      'volume mappings to the same host, QoS associations '
+                      'and initiator queries are collected and sent to '
+                      'FusionStorage as one request, 0 disables batching.'),
+    cfg.IntOpt('rest_batch_max_items',
+               default=100,
+               min=1,
+               help='Maximum number of items of a batched FusionStorage '
+                    'request.'),
+    cfg.StrOpt('rest_json_codec',
+               default='auto',
+               choices=['auto', 'json', 'orjson', 'ujson'],
+               help='JSON library used to encode the FusionStorage REST '
+                    'requests and decode the responses. auto uses the '
+                    'fastest installed one among orjson, ujson and json. '
+                    'A library which is not installed falls back to json.'),
+    cfg.IntOpt('rest_topology_refresh_interval',
+               default=300,
+               min=0,
+               help='Interval in seconds after which the index of the '
+                    'FusionStorage hosts, host groups and initiators used '
+                    'by attach and detach is compared with the array '
+                    'again. 0 disables the index, the lists are then '
+                    'queried by each attach and detach.'),
+    cfg.IntOpt('mapping_flow_workers',
+               default=4,
+               min=1,
+               help='Number of threads shared by the iSCSI attach and detach '
+                    'flows to run their independent steps, such as the '
+                    'creation of a host, of its host group and of its '
+                    'initiator, in parallel. 1 runs the steps one after '
+                    'the other.'),
+    cfg.IntOpt('rest_time_config_ttl',
+               default=3600,
+               min=0,
+               help='Seconds the time zone and DST configuration of '
+                    'FusionStorage are cached for the conversion of '
+                    'scheduled QoS. They are also reloaded when the DST '
+                    'of the array begins or ends. 0 disables the cache.'),
 ]
 
 CONF = cfg.CONF
 CONF.register_opts(volume_opts)
 
 
+def with_operation_deadline(func):
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        with fs_client.operation_deadline(
+                self.configuration.rest_operation_deadline):
+            return func(self, *args, **kwargs)
+    return wrapper
+
+
 @interface.volumedriver
 class DSWAREBaseDriver(driver.VolumeDriver):
     VERSION = "2.6.2"
@@ -155,8 +353,46 @@ class DSWAREBaseDriver(driver.VolumeDriver):
                 self.configuration.storage_ssl_two_way_auth
         }
 
+        connection_pool = {
+            "pool_connections": self.configuration.rest_connection_pool_size,
+            "pool_maxsize": self.configuration.rest_connection_pool_maxsize,
+            "pool_block": self.configuration.rest_connection_pool_block,
+            "idle_timeout": self.configuration.rest_connection_idle_timeout
+        }
+
         extend_conf = {
-            "mutual_authentication": mutual_authentication
+            "mutual_authentication": mutual_authentication,
+            "connection_pool": connection_pool,
+            "failure_threshold":
+                self.configuration.rest_endpoint_failure_threshold,
+            "cache_ttl": self._get_rest_cache_ttl(),
+            "retry": {
+                "max_attempts": self.configuration.rest_retry_max_attempts,
+                "base_interval": self.configuration.rest_retry_base_interval,
+                "max_interval": self.configuration.rest_retry_max_interval,
+                "deadline": self.configuration.rest_retry_deadline,
+                "busy_codes": tuple(self.configuration.rest_retry_error_codes)
+            },
+            "circuit_breaker": {
+                "failure_threshold":
+                    self.configuration.rest_circuit_failure_threshold,
+                "reset_timeout": self.configuration.rest_circuit_reset_timeout
+            },
+            "adaptive_timeout": self._get_adaptive_timeout_conf(),
+            "pagination": {
+                "page_size": self.configuration.rest_list_page_size,
+                "prefetch": self.configuration.rest_list_prefetch,
+                "concurrency": self.configuration.rest_list_concurrency,
+                "streaming": self.configuration.rest_list_streaming
+            },
+            "batch": {
+                "window": self.configuration.rest_batch_window,
+                "max_items": self.configuration.rest_batch_max_items
+            },
+            "json_codec": self.configuration.rest_json_codec,
+            "time_config_ttl": self.configuration.rest_time_config_ttl,
+            "topology_refresh_interval":
+                self.configuration.rest_topology_refresh_interval
         }
 
         self.client = fs_client.RestCommon(fs_address=url_str,
@@ -164,8 +400,55 @@ class DSWAREBaseDriver(driver.VolumeDriver):
                                            fs_password=url_password,
                                            **extend_conf)
         self.client.login()
+        self.client.prewarm_connections(
+            self.configuration.rest_connection_prewarm_count)
+        self.client.start_keep_alive_timer(
+            self.configuration.rest_keep_alive_interval)
+        self._start_metrics_reporter()
         self.fs_qos = fs_qos.FusionStorageQoS(self.client)
 
+    def _start_metrics_reporter(self):
+        backend_name = self.configuration.safe_get(
+            'volume_backend_name') or self.__class__.__name__
+        exporters = fs_metrics.get_exporters(
+            self.configuration.rest_metrics_exporters, backend_name,
+            file_path=self.configuration.rest_metrics_file)
+        self.metrics_reporter = fs_metrics.MetricsReporter(
+            self.client, exporters)
+        self.metrics_reporter.start(self.configuration.rest_metrics_interval)
+
+    def _get_adaptive_timeout_conf(self):
+        floor = self.configuration.rest_adaptive_timeout_floor
+        ceiling = self.configuration.rest_adaptive_timeout_ceiling
+        if floor > ceiling:
+            msg = _('The rest_adaptive_timeout_floor %(floor)s must not be '
+                    'greater than the rest_adaptive_timeout_ceiling '
+                    '%(ceiling)s.') % {"floor": floor, "ceiling": ceiling}
+            LOG.error(msg)
+            raise exception.InvalidInput(reason=msg)
+
+        return {
+            "enabled": self.configuration.rest_adaptive_timeout_enabled,
+            "percentile": self.configuration.rest_adaptive_timeout_percentile,
+            "floor": floor,
+            "ceiling": ceiling
+        }
+
+    def _get_rest_cache_ttl(self):
+        if not self.configuration.rest_cache_enabled:
+            return {}
+
+        cache_ttl = dict(constants.REST_CACHE_TTL)
+        for path, ttl in self.configuration.rest_cache_ttl.items():
+            if path not in cache_ttl:
+                msg = _('The REST cache path %(path)s is not supported, the '
+                        'supported paths are %(paths)s.'
+                        ) % {"path": path, "paths": list(cache_ttl)}
+                LOG.error(msg)
+                raise exception.InvalidInput(reason=msg)
+            cache_ttl[path] = int(ttl)
+        return cache_ttl
+
     def check_for_setup_error(self):
         all_pools = self.client.query_pool_info()
         all_pools_name = [p['poolName'] for p in all_pools
@@ -178,14 +461,17 @@ class DSWAREBaseDriver(driver.VolumeDriver):
                 LOG.error(msg)
                 raise exception.InvalidInput(reason=msg)
 
-    def _update_pool_stats(self):
+    def _get_base_stats(self):
         backend_name = self.configuration.safe_get(
             'volume_backend_name') or self.__class__.__name__
-        data = {"volume_backend_name": backend_name,
+        return {"volume_backend_name": backend_name,
                 "driver_version": self.VERSION,
                 "pools": [],
                 "vendor_name": "Huawei"
                 }
+
+    def _update_pool_stats(self):
+        data = self._get_base_stats()
         all_pools = self.client.query_pool_info()
 
         for pool in all_pools:
@@ -225,9 +511,48 @@ class DSWAREBaseDriver(driver.VolumeDriver):
         })
         return status
 
+    def _get_unavailable_pool_stats(self):
+        # Report no capacity so that the scheduler steers away from the
+        # backend while the array can not be reached.
+        data = self._get_base_stats()
+        for pool_name in self.configuration.pools_name:
+            data['pools'].append({
+                "pool_name": pool_name,
+                "total_capacity_gb": 0,
+                "free_capacity_gb": 0,
+                "provisioned_capacity_gb": 0,
+                "location_info": self.client.esn,
+                "QoS_support": True,
+                'multiattach': True,
+                "thin_provisioning_support": True,
+                "reserved_percentage":
+                    self.configuration.safe_get('reserved_percentage'),
+            })
+        return data
+
     def get_volume_stats(self, refresh=False):
-        self.client.keep_alive()
-        stats = self._update_pool_stats()
+        try:
+            self.client.keep_alive()
+            stats = self._update_pool_stats()
+        except Exception as err:
+            if not self.client.is_circuit_open():
+                raise
+            LOG.error("Update volume stats failed, the FusionStorage is "
+                      "unavailable. Reason: %s", err)
+            stats = self._get_unavailable_pool_stats()
+
+        circuit_breaker = self.client.get_circuit_breaker_stats()
+        stats['backend_state'] = (
+            'up' if circuit_breaker['state'] == constants.CIRCUIT_CLOSED
+            else 'down')
+        stats['circuit_breaker_state'] = circuit_breaker['state']
+        LOG.debug("REST connection pool stats: %(pool)s, cache stats: "
+                  "%(cache)s, coalesce stats: %(coalesce)s, circuit breaker "
+                  "stats: %(breaker)s",
+                  {"pool": self.client.get_connection_pool_stats(),
+                   "cache": self.client.get_cache_stats(),
+                   "coalesce": self.client.get_coalesce_stats(),
+                   "breaker": circuit_breaker})
         return stats
 
     def _check_volume_exist(self, volume):
@@ -311,6 +636,7 @@ class DSWAREBaseDriver(driver.VolumeDriver):
             self.client.delete_volume(vol_name=vol_name)
             raise
 
+    @with_operation_deadline
     def create_volume(self, volume):
         pool_id = self._get_pool_id(volume)
         vol_name = volume.name
@@ -323,6 +649,7 @@ class DSWAREBaseDriver(driver.VolumeDriver):
         result = self.client.query_volume_by_name(vol_name=vol_name)
         return {"metadata": {'lun_wwn': result.get('wwn')}} if result else {}
 
+    @with_operation_deadline
     def delete_volume(self, volume):
         vol_name = self._get_vol_name(volume)
         if self._check_volume_exist(volume):
@@ -330,6 +657,7 @@ class DSWAREBaseDriver(driver.VolumeDriver):
             self.fs_qos.remove(vol_name)
             self.client.delete_volume(vol_name=vol_name)
 
+    @with_operation_deadline
     def extend_volume(self, volume, new_size):
         vol_name = self._get_vol_name(volume)
         if not self._check_volume_exist(volume):
@@ -508,6 +836,7 @@ class DSWAREBaseDriver(driver.VolumeDriver):
         return ({"metadata": {'lun_wwn': result.get('wwn')}}
                 if result else {})
 
+    @with_operation_deadline
     def create_snapshot(self, snapshot):
         snapshot_name = self._get_snapshot_name(snapshot)
         vol_name = self._get_vol_name(snapshot.volume)
@@ -515,6 +844,7 @@ class DSWAREBaseDriver(driver.VolumeDriver):
         self.client.create_snapshot(
             snapshot_name=snapshot_name, vol_name=vol_name)
 
+    @with_operation_deadline
     def delete_snapshot(self, snapshot):
         snapshot_name = self._get_snapshot_name(snapshot)
 
@@ -526,6 +856,8 @@ class DSWAREBaseDriver(driver.VolumeDriver):
             return self.client.query_volume_by_name(vol_name)
 
         elif vol_id:
+            if self.client.capabilities.supports_api("v1.3") is False:
+                return self.client.get_volume_by_id(pool_id, vol_id)
             try:
                 return self.client.query_volume_by_id(vol_id)
             except Exception:
@@ -853,6 +1185,11 @@ class DSWAREBaseDriver(driver.VolumeDriver):
             LOG.error("lun migration error, pool_name not exists")
             return False
 
+        if self.client.capabilities.supports_api("v2") is False:
+            LOG.warning("lun migration is not supported, the array does "
+                        "not provide the v2 REST API")
+            return False
+
         return True
 
     def _check_volume_exist_on_array(self, volume):
@@ -873,7 +1210,7 @@ class DSWAREBaseDriver(driver.VolumeDriver):
                     ) % volume.id
             self._raise_exception(msg)
 
-        if self.client.get_volume_snapshot(volume_name):
+        if self.client.volume_has_snapshot(volume_name):
             msg = _("Volume %s which have snapshot cannot do lun migration"
                     ) % volume.id
             self._raise_exception(msg)
@@ -1233,6 +1570,7 @@ class DSWAREDriver(DSWAREBaseDriver):
             manager_ip = self._get_manager_ip(properties)
             self.client.detach_volume(vol_name, manager_ip)
 
+    @with_operation_deadline
     def initialize_connection(self, volume, connector):
         vol_name = self._get_vol_name(volume)
         manager_ip = self._get_manager_ip(connector)
@@ -1253,6 +1591,7 @@ class DSWAREDriver(DSWAREBaseDriver):
         return {'driver_volume_type': 'local',
                 'data': properties}
 
+    @with_operation_deadline
     def terminate_connection(self, volume, connector, **kwargs):
         if self._check_volume_exist(volume):
             manager_ip = self._get_manager_ip(connector)
@@ -1264,15 +1603,23 @@ class DSWAREDriver(DSWAREBaseDriver):
 class DSWAREISCSIDriver(DSWAREBaseDriver):
     def __init__(self, *args, **kwargs):
         super(DSWAREISCSIDriver, self).__init__(*args, **kwargs)
-        self.support_iscsi_links_balance_by_pool = False
+        self.flow_executor = None
+        self.mapping_queue = fs_flow.HostWorkQueue()
 
     def do_setup(self, context):
         super(DSWAREISCSIDriver, self).do_setup(context)
+        if self.configuration.mapping_flow_workers > 1:
+            # Shared by all attaches and detaches, so that its size caps
+            # the number of mapping calls sent to the array at a time.
+            self.flow_executor = fs_client.DeadlineThreadPoolExecutor(
+                max_workers=self.configuration.mapping_flow_workers)
+
+    def _is_support_links_balance_by_pool(self):
+        # The registry is probed again on each login, so that an array
+        # upgraded since do_setup is seen without restarting the service.
         if self.configuration.iscsi_manager_groups or self.configuration.target_ips:
-            self.support_iscsi_links_balance_by_pool = False
-        else:
-            self.support_iscsi_links_balance_by_pool = \
-                self.client.is_support_links_balance_by_pool()
+            return False
+        return self.client.is_support_links_balance_by_pool()
 
     def check_for_setup_error(self):
         super(DSWAREISCSIDriver, self).check_for_setup_error()
@@ -1284,7 +1631,7 @@ class DSWAREISCSIDriver(DSWAREBaseDriver):
         stats['storage_protocol'] = 'iSCSI'
         return stats
 
-    @coordination.synchronized('huawei-mapping-{connector[host]}')
+    @with_operation_deadline
     def initialize_connection(self, volume, connector):
         LOG.info("Start to initialize iscsi connection, volume: %(vol)s, "
                  "connector: %(con)s", {"vol": volume, "con": connector})
@@ -1301,31 +1648,55 @@ class DSWAREISCSIDriver(DSWAREBaseDriver):
             'manager_groups': self.manager_groups,
             'thread_lock': self.lock,
             'pool_name': pool_name,
-            'support_iscsi_links_balance_by_pool': self.support_iscsi_links_balance_by_pool
+            'support_iscsi_links_balance_by_pool':
+                self._is_support_links_balance_by_pool(),
+            'flow_executor': self.flow_executor
         }
-        properties = fs_flow.initialize_iscsi_connection(
-            self.client, vol_name, connector, iscsi_params)
+
+        lock_name = 'huawei-mapping-%s' % connector['host']
+
+        def _map_volumes(vol_names):
+            return fs_flow.map_iscsi_volumes(
+                self.client, vol_names, connector, iscsi_params)
+
+        def _get_iscsi_properties(mapping):
+            return fs_flow.get_iscsi_properties(
+                self.client, mapping, lock_name)
+
+        # Concurrent attaches to the same host are mapped together. The
+        # mapping and the choice of the iSCSI portals hold the mapping lock
+        # of the host, the LUN ids are read after it is released.
+        batch_key = ('attach', connector.get('initiator'),
+                     bool(connector.get('multipath')), pool_name)
+        properties = self.mapping_queue.submit(
+            connector['host'], batch_key, lock_name, vol_name,
+            _map_volumes, _get_iscsi_properties)
 
         LOG.info("Finish initialize iscsi connection, return: %s, the "
                  "remaining manager groups are %s",
                  properties, self.manager_groups)
         return {'driver_volume_type': 'iscsi', 'data': properties}
 
+    @with_operation_deadline
     def terminate_connection(self, volume, connector, **kwargs):
         host = connector['host'] if 'host' in connector else ""
+        LOG.info("Start to terminate iscsi connection, volume: %(vol)s, "
+                 "connector: %(con)s", {"vol": volume, "con": connector})
+        if not self._check_volume_exist(volume):
+            LOG.info("Terminate_connection, volume %(vol)s is not exist "
+                     "on the array ", {"vol": volume})
+            return
+
+        vol_name = self._get_vol_name(volume)
 
-        @coordination.synchronized('huawei-mapping-{host}')
-        def _terminate_connection_locked(host):
-            LOG.info("Start to terminate iscsi connection, volume: %(vol)s, "
-                     "connector: %(con)s", {"vol": volume, "con": connector})
-            if not self._check_volume_exist(volume):
-                LOG.info("Terminate_connection, volume %(vol)s is not exist "
-                         "on the array ", {"vol": volume})
-                return
+        def _terminate_connections(vol_names):
+            return fs_flow.terminate_iscsi_connections(
+                self.client, vol_names, connector, self.flow_executor)
 
-            vol_name = self._get_vol_name(volume)
-            fs_flow.terminate_iscsi_connection(
-                self.client, vol_name, connector)
+        # Concurrent detaches from the same host are unmapped together,
+        # in order with the attaches to it.
+        self.mapping_queue.submit(
+            host, ('detach',), 'huawei-mapping-%s' % host, vol_name,
+            _terminate_connections)
 
-            LOG.info("Terminate iscsi connection successful.")
-        return _terminate_connection_locked(host)
+        LOG.info("Terminate iscsi connection successful.")
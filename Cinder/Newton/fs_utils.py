@@ -38,21 +38,37 @@ LOG = logging.getLogger(__name__)
 
 
 def is_volume_associate_to_host(client, vol_name, host_name):
-    lun_host_list = client.get_host_by_volume(vol_name)
-    for host in lun_host_list:
+    for host in client.iter_hosts_by_volume(vol_name):
         if host.get('hostName') == host_name:
             return host.get("lunId")
 
 
 def is_initiator_add_to_array(client, initiator_name):
+    if client.topology.enabled:
+        if client.get_topology().has_initiator(initiator_name):
+            return initiator_name
+        return None
+
     initiator_list = client.get_all_initiator_on_array()
     for initiator in initiator_list:
         if initiator.get('portName') == initiator_name:
             return initiator.get('portName')
 
 
+def get_initiators_of_host(client, host_name):
+    if not client.topology.enabled:
+        return client.get_associate_initiator_by_host_name(host_name)
+
+    initiator_list = client.get_topology().get_host_initiators(host_name)
+    if initiator_list is None:
+        initiator_list = client.get_associate_initiator_by_host_name(
+            host_name)
+        client.topology.set_host_initiators(host_name, initiator_list)
+    return initiator_list
+
+
 def is_initiator_associate_to_host(client, host_name, initiator_name):
-    initiator_list = client.get_associate_initiator_by_host_name(host_name)
+    initiator_list = get_initiators_of_host(client, host_name)
     return initiator_name in initiator_list
 
 
@@ -89,6 +105,11 @@ def is_lun_in_host(client, host_name):
 
 
 def is_host_add_to_array(client, host_name):
+    if client.topology.enabled:
+        if client.get_topology().has_host(host_name):
+            return host_name
+        return None
+
     all_hosts = client.get_all_host()
     for host in all_hosts:
         if host.get("hostName") == host_name:
@@ -96,19 +117,35 @@ def is_host_add_to_array(client, host_name):
 
 
 def is_hostgroup_add_to_array(client, host_group_name):
+    if client.topology.enabled:
+        if client.get_topology().has_host_group(host_group_name):
+            return host_group_name
+        return None
+
     all_host_groups = client.get_all_hostgroup()
     for host_group in all_host_groups:
         if host_group.get("hostGroupName") == host_group_name:
             return host_group.get("hostGroupName")
 
 
+def get_hosts_in_hostgroup(client, host_group_name):
+    if not client.topology.enabled:
+        return client.get_host_in_hostgroup(host_group_name)
+
+    all_host = client.get_topology().get_group_hosts(host_group_name)
+    if all_host is None:
+        all_host = client.get_host_in_hostgroup(host_group_name)
+        client.topology.set_group_hosts(host_group_name, all_host)
+    return all_host
+
+
 def is_host_group_empty(client, host_group_name):
-    all_host = client.get_host_in_hostgroup(host_group_name)
+    all_host = get_hosts_in_hostgroup(client, host_group_name)
     return not all_host
 
 
 def is_host_in_host_group(client, host_name, host_group_name):
-    all_host = client.get_host_in_hostgroup(host_group_name)
+    all_host = get_hosts_in_hostgroup(client, host_group_name)
     return host_name in all_host
 
 
@@ -137,7 +174,7 @@ def get_volume_type_params(volume_type, client):
 
 def _get_trigger_qos(qos, client):
     if qos.get(constants.QOS_SCHEDULER_KEYS[0]):
-        if client.get_fsm_version() >= constants.QOS_SUPPORT_SCHEDULE_VERSION:
+        if client.is_support_schedule_qos():
             qos = _check_and_convert_qos(qos, client)
         else:
             msg = _('FusionStorage Version is not suitable for QoS: %s') % qos
@@ -272,8 +309,7 @@ def _check_scheduler_count(qos, is_default_scheduler, configed_week_scheduler,
 def _check_and_convert_qos(qos, client):
     configed_none_default = 0
     sys_loc_time = _get_sys_time(client)
-    sys_loc_time = time.strptime(datetime.datetime.now(sys_loc_time).strftime(
-        "%Y-%m-%d %H:%M:%S"), "%Y-%m-%d %H:%M:%S")
+    sys_loc_time = datetime.datetime.now(sys_loc_time).timetuple()
 
     (qos, is_default_scheduler,
      configed_week_scheduler) = _convert_schedule_type(qos)
@@ -301,6 +337,11 @@ def _check_and_convert_qos(qos, client):
 
 
 def _get_sys_time(client):
+    return client.system_time_cache.get(
+        "time_zone", lambda: (_load_sys_time(client), None))
+
+
+def _load_sys_time(client):
     time_zone = client.get_system_time_zone()
     try:
         sys_loc_time = pytz.timezone(time_zone)
@@ -312,6 +353,50 @@ def _get_sys_time(client):
     return sys_loc_time
 
 
+def _get_time_config(client, sys_loc_time):
+    """Return the time config of the array and its UTC offset.
+
+    The offset is None when the time config has no time zone.
+    """
+    return client.system_time_cache.get(
+        "time_config", lambda: _load_time_config(client, sys_loc_time))
+
+
+def _load_time_config(client, sys_loc_time):
+    time_config = client.get_time_config()
+    zone = None
+    if time_config.get("time_zone"):
+        zone = _get_diff_time(time_config)
+    return (time_config, zone), _get_next_dst_change(time_config,
+                                                     sys_loc_time)
+
+
+def _get_next_dst_change(time_config, sys_loc_time):
+    """Return the timestamp of the next DST begin or end of the array."""
+    if not int(time_config.get("use_dst", 0)):
+        return None
+
+    cur_time = datetime.datetime(*sys_loc_time[:6])
+    changes = []
+    for key in ("dst_begin_date", "dst_end_date"):
+        try:
+            for year in (cur_time.year, cur_time.year + 1):
+                change = datetime.datetime.strptime(
+                    "%s-%s" % (year, time_config[key]),
+                    "%Y-" + constants.DST_TIME_FORMAT)
+                if change > cur_time:
+                    break
+        except (KeyError, TypeError, ValueError) as err:
+            LOG.warning("The DST time %(time)s is invalid, reason: %(err)s",
+                        {"time": time_config.get(key), "err": err})
+            continue
+        changes.append(change)
+
+    if not changes:
+        return None
+    return time.time() + (min(changes) - cur_time).total_seconds()
+
+
 def _deal_dst_time(time_config, cur_time):
     LOG.info("Current system time is %(cur)s.", {"cur": cur_time})
     use_dst = int(time_config.get("use_dst", 0))
@@ -443,7 +528,7 @@ def _convert_start_time(qos, client, sys_loc_time, configed_none_default):
     start_time = constants.QOS_SCHEDULER_KEYS[2]
     is_date_increase = False
     is_date_decrease = False
-    sys_dst_time = time.strftime("%m-%d %H:%M:%S", sys_loc_time)
+    sys_dst_time = time.strftime(constants.DST_TIME_FORMAT, sys_loc_time)
     if qos.get(start_time):
         if qos.get(start_date) is None:
             msg = (_("The start date %(date)s is not config.")
@@ -461,13 +546,13 @@ def _convert_start_time(qos, client, sys_loc_time, configed_none_default):
         config_sec = datetime.timedelta(
             hours=config_time.tm_hour, minutes=config_time.tm_min).seconds
 
-        time_config = client.get_time_config()
+        time_config, zone = _get_time_config(client, sys_loc_time)
 
         cur_date_in_dst_time = _deal_dst_time(
             time_config, sys_dst_time)
 
         LOG.info("System time is: %s", sys_loc_time)
-        zone_flag, time_zone = _get_diff_time(time_config)
+        zone_flag, time_zone = zone or _get_diff_time(time_config)
 
         (qos_time_params, is_date_decrease,
          is_date_increase) = _get_qos_time_params(
@@ -0,0 +1,373 @@
+# Copyright (c) 2018 Huawei Technologies Co., Ltd.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import bisect
+import os
+import re
+import threading
+
+import six
+from oslo_log import log as logging
+from oslo_service import loopingcall
+
+from cinder import exception
+from cinder.i18n import _
+from cinder.volume.drivers.fusionstorage import constants
+
+LOG = logging.getLogger(__name__)
+
+_METRIC_NAME_RE = re.compile(r"^[a-zA-Z_][a-zA-Z0-9_]*$")
+
+
+class LatencyHistogram(object):
+    """Fixed bucket latency histogram in seconds."""
+
+    def __init__(self, buckets=constants.REST_LATENCY_BUCKETS):
+        self.buckets = buckets
+        # The last counter is the +Inf bucket.
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def percentile(self, percent):
+        """Estimate a percentile by interpolating inside its bucket."""
+        if not self.count:
+            return 0.0
+
+        rank = self.count * percent / 100.0
+        cumulative = 0
+        for index, count in enumerate(self.counts):
+            if not count or cumulative + count < rank:
+                cumulative += count
+                continue
+
+            lower = self.buckets[index - 1] if index else 0.0
+            upper = (self.buckets[index] if index < len(self.buckets)
+                     else self.max)
+            upper = min(upper, self.max)
+            return lower + (upper - lower) * (rank - cumulative) / count
+        return self.max
+
+    def to_dict(self):
+        cumulative = []
+        total = 0
+        for count in self.counts:
+            total += count
+            cumulative.append(total)
+        return {"buckets": list(zip(self.buckets, cumulative)),
+                "count": self.count,
+                "sum": self.sum,
+                "max": self.max,
+                "p50": self.percentile(50),
+                "p95": self.percentile(95),
+                "p99": self.percentile(99)}
+
+
+class _CallMetrics(object):
+    def __init__(self):
+        self.latency = LatencyHistogram()
+        self.errors = {}
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.retries = 0
+        self.cache_hits = 0
+        self.coalesced = 0
+
+    def to_dict(self):
+        data = self.latency.to_dict()
+        data.update({"errors": dict(self.errors),
+                     "bytes_sent": self.bytes_sent,
+                     "bytes_received": self.bytes_received,
+                     "retries": self.retries,
+                     "cache_hits": self.cache_hits,
+                     "coalesced": self.coalesced})
+        return data
+
+
+class RestMetrics(object):
+    """Call metrics of RestCommon, keyed by method and URL template.
+
+    The URL template is the request path without its query string, so
+    that calls such as "/volume/queryByName?volName=x" share one series.
+    The latencies are the ones of the HTTP requests sent to the array,
+    the calls answered by the cache or by a coalesced request are only
+    counted.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    @staticmethod
+    def get_template(url):
+        return url.split("?")[0]
+
+    def _get(self, method, url):
+        key = (method.upper(), self.get_template(url))
+        metrics = self._calls.get(key)
+        if metrics is None:
+            metrics = self._calls[key] = _CallMetrics()
+        return metrics
+
+    def observe(self, method, url, elapsed, error_code=None):
+        with self._lock:
+            metrics = self._get(method, url)
+            metrics.latency.observe(elapsed)
+            self._add_error(metrics, error_code)
+
+    def record_error(self, method, url, error_code):
+        with self._lock:
+            self._add_error(self._get(method, url), error_code)
+
+    @staticmethod
+    def _add_error(metrics, error_code):
+        if error_code is not None:
+            error_code = six.text_type(error_code)
+            metrics.errors[error_code] = metrics.errors.get(error_code, 0) + 1
+
+    def record_bytes(self, method, url, sent, received):
+        with self._lock:
+            metrics = self._get(method, url)
+            metrics.bytes_sent += sent
+            metrics.bytes_received += received
+
+    def record_retry(self, method, url):
+        with self._lock:
+            self._get(method, url).retries += 1
+
+    def record_cache_hit(self, method, url):
+        with self._lock:
+            self._get(method, url).cache_hits += 1
+
+    def record_coalesced(self, method, url):
+        with self._lock:
+            self._get(method, url).coalesced += 1
+
+    def to_dict(self):
+        with self._lock:
+            return dict(("%s %s" % key, metrics.to_dict())
+                        for key, metrics in self._calls.items())
+
+
+class MetricsExporter(object):
+    """Base class of the exporters of the REST metrics."""
+
+    def __init__(self, backend_name, **kwargs):
+        self.backend_name = backend_name
+
+    def export(self, metrics):
+        """Hand the metrics of RestCommon.get_metrics to the backend.
+
+        The base exporter drops them, the exporters override this.
+        """
+
+
+class LogExporter(MetricsExporter):
+    """Log a summary of the slowest calls."""
+
+    def export(self, metrics):
+        calls = sorted(metrics.get("calls", {}).items(),
+                       key=lambda item: item[1]["sum"], reverse=True)
+        lines = []
+        for name, call in calls[:constants.REST_METRICS_LOG_TOP]:
+            lines.append(
+                "%(name)s: count=%(count)s p50=%(p50).3fs p95=%(p95).3fs "
+                "p99=%(p99).3fs retries=%(retries)s errors=%(errors)s "
+                "sent=%(sent)s received=%(received)s "
+                "cache_hits=%(cache_hits)s coalesced=%(coalesced)s" % {
+                    "name": name, "count": call["count"], "p50": call["p50"],
+                    "p95": call["p95"], "p99": call["p99"],
+                    "retries": call["retries"], "errors": call["errors"],
+                    "sent": call["bytes_sent"],
+                    "received": call["bytes_received"],
+                    "cache_hits": call["cache_hits"],
+                    "coalesced": call["coalesced"]})
+
+        LOG.info("FusionStorage REST metrics of backend %(backend)s:\n"
+                 "%(calls)s\nOther stats: %(stats)s",
+                 {"backend": self.backend_name, "calls": "\n".join(lines),
+                  "stats": dict((k, v) for k, v in metrics.items()
+                                if k != "calls")})
+
+
+class PrometheusFileExporter(MetricsExporter):
+    """Dump the metrics in the Prometheus text format.
+
+    The file is meant to be picked up by the textfile collector of the
+    node exporter, so it is replaced atomically.
+    """
+
+    PREFIX = "fusionstorage_rest_"
+
+    # The stats keyed by something other than a metric name, such as an
+    # URL, are exported as one gauge labelled by the key.
+    LABELLED_GAUGES = {"timeouts": ("timeout_seconds", "url")}
+
+    def __init__(self, backend_name, file_path=None, **kwargs):
+        super(PrometheusFileExporter, self).__init__(backend_name, **kwargs)
+        if not file_path:
+            msg = _("The rest_metrics_file must be set to use the "
+                    "prometheus metrics exporter.")
+            LOG.error(msg)
+            raise exception.InvalidInput(reason=msg)
+        self.file_path = file_path
+
+    @staticmethod
+    def _escape(value):
+        return six.text_type(value).replace(
+            "\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    def _labels(self, **labels):
+        labels["backend"] = self.backend_name
+        return "{%s}" % ",".join(
+            '%s="%s"' % (key, self._escape(labels[key]))
+            for key in sorted(labels))
+
+    def _format(self, metrics):
+        name = self.PREFIX + "request_duration_seconds"
+        lines = ["# TYPE %s histogram" % name]
+        counters = {"request_errors_total": [],
+                    "request_bytes_sent_total": [],
+                    "request_bytes_received_total": [],
+                    "request_retries_total": [],
+                    "request_cache_hits_total": [],
+                    "request_coalesced_total": []}
+        for call_name, call in sorted(metrics.get("calls", {}).items()):
+            method, url = call_name.split(" ", 1)
+            for bucket, count in call["buckets"]:
+                lines.append("%s_bucket%s %s" % (name, self._labels(
+                    method=method, url=url, le=bucket), count))
+            lines.append("%s_bucket%s %s" % (name, self._labels(
+                method=method, url=url, le="+Inf"), call["count"]))
+            lines.append("%s_sum%s %s" % (
+                name, self._labels(method=method, url=url), call["sum"]))
+            lines.append("%s_count%s %s" % (
+                name, self._labels(method=method, url=url), call["count"]))
+
+            for code, count in sorted(call["errors"].items()):
+                counters["request_errors_total"].append((self._labels(
+                    method=method, url=url, code=code), count))
+            for key, counter in (("bytes_sent", "request_bytes_sent_total"),
+                                 ("bytes_received",
+                                  "request_bytes_received_total"),
+                                 ("retries", "request_retries_total"),
+                                 ("cache_hits", "request_cache_hits_total"),
+                                 ("coalesced", "request_coalesced_total")):
+                counters[counter].append(
+                    (self._labels(method=method, url=url), call[key]))
+
+        for counter, samples in sorted(counters.items()):
+            lines.append("# TYPE %s%s counter" % (self.PREFIX, counter))
+            lines.extend("%s%s%s %s" % (self.PREFIX, counter, labels, value)
+                         for labels, value in samples)
+
+        # The stats of the connection pool, cache, coalescer and so on
+        # are exported as gauges. Non numeric values are skipped, and so
+        # are the keys which are not valid metric names, since the
+        # textfile collector rejects the whole file for one of them.
+        for group, stats in sorted(metrics.items()):
+            if group == "calls" or not isinstance(stats, dict):
+                continue
+            if group in self.LABELLED_GAUGES:
+                lines.extend(self._format_labelled_gauge(group, stats))
+                continue
+            if not _METRIC_NAME_RE.match(group):
+                continue
+            for key, value in sorted(stats.items()):
+                value = self._gauge_value(value)
+                if value is None or not _METRIC_NAME_RE.match(key):
+                    continue
+                gauge = "%s%s_%s" % (self.PREFIX, group, key)
+                lines.append("# TYPE %s gauge" % gauge)
+                lines.append("%s%s %s" % (gauge, self._labels(), value))
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _gauge_value(value):
+        if isinstance(value, bool):
+            return int(value)
+        if isinstance(value, six.integer_types + (float,)):
+            return value
+        return None
+
+    def _format_labelled_gauge(self, group, stats):
+        name, label = self.LABELLED_GAUGES[group]
+        gauge = self.PREFIX + name
+        lines = ["# TYPE %s gauge" % gauge]
+        for key, value in sorted(stats.items()):
+            value = self._gauge_value(value)
+            if value is not None:
+                lines.append("%s%s %s" % (
+                    gauge, self._labels(**{label: key}), value))
+        return lines
+
+    def export(self, metrics):
+        tmp_path = self.file_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(self._format(metrics))
+        os.rename(tmp_path, self.file_path)
+
+
+EXPORTERS = {
+    "log": LogExporter,
+    "prometheus": PrometheusFileExporter,
+}
+
+
+def get_exporters(names, backend_name, **kwargs):
+    exporters = []
+    for name in names:
+        if name not in EXPORTERS:
+            msg = _("The REST metrics exporter %(name)s is not supported, "
+                    "the supported exporters are %(exporters)s."
+                    ) % {"name": name, "exporters": sorted(EXPORTERS)}
+            LOG.error(msg)
+            raise exception.InvalidInput(reason=msg)
+        exporters.append(EXPORTERS[name](backend_name, **kwargs))
+    return exporters
+
+
+class MetricsReporter(object):
+    """Periodically hand the metrics of a client to the exporters."""
+
+    def __init__(self, client, exporters):
+        self.client = client
+        self.exporters = exporters
+        self._timer = None
+
+    def report(self):
+        metrics = self.client.get_metrics()
+        for exporter in self.exporters:
+            try:
+                exporter.export(metrics)
+            except Exception as err:
+                LOG.warning("Export FusionStorage REST metrics with "
+                            "%(exporter)s failed. Reason: %(err)s",
+                            {"exporter": exporter.__class__.__name__,
+                             "err": err})
+
+    def start(self, interval):
+        if interval <= 0 or not self.exporters or self._timer:
+            return
+
+        self._timer = loopingcall.FixedIntervalLoopingCall(self.report)
+        self._timer.start(interval=interval, initial_delay=interval)
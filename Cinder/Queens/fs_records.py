@@ -0,0 +1,105 @@
+# Copyright (c) 2018 Huawei Technologies Co., Ltd.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+
+class Record(object):
+    """Compact read-only view of a FusionStorage inventory object.
+
+    Only the members named in __slots__ are kept from the REST payload,
+    under the same names, and the record answers get, [] and in like the
+    payload dict did. A member missing from the payload is left unset,
+    so get returns its default as with a dict.
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def from_dict(cls, info):
+        record = cls.__new__(cls)
+        for key in cls.__slots__:
+            if key in info:
+                setattr(record, key, info[key])
+        return record
+
+    @classmethod
+    def from_list(cls, infos):
+        return [cls.from_dict(info) for info in infos or []]
+
+    def get(self, key, default=None):
+        if key not in self.__slots__:
+            return default
+        return getattr(self, key, default)
+
+    def __getitem__(self, key):
+        if key not in self.__slots__ or not hasattr(self, key):
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __contains__(self, key):
+        return key in self.__slots__ and hasattr(self, key)
+
+    def keys(self):
+        return [key for key in self.__slots__ if hasattr(self, key)]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def items(self):
+        return [(key, getattr(self, key)) for key in self.keys()]
+
+    def to_dict(self):
+        return dict(self.items())
+
+    def __eq__(self, other):
+        if isinstance(other, (Record, dict)):
+            return self.to_dict() == dict(other.items())
+        return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(self.to_dict())
+
+
+class VolumeRecord(Record):
+    __slots__ = ('volName', 'volId', 'poolId', 'volSize', 'wwn', 'status')
+
+
+class SnapshotRecord(Record):
+    # /snapshot/list names the snapshot snapName, /volume/snapshot/list
+    # names it snapshotName.
+    __slots__ = ('snapName', 'snapshotName', 'snapSize', 'volName',
+                 'status')
+
+
+class HostRecord(Record):
+    __slots__ = ('hostName',)
+
+
+class InitiatorRecord(Record):
+    __slots__ = ('portName',)
+
+
+class LunMappingRecord(Record):
+    """A LUN mapped to a host, from /lun/host/list or /host/lun/list."""
+
+    __slots__ = ('hostName', 'lunName', 'lunId')
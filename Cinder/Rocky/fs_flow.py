@@ -13,15 +13,21 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
-from oslo_log import log as logging
+import sys
+import threading
 
+from oslo_log import log as logging
+from oslo_utils import excutils
+import six
 import taskflow.engines
-from taskflow.patterns import linear_flow
+from taskflow.patterns import graph_flow
 from taskflow import task
 from taskflow.types import failure
 
+from cinder import coordination
 from cinder import exception
 from cinder.i18n import _
+from cinder.volume.drivers.fusionstorage import constants
 from cinder.volume.drivers.fusionstorage import fs_utils
 
 
@@ -43,12 +49,14 @@ class CheckLunInHostTask(task.Task):
 
 
 class CreateHostCheckTask(task.Task):
-    def __init__(self, client, *args, **kwargs):
+    def __init__(self, client, check=True, *args, **kwargs):
         super(CreateHostCheckTask, self).__init__(*args, **kwargs)
         self.client = client
+        self.check = check
 
     def execute(self, host_name):
-        if not fs_utils.is_host_add_to_array(self.client, host_name):
+        if not self.check or not fs_utils.is_host_add_to_array(
+                self.client, host_name):
             LOG.info("Create a new host: %s on the array", host_name)
             self.client.create_host(host_name)
         else:
@@ -71,12 +79,13 @@ class DeleteHostWithCheck(task.Task):
 
 
 class CreateHostGroupWithCheckTask(task.Task):
-    def __init__(self, client, *args, **kwargs):
+    def __init__(self, client, check=True, *args, **kwargs):
         super(CreateHostGroupWithCheckTask, self).__init__(*args, **kwargs)
         self.client = client
+        self.check = check
 
     def execute(self, host_group_name):
-        if not fs_utils.is_hostgroup_add_to_array(
+        if not self.check or not fs_utils.is_hostgroup_add_to_array(
                 self.client, host_group_name):
             LOG.info("Create a HostGroup: %s on the array", host_group_name)
             self.client.create_hostgroup(host_group_name)
@@ -98,13 +107,14 @@ class DeleteHostGroupWithCheck(task.Task):
 
 
 class AddHostToHostGroupTask(task.Task):
-    def __init__(self, client, *args, **kwargs):
+    def __init__(self, client, check=True, *args, **kwargs):
         super(AddHostToHostGroupTask, self).__init__(*args, **kwargs)
         self.client = client
+        self.check = check
 
     def execute(self, host_name, host_group_name):
-        if not fs_utils.is_host_in_host_group(self.client, host_name,
-                                              host_group_name):
+        if not self.check or not fs_utils.is_host_in_host_group(
+                self.client, host_name, host_group_name):
             LOG.info("Add host: %(host)s to HostGroup: %(HostGroup)s",
                      {"host": host_name, "HostGroup": host_group_name})
             self.client.add_host_to_hostgroup(host_group_name, host_name)
@@ -133,12 +143,14 @@ class RemoveHostFromHostGroupWithCheck(task.Task):
 
 
 class AddInitiatorWithCheckTask(task.Task):
-    def __init__(self, client, *args, **kwargs):
+    def __init__(self, client, check=True, *args, **kwargs):
         super(AddInitiatorWithCheckTask, self).__init__(*args, **kwargs)
         self.client = client
+        self.check = check
 
     def execute(self, initiator_name):
-        if not fs_utils.is_initiator_add_to_array(self.client, initiator_name):
+        if not self.check or not fs_utils.is_initiator_add_to_array(
+                self.client, initiator_name):
             LOG.info("Create a new initiator: %s on the array", initiator_name)
             self.client.add_initiator_to_array(initiator_name)
         else:
@@ -161,12 +173,13 @@ class RemoveInitiatorWithCheck(task.Task):
 
 
 class AssociateInitiatorToHostTask(task.Task):
-    def __init__(self, client, *args, **kwargs):
+    def __init__(self, client, check=True, *args, **kwargs):
         super(AssociateInitiatorToHostTask, self).__init__(*args, **kwargs)
         self.client = client
+        self.check = check
 
     def execute(self, initiator_name, host_name):
-        if not fs_utils.is_initiator_associate_to_host(
+        if not self.check or not fs_utils.is_initiator_associate_to_host(
                 self.client, host_name, initiator_name):
             LOG.info("Associate initiator: %(initiator)s to host: %(host)s.",
                      {"initiator": initiator_name, "host": host_name})
@@ -199,39 +212,75 @@ class DeleteInitiatorFromHostWithCheck(task.Task):
         return is_initiator_in_host, initiator_list
 
 
-class MapLunToHostTask(task.Task):
+class MapLunsToHostTask(task.Task):
+    default_provides = ('mapped_vol_names', 'map_failures')
+
     def __init__(self, client, *args, **kwargs):
-        super(MapLunToHostTask, self).__init__(*args, **kwargs)
+        super(MapLunsToHostTask, self).__init__(*args, **kwargs)
         self.client = client
 
-    def execute(self, host_name, vol_name):
-        LOG.info("Map lun: %(lun)s to host %(host)s.",
-                 {"lun": vol_name, "host": host_name})
-        self.client.map_volume_to_host(host_name, vol_name)
-
-    def revert(self, result, host_name, vol_name, **kwargs):
-        LOG.warning("Revert map lun to host task.")
-        if isinstance(result, failure.Failure):
+    def execute(self, host_name, vol_names):
+        LOG.info("Map luns: %(luns)s to host %(host)s.",
+                 {"luns": vol_names, "host": host_name})
+        if len(vol_names) == 1:
+            self.client.map_volume_to_host(host_name, vol_names[0])
+            return list(vol_names), {}
+
+        map_failures = self.client.map_volumes_to_host(host_name, vol_names)
+        if len(map_failures) == len(vol_names):
+            raise map_failures[vol_names[0]]
+        for vol_name, err in map_failures.items():
+            LOG.error("Map lun: %(lun)s to host %(host)s failed. Reason: "
+                      "%(err)s", {"lun": vol_name, "host": host_name,
+                                  "err": err})
+        return ([vol_name for vol_name in vol_names
+                 if vol_name not in map_failures], map_failures)
+
+    def revert(self, result, host_name, vol_names, **kwargs):
+        LOG.warning("Revert map luns to host task.")
+        if isinstance(result, failure.Failure) or result is None:
             return
-        self.client.unmap_volume_from_host(host_name, vol_name)
+        for vol_name in result[0]:
+            self.client.unmap_volume_from_host(host_name, vol_name)
 
 
-class UnMapLunFromHostTask(task.Task):
+class UnMapLunsFromHostTask(task.Task):
+    default_provides = 'unmap_failures'
+
     def __init__(self, client, *args, **kwargs):
-        super(UnMapLunFromHostTask, self).__init__(*args, **kwargs)
+        super(UnMapLunsFromHostTask, self).__init__(*args, **kwargs)
         self.client = client
 
-    def execute(self, host_name, vol_name):
-        LOG.info("Unmap lun: %(lun)s with host %(host)s.",
-                 {"lun": vol_name, "host": host_name})
-        self.client.unmap_volume_from_host(host_name, vol_name)
+    def execute(self, host_name, vol_names):
+        LOG.info("Unmap luns: %(luns)s with host %(host)s.",
+                 {"luns": vol_names, "host": host_name})
+        if len(vol_names) == 1:
+            self.client.unmap_volume_from_host(host_name, vol_names[0])
+            return {}
 
+        unmap_failures = self.client.unmap_volumes_from_host(host_name,
+                                                             vol_names)
+        if len(unmap_failures) == len(vol_names):
+            raise unmap_failures[vol_names[0]]
+        for vol_name, err in unmap_failures.items():
+            LOG.error("Unmap lun: %(lun)s with host %(host)s failed. "
+                      "Reason: %(err)s", {"lun": vol_name, "host": host_name,
+                                          "err": err})
+        return unmap_failures
 
-class GetISCSIProperties(task.Task):
-    default_provides = 'properties'
+
+class GetISCSITargetsTask(task.Task):
+    """Choose the iSCSI portals of the host.
+
+    This may add or delete the iSCSI relation of the host on the array
+    and takes the next iSCSI manager group, so it runs under the mapping
+    lock of the host with the mapping tasks.
+    """
+
+    default_provides = ('target_ips', 'target_iqns')
 
     def __init__(self, client, iscsi_params, *args, **kwargs):
-        super(GetISCSIProperties, self).__init__(*args, **kwargs)
+        super(GetISCSITargetsTask, self).__init__(*args, **kwargs)
         self.client = client
         self.configuration = iscsi_params.get('configuration')
         self.manager_groups = iscsi_params.get('manager_groups')
@@ -240,23 +289,6 @@ class GetISCSIProperties(task.Task):
         self.support_iscsi_links_balance_by_pool = iscsi_params.get(
             "support_iscsi_links_balance_by_pool")
 
-    @staticmethod
-    def _construct_properties(multipath, target_lun, target_ips, target_iqns):
-        properties = {}
-        if multipath:
-            properties.update({
-                "target_luns": [target_lun] * len(target_ips),
-                "target_iqns": target_iqns,
-                "target_portals": target_ips,
-            })
-        else:
-            properties.update({
-                "target_lun": target_lun,
-                "target_iqn": target_iqns[0],
-                "target_portal": target_ips[0],
-            })
-        return properties
-
     @staticmethod
     def _get_iscsi_info_from_iscsi_links(iscsi_links_info):
         iscsi_ips = []
@@ -355,23 +387,110 @@ class GetISCSIProperties(task.Task):
             iscsi_links_result.get("iscsiLinks", []))
         return target_ips_format, target_iqns
 
-    def execute(self, host_name, vol_name, multipath):
-        LOG.info("Get ISCSI initialize connection properties.")
-        target_lun = fs_utils.get_target_lun(self.client, host_name, vol_name)
-
+    def execute(self, host_name):
+        LOG.info("Get ISCSI target info of host %s.", host_name)
         if self.configuration.iscsi_manager_groups:
-            target_ips, target_iqns = self._find_iscsi_ips(host_name)
+            return self._find_iscsi_ips(host_name)
         elif self.configuration.target_ips:
-            target_ips, target_iqns = self._find_target_ips()
+            return self._find_target_ips()
         elif self.pool_name and self.support_iscsi_links_balance_by_pool:
-            target_ips, target_iqns = self._find_iscsi_ips_from_storage_pool(
+            return self._find_iscsi_ips_from_storage_pool(
                 host_name, self.pool_name)
+        return self._find_iscsi_ips_from_storage(host_name)
+
+
+class GetISCSIProperties(task.Task):
+    """Build the connection properties of the volumes.
+
+    This only reads the LUN ids of the host and runs outside of its
+    mapping lock.
+    """
+
+    default_provides = 'properties'
+
+    def __init__(self, client, *args, **kwargs):
+        super(GetISCSIProperties, self).__init__(*args, **kwargs)
+        self.client = client
+
+    @staticmethod
+    def _construct_properties(multipath, target_lun, target_ips, target_iqns):
+        properties = {}
+        if multipath:
+            properties.update({
+                "target_luns": [target_lun] * len(target_ips),
+                "target_iqns": target_iqns,
+                "target_portals": target_ips,
+            })
         else:
-            target_ips, target_iqns = self._find_iscsi_ips_from_storage(
-                host_name)
+            properties.update({
+                "target_lun": target_lun,
+                "target_iqn": target_iqns[0],
+                "target_portal": target_ips[0],
+            })
+        return properties
 
-        return self._construct_properties(multipath, target_lun,
-                                          target_ips, target_iqns)
+    def _get_target_luns(self, host_name, vol_names, target_luns):
+        target_luns = dict(target_luns)
+        if len(vol_names) == 1 and vol_names[0] not in target_luns:
+            target_luns[vol_names[0]] = fs_utils.get_target_lun(
+                self.client, host_name, vol_names[0])
+        elif any(vol_name not in target_luns for vol_name in vol_names):
+            # One listing of the host LUNs serves all the volumes.
+            for hostlun in self.client.get_host_lun(host_name):
+                target_luns.setdefault(hostlun.get("lunName"),
+                                       hostlun.get("lunId"))
+        return target_luns
+
+    def execute(self, host_name, multipath, target_luns, mapped_vol_names,
+                target_ips, target_iqns):
+        LOG.info("Get ISCSI initialize connection properties.")
+        vol_names = list(target_luns) + [
+            vol_name for vol_name in mapped_vol_names
+            if vol_name not in target_luns]
+        target_luns = self._get_target_luns(host_name, vol_names,
+                                            target_luns)
+
+        return dict((vol_name, self._construct_properties(
+            multipath, target_luns.get(vol_name), target_ips, target_iqns))
+            for vol_name in vol_names)
+
+
+# The tasks that each mapping task follows when they are in the same flow,
+# the others run in parallel.
+_MAPPING_DEPENDENCIES = (
+    (AddHostToHostGroupTask, (CreateHostCheckTask,
+                              CreateHostGroupWithCheckTask)),
+    (AssociateInitiatorToHostTask, (CreateHostCheckTask,
+                                    AddInitiatorWithCheckTask)),
+    (MapLunsToHostTask, (CreateHostCheckTask,)),
+)
+
+
+def _link_mapping_tasks(work_flow, tasks):
+    tasks_by_type = dict((type(t), t) for t in tasks)
+    for task_type, required_types in _MAPPING_DEPENDENCIES:
+        for required_type in required_types:
+            if task_type in tasks_by_type and required_type in tasks_by_type:
+                work_flow.link(tasks_by_type[required_type],
+                               tasks_by_type[task_type])
+
+
+def _load_engine(work_flow, store_spec, executor):
+    if executor is None:
+        return taskflow.engines.load(work_flow, store=store_spec)
+    return taskflow.engines.load(work_flow, store=store_spec,
+                                 engine='parallel', executor=executor)
+
+
+def _run_mapping_flow(client, engine):
+    try:
+        engine.run()
+    except Exception:
+        # The topology index may be wrong about what the array has, such
+        # as a host deleted outside of the driver, list the array again
+        # next time.
+        client.topology.invalidate()
+        raise
 
 
 def get_iscsi_required_params(vol_name, connector, client=None):
@@ -407,55 +526,209 @@ def get_iscsi_required_params(vol_name, connector, client=None):
     return vol_name, host_name, host_group_name, initiator_name, multipath
 
 
-def initialize_iscsi_connection(client, vol_name, connector, iscsi_params):
-    (vol_name, host_name, host_group_name, initiator_name,
-     multipath) = get_iscsi_required_params(vol_name, connector)
-
-    store_spec = {'vol_name': vol_name,
-                  'host_name': host_name,
-                  'host_group_name': host_group_name,
-                  'initiator_name': initiator_name,
-                  'multipath': multipath,
-                  'connector_host_name': connector.get("host")}
-    work_flow = linear_flow.Flow('initialize_iscsi_connection')
-
-    if fs_utils.is_volume_associate_to_host(client, vol_name, host_name):
-        LOG.info("Volume: %(vol)s has associated to the host: %(host)s",
-                 {"vol": vol_name, "host": host_name})
+def plan_iscsi_mapping(client, host_name, host_group_name, initiator_name):
+    """Return the tasks mapping volumes to the host that the array needs.
+
+    The hosts, host groups and initiators of the array are read once, from
+    the topology index when it is enabled, and the members of the host
+    and of its host group only when they exist. The returned tasks change
+    the array without checking it again.
+    """
+    tasks = []
+    host_exists = fs_utils.is_host_add_to_array(client, host_name)
+    if not host_exists:
+        tasks.append(CreateHostCheckTask(client, check=False))
+
+    host_in_group = False
+    if not fs_utils.is_hostgroup_add_to_array(client, host_group_name):
+        tasks.append(CreateHostGroupWithCheckTask(client, check=False))
+    elif host_exists:
+        host_in_group = fs_utils.is_host_in_host_group(
+            client, host_name, host_group_name)
+    if not host_in_group:
+        tasks.append(AddHostToHostGroupTask(client, check=False))
+
+    initiator_in_host = False
+    if not fs_utils.is_initiator_add_to_array(client, initiator_name):
+        tasks.append(AddInitiatorWithCheckTask(client, check=False))
+    elif host_exists:
+        initiator_in_host = fs_utils.is_initiator_associate_to_host(
+            client, host_name, initiator_name)
+    if not initiator_in_host:
+        tasks.append(AssociateInitiatorToHostTask(client, check=False))
+
+    tasks.append(MapLunsToHostTask(client))
+    LOG.info("Planned mapping of host %(host)s: %(tasks)s",
+             {"host": host_name, "tasks": [t.name for t in tasks]})
+    return tasks
+
+
+def _get_mapped_luns(client, vol_names, host_name):
+    """Return the LUN ids of the volumes already mapped to the host."""
+    if len(vol_names) == 1:
+        target_lun = fs_utils.is_volume_associate_to_host(
+            client, vol_names[0], host_name)
+        return {} if target_lun is None else {vol_names[0]: target_lun}
+
+    if not fs_utils.is_host_add_to_array(client, host_name):
+        return {}
+    return dict((hostlun.get("lunName"), hostlun.get("lunId"))
+                for hostlun in client.get_host_lun(host_name)
+                if hostlun.get("lunName") in vol_names)
+
+
+def _run_iscsi_mapping(client, vol_names, host_name, host_group_name,
+                       initiator_name, iscsi_params):
+    target_luns = _get_mapped_luns(client, vol_names, host_name)
+    if target_luns:
+        LOG.info("Volumes: %(vols)s have associated to the host: %(host)s",
+                 {"vols": list(target_luns), "host": host_name})
+
+    unmapped_vol_names = [vol_name for vol_name in vol_names
+                          if vol_name not in target_luns]
+    store_spec = {'host_name': host_name}
+    work_flow = graph_flow.Flow('map_iscsi_volumes')
+    targets_task = GetISCSITargetsTask(client, iscsi_params)
+    work_flow.add(targets_task)
+    if unmapped_vol_names:
+        store_spec.update({'host_group_name': host_group_name,
+                           'initiator_name': initiator_name,
+                           'vol_names': unmapped_vol_names})
+        tasks = plan_iscsi_mapping(
+            client, host_name, host_group_name, initiator_name)
+        work_flow.add(*tasks)
+        _link_mapping_tasks(work_flow, tasks)
+        # The iSCSI relation is added to the host once it is set up.
+        for mapping_task in tasks:
+            work_flow.link(mapping_task, targets_task)
+
+    engine = _load_engine(work_flow, store_spec,
+                          iscsi_params.get('flow_executor'))
+    _run_mapping_flow(client, engine)
+    return target_luns, unmapped_vol_names, engine
+
+
+def map_iscsi_volumes(client, vol_names, connector, iscsi_params):
+    """Map the volumes to the host of the connector.
+
+    The host, its host group and its initiator are created on the way
+    when missing, and the iSCSI portals of the host are chosen. This
+    changes the topology of the host and runs under its mapping lock,
+    the result is what get_iscsi_properties needs.
+    """
+    (_, host_name, host_group_name, initiator_name,
+     multipath) = get_iscsi_required_params(vol_names, connector)
+
+    # A plan made from the topology index may be out of date, such as
+    # when another service deleted the host meanwhile. It is made again
+    # once from a fresh listing of the array before giving up.
+    planned_from_index = (client.topology.enabled and
+                          client.topology.is_fresh())
+    try:
+        target_luns, unmapped_vol_names, engine = _run_iscsi_mapping(
+            client, vol_names, host_name, host_group_name, initiator_name,
+            iscsi_params)
+    except Exception as err:
+        if not planned_from_index:
+            raise
+        LOG.warning("Map volumes %(vols)s to host %(host)s failed, plan "
+                    "it again from the array. Reason: %(err)s",
+                    {"vols": vol_names, "host": host_name, "err": err})
+        client.topology.invalidate()
+        target_luns, unmapped_vol_names, engine = _run_iscsi_mapping(
+            client, vol_names, host_name, host_group_name, initiator_name,
+            iscsi_params)
+
+    mapping = {'host_name': host_name,
+               'multipath': multipath,
+               'target_luns': target_luns,
+               'target_ips': engine.storage.fetch('target_ips'),
+               'target_iqns': engine.storage.fetch('target_iqns'),
+               'mapped_vol_names': [],
+               'map_failures': {}}
+    if unmapped_vol_names:
+        mapping['mapped_vol_names'] = engine.storage.fetch('mapped_vol_names')
+        mapping['map_failures'] = engine.storage.fetch('map_failures')
+    return mapping
+
+
+def _revert_mapping(client, mapping, lock_name):
+    def _unmap():
+        LOG.warning("Revert the mapping of luns: %(luns)s to host "
+                    "%(host)s.", {"luns": mapping['mapped_vol_names'],
+                                  "host": mapping['host_name']})
+        for vol_name in mapping['mapped_vol_names']:
+            client.unmap_volume_from_host(mapping['host_name'], vol_name)
+
+    @coordination.synchronized('{lock_name}')
+    def _unmap_locked(lock_name):
+        _unmap()
+
+    if lock_name is None:
+        _unmap()
     else:
-        work_flow.add(
-            CreateHostCheckTask(client),
-            CreateHostGroupWithCheckTask(client),
-            AddHostToHostGroupTask(client),
-            AddInitiatorWithCheckTask(client),
-            AssociateInitiatorToHostTask(client),
-            MapLunToHostTask(client)
-        )
+        _unmap_locked(lock_name)
+
+
+def get_iscsi_properties(client, mapping, lock_name=None):
+    """Return the connection properties of the volumes of the mapping.
+
+    This only reads the LUN ids of the host and runs outside of its
+    mapping lock. The volumes mapped by map_iscsi_volumes are unmapped again,
+    under lock_name, when it fails. A volume which could not be mapped
+    gets the exception raised for it instead of properties.
+    """
+    store_spec = dict((key, mapping[key]) for key in (
+        'host_name', 'multipath', 'target_luns', 'mapped_vol_names',
+        'target_ips', 'target_iqns'))
+    work_flow = graph_flow.Flow('get_iscsi_properties')
+    work_flow.add(GetISCSIProperties(client))
+    engine = taskflow.engines.load(work_flow, store=store_spec)
+    try:
+        engine.run()
+    except Exception:
+        with excutils.save_and_reraise_exception():
+            _revert_mapping(client, mapping, lock_name)
 
-    work_flow.add(
-        GetISCSIProperties(client, iscsi_params)
-    )
+    results = dict(mapping['map_failures'])
+    results.update(engine.storage.fetch('properties'))
+    return results
 
-    engine = taskflow.engines.load(work_flow, store=store_spec)
-    engine.run()
-    return engine.storage.fetch('properties')
 
+def initialize_iscsi_connections(client, vol_names, connector, iscsi_params):
+    """Attach the volumes to the host of the connector together."""
+    mapping = map_iscsi_volumes(client, vol_names, connector, iscsi_params)
+    return get_iscsi_properties(client, mapping)
 
-def terminate_iscsi_connection(client, vol_name, connector):
-    (vol_name, host_name, host_group_name,
-     _, _) = get_iscsi_required_params(vol_name, connector, client)
 
-    store_spec = {'vol_name': vol_name,
-                  'host_name': host_name,
+def initialize_iscsi_connection(client, vol_name, connector, iscsi_params):
+    result = initialize_iscsi_connections(
+        client, [vol_name], connector, iscsi_params)[vol_name]
+    if isinstance(result, Exception):
+        raise result
+    return result
+
+
+def _terminate_iscsi_connections(client, vol_names, host_name,
+                                 host_group_name, flow_executor):
+    results = dict.fromkeys(vol_names)
+    store_spec = {'host_name': host_name,
                   'host_group_name': host_group_name}
-    work_flow = linear_flow.Flow('terminate_iscsi_connection')
+    # The order of the tasks follows from the values they provide and
+    # require, the unmapping goes first.
+    work_flow = graph_flow.Flow('terminate_iscsi_connection')
     if host_name and fs_utils.is_host_add_to_array(client, host_name):
-        if fs_utils.is_volume_associate_to_host(client, vol_name, host_name):
-            work_flow.add(
-                UnMapLunFromHostTask(client)
-            )
+        check_task = CheckLunInHostTask(client)
+        mapped_vol_names = list(_get_mapped_luns(client, vol_names,
+                                                 host_name))
+        if mapped_vol_names:
+            store_spec['vol_names'] = mapped_vol_names
+            unmap_task = UnMapLunsFromHostTask(client)
+            work_flow.add(unmap_task, check_task)
+            work_flow.link(unmap_task, check_task)
+        else:
+            work_flow.add(check_task)
         work_flow.add(
-            CheckLunInHostTask(client),
             DeleteInitiatorFromHostWithCheck(client),
             RemoveInitiatorWithCheck(client),
             RemoveHostFromHostGroupWithCheck(client),
@@ -463,5 +736,142 @@ def terminate_iscsi_connection(client, vol_name, connector):
             DeleteHostGroupWithCheck(client)
         )
 
-        engine = taskflow.engines.load(work_flow, store=store_spec)
-        engine.run()
+        engine = _load_engine(work_flow, store_spec, flow_executor)
+        _run_mapping_flow(client, engine)
+        if mapped_vol_names:
+            results.update(engine.storage.fetch('unmap_failures'))
+    return results
+
+
+def terminate_iscsi_connection(client, vol_name, connector,
+                               flow_executor=None):
+    (vol_name, host_name, host_group_name,
+     _, _) = get_iscsi_required_params(vol_name, connector, client)
+    result = _terminate_iscsi_connections(
+        client, [vol_name], host_name, host_group_name,
+        flow_executor)[vol_name]
+    if isinstance(result, Exception):
+        raise result
+
+
+def terminate_iscsi_connections(client, vol_names, connector,
+                                flow_executor=None):
+    """Detach the volumes from the host of the connector together.
+
+    Return None for each volume detached, or the exception raised for it
+    when only some of the volumes could not be unmapped.
+    """
+    if "host" not in connector:
+        # The host of each volume is found from its mappings.
+        results = {}
+        for vol_name in vol_names:
+            try:
+                terminate_iscsi_connection(client, vol_name, connector,
+                                           flow_executor)
+                results[vol_name] = None
+            except Exception as err:
+                results[vol_name] = err
+        return results
+
+    (_, host_name, host_group_name,
+     _, _) = get_iscsi_required_params(vol_names, connector)
+    return _terminate_iscsi_connections(
+        client, vol_names, host_name, host_group_name, flow_executor)
+
+
+class _HostBatch(object):
+    def __init__(self, key):
+        self.key = key
+        self.event = threading.Event()
+        self.items = []
+        self.results = {}
+        self.exc_info = None
+        self.started = False
+
+
+class HostWorkQueue(object):
+    """Attaches and detaches of each host, run in order and in batches.
+
+    The requests of a host run one batch at a time, in the order they
+    arrive. A request joins the last batch of its host when that has the
+    same key and has not started yet, so that the requests queued behind
+    a running batch are combined. The first request of a batch runs it
+    once the batches before it are done: run_locked changes the topology
+    of the host holding its mapping lock, then the next batch may start
+    while run_unlocked completes this one with reads of the array only,
+    such as of the LUN ids. Both return the result of each item, or the
+    exception raised for it.
+    """
+
+    def __init__(self, max_items=constants.REST_BATCH_MAX_ITEMS):
+        self._cond = threading.Condition()
+        self._queues = {}
+        self.max_items = max_items
+        self.batches = 0
+        self.items = 0
+
+    def submit(self, host, key, lock_name, item, run_locked,
+               run_unlocked=None):
+        with self._cond:
+            self.items += 1
+            queue = self._queues.setdefault(host, [])
+            batch = queue[-1] if queue else None
+            if (batch is None or batch.started or batch.key != key or
+                    len(batch.items) >= self.max_items):
+                batch = _HostBatch(key)
+                queue.append(batch)
+                self.batches += 1
+                is_leader = True
+            else:
+                is_leader = False
+            if item not in batch.items:
+                batch.items.append(item)
+
+        if is_leader:
+            self._run(host, lock_name, batch, run_locked, run_unlocked)
+        else:
+            batch.event.wait()
+
+        if batch.exc_info:
+            six.reraise(*batch.exc_info)
+        result = batch.results[item]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def _run(self, host, lock_name, batch, run_locked, run_unlocked):
+        @coordination.synchronized('{lock_name}')
+        def _run_locked(lock_name):
+            LOG.info("Run the batch of %(count)s requests %(key)s of host "
+                     "%(host)s.", {"count": len(batch.items),
+                                   "key": batch.key, "host": host})
+            return run_locked(list(batch.items))
+
+        with self._cond:
+            while self._queues[host][0] is not batch:
+                self._cond.wait()
+            batch.started = True
+
+        try:
+            try:
+                results = _run_locked(lock_name)
+            finally:
+                with self._cond:
+                    queue = self._queues[host]
+                    queue.pop(0)
+                    if not queue:
+                        del self._queues[host]
+                    self._cond.notify_all()
+            if run_unlocked is not None:
+                results = run_unlocked(results)
+            batch.results = results
+        except Exception:
+            batch.exc_info = sys.exc_info()
+        finally:
+            batch.event.set()
+
+    def to_dict(self):
+        with self._cond:
+            return {"batches": self.batches,
+                    "items": self.items,
+                    "hosts": len(self._queues)}
@@ -97,11 +97,17 @@ class FusionStorageConf(object):
             san_ip = self.configuration.safe_get(constants.CONF_IP)
             san_port = self.configuration.safe_get(constants.CONF_PORT)
             if san_ip and san_port:
-                address = "https://" + san_ip + ":" + san_port
+                address = ";".join("https://" + ip.strip() + ":" + san_port
+                                   for ip in san_ip.split(';') if ip.strip())
         mess = (constants.CONF_ADDRESS + ' or ' + constants.CONF_IP + ' or ' +
                 constants.CONF_PORT)
         self._assert_text_result(address, mess=mess)
-        setattr(self.configuration, 'san_address', address)
+        addresses = []
+        for addr in address.split(';'):
+            if addr.strip() and addr.strip() not in addresses:
+                addresses.append(addr.strip())
+        self._assert_text_result(addresses, mess=mess)
+        setattr(self.configuration, 'san_address', addresses)
 
     def _decode_text(self, text):
         return (base64.b64decode(six.b(text[4:])).decode() if
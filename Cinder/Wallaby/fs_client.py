@@ -13,39 +13,1185 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import collections
+import contextlib
+import functools
 import json
+import random
+import sys
+import threading
+import time
 
+import futurist
 import requests
 import six
 from oslo_log import log as logging
+from oslo_service import loopingcall
 from requests.adapters import HTTPAdapter
+from requests.packages.urllib3 import connectionpool
 
 from cinder import exception
 from cinder.i18n import _
 from cinder.volume.drivers.fusionstorage import constants
+from cinder.volume.drivers.fusionstorage import fs_json
+from cinder.volume.drivers.fusionstorage import fs_metrics
+from cinder.volume.drivers.fusionstorage import fs_records
 
 LOG = logging.getLogger(__name__)
 
+_deadline_local = threading.local()
+
+
+@contextlib.contextmanager
+def operation_deadline(timeout):
+    """Bound all REST calls made inside the block by an overall deadline.
+
+    Nested deadlines can only shorten the deadline of the outer block.
+    """
+    if not timeout or timeout <= 0:
+        yield
+        return
+
+    outer = getattr(_deadline_local, "deadline", None)
+    deadline = time.time() + timeout
+    if outer is not None:
+        deadline = min(deadline, outer)
+    _deadline_local.deadline = deadline
+    try:
+        yield
+    finally:
+        _deadline_local.deadline = outer
+
+
+def get_remaining_time():
+    deadline = getattr(_deadline_local, "deadline", None)
+    if deadline is None:
+        return None
+    return deadline - time.time()
+
+
+def _run_with_deadline(deadline, func, *args, **kwargs):
+    # The deadline is thread local, carry it over to helper threads.
+    _deadline_local.deadline = deadline
+    try:
+        return func(*args, **kwargs)
+    finally:
+        _deadline_local.deadline = None
+
+
+class DeadlineThreadPoolExecutor(futurist.ThreadPoolExecutor):
+    """Thread pool whose work runs within the deadline of its submitter."""
+
+    def submit(self, fn, *args, **kwargs):
+        deadline = getattr(_deadline_local, "deadline", None)
+        return super(DeadlineThreadPoolExecutor, self).submit(
+            _run_with_deadline, deadline, fn, *args, **kwargs)
+
+
+def _get_connect_error():
+    # The code is the one of an HTTP 403, connect_error tells them apart.
+    return {"error": {
+        "code": constants.CONNECT_ERROR,
+        "description": "Connect to server error.",
+        "connect_error": True}}
+
+
+def _get_deadline_error():
+    return {"error": {
+        "code": constants.DEADLINE_EXCEEDED_ERROR,
+        "description": "The deadline of the operation is exceeded."}}
+
+
+class ConnectionPoolStats(object):
+    """Usage counters shared by all connection pools of one RestCommon."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.new_connections = 0
+        self.waits = 0
+        self.expired = 0
+
+    def incr(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def to_dict(self):
+        with self._lock:
+            return {"hits": self.hits,
+                    "new_connections": self.new_connections,
+                    "waits": self.waits,
+                    "expired": self.expired}
+
+
+class _ConnectionPoolMixin(object):
+    """Count connection reuse and drop connections idle for too long."""
+
+    def __init__(self, *args, **kwargs):
+        self.pool_stats = kwargs.pop("pool_stats")
+        self.idle_timeout = kwargs.pop("idle_timeout", 0)
+        super(_ConnectionPoolMixin, self).__init__(*args, **kwargs)
+
+    def _new_conn(self):
+        self.pool_stats.incr("new_connections")
+        return super(_ConnectionPoolMixin, self)._new_conn()
+
+    def _get_conn(self, timeout=None):
+        if self.block and self.pool is not None and self.pool.empty():
+            self.pool_stats.incr("waits")
+
+        conn = super(_ConnectionPoolMixin, self)._get_conn(timeout)
+        released_at = getattr(conn, "fs_released_at", None)
+        if released_at is None:
+            return conn
+
+        conn.fs_released_at = None
+        if self.idle_timeout and (
+                time.time() - released_at > self.idle_timeout):
+            conn.close()
+            self.pool_stats.incr("expired")
+        else:
+            self.pool_stats.incr("hits")
+        return conn
+
+    def _put_conn(self, conn):
+        if conn is not None:
+            conn.fs_released_at = time.time()
+        super(_ConnectionPoolMixin, self)._put_conn(conn)
+
+    def prewarm(self, count):
+        conns = []
+        try:
+            for __ in range(min(count, self.pool.maxsize)):
+                conns.append(self._get_conn())
+            for conn in conns:
+                if getattr(conn, "sock", None) is None:
+                    conn.connect()
+        finally:
+            for conn in conns:
+                self._put_conn(conn)
+
+
+class FusionStorageHTTPConnectionPool(_ConnectionPoolMixin,
+                                      connectionpool.HTTPConnectionPool):
+    pass
+
+
+class FusionStorageHTTPSConnectionPool(_ConnectionPoolMixin,
+                                       connectionpool.HTTPSConnectionPool):
+    pass
+
 
 class HostNameIgnoringAdapter(HTTPAdapter):
+    def __init__(self, pool_stats=None, idle_timeout=0, **kwargs):
+        # init_poolmanager() is called from the parent constructor.
+        self.pool_stats = pool_stats or ConnectionPoolStats()
+        self.idle_timeout = idle_timeout
+        super(HostNameIgnoringAdapter, self).__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super(HostNameIgnoringAdapter, self).init_poolmanager(*args, **kwargs)
+        pool_kw = {"pool_stats": self.pool_stats,
+                   "idle_timeout": self.idle_timeout}
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": functools.partial(FusionStorageHTTPConnectionPool,
+                                      **pool_kw),
+            "https": functools.partial(FusionStorageHTTPSConnectionPool,
+                                       **pool_kw),
+        }
+
     def cert_verify(self, conn, url, verify, cert):
         conn.assert_hostname = False
         return super(HostNameIgnoringAdapter, self).cert_verify(
             conn, url, verify, cert)
 
+    def prewarm(self, count):
+        pools = self.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if not isinstance(pool, _ConnectionPoolMixin):
+                continue
+            # An unreachable endpoint does not keep the others cold.
+            try:
+                pool.prewarm(count)
+            except Exception as err:
+                LOG.warning("Pre-warm connections to %(host)s:%(port)s "
+                            "failed. Reason: %(err)s",
+                            {"host": pool.host, "port": pool.port,
+                             "err": err})
+
+
+class RestEndpoint(object):
+    """Latency and health bookkeeping of one FSM management address."""
+
+    def __init__(self, address):
+        self.address = address
+        self.latency = None
+        self.inflight = 0
+        self.failures = 0
+        self.down_since = None
+
+    def score(self):
+        # Endpoints without samples are tried first so that they get one.
+        return (self.latency or 0.0) * (self.inflight + 1)
+
+    def is_available(self):
+        return (self.down_since is None or time.time() - self.down_since >=
+                constants.ENDPOINT_RETRY_INTERVAL)
+
+
+class RestEndpointGroup(object):
+    """Choose the management address every REST call is sent to.
+
+    Read-only calls go to the available endpoint with the lowest EWMA
+    latency weighted by its in-flight calls. Mutating calls stay on the
+    active endpoint, which is replaced by a standby once it has failed
+    failure_threshold times in a row.
+    """
+
+    def __init__(self, addresses, failure_threshold):
+        self._lock = threading.Lock()
+        self.failure_threshold = failure_threshold
+        self.endpoints = [RestEndpoint(address) for address in addresses]
+        self.active = self.endpoints[0]
+
+    def select(self, read_only):
+        with self._lock:
+            available = ([ep for ep in self.endpoints if ep.is_available()]
+                         or list(self.endpoints))
+            if read_only:
+                return sorted(available, key=lambda ep: ep.score())
+
+            if self.active not in available:
+                self._failover(available)
+            return [self.active]
+
+    def _failover(self, available):
+        standby = min(available, key=lambda ep: ep.score())
+        LOG.warning("Switch FusionStorage management address from %(old)s "
+                    "to %(new)s.", {"old": self.active.address,
+                                    "new": standby.address})
+        self.active = standby
+
+    def begin(self, endpoint):
+        with self._lock:
+            endpoint.inflight += 1
+
+    def release(self, endpoint):
+        with self._lock:
+            endpoint.inflight -= 1
+
+    def finish(self, endpoint, elapsed=None, success=True):
+        with self._lock:
+            endpoint.inflight -= 1
+            if success:
+                endpoint.failures = 0
+                endpoint.down_since = None
+                alpha = constants.ENDPOINT_LATENCY_EWMA_ALPHA
+                endpoint.latency = (
+                    elapsed if endpoint.latency is None else
+                    alpha * elapsed + (1 - alpha) * endpoint.latency)
+                return
+
+            endpoint.failures += 1
+            if endpoint.failures >= self.failure_threshold:
+                if endpoint.down_since is None:
+                    LOG.error("FusionStorage management address %s is "
+                              "unavailable.", endpoint.address)
+                endpoint.down_since = time.time()
+                others = [ep for ep in self.endpoints
+                          if ep is not endpoint and ep.is_available()]
+                if endpoint is self.active and others:
+                    self._failover(others)
+
+    def to_dict(self):
+        with self._lock:
+            return [{"address": ep.address,
+                     "active": ep is self.active,
+                     "latency": ep.latency,
+                     "failures": ep.failures,
+                     "available": ep.is_available()}
+                    for ep in self.endpoints]
+
+
+class RestCache(object):
+    """Read-through cache of slowly changing FusionStorage query results.
+
+    Entries are keyed by method, URL and request body and expire after the
+    TTL configured for their URL path. Mutating calls bump the generation
+    of the paths they affect, which drops the cached entries and keeps
+    queries started before the change from storing their stale result.
+    Cached results are shared between callers and must not be modified.
+    """
+
+    def __init__(self, ttls):
+        self._lock = threading.Lock()
+        self._ttls = ttls
+        self._entries = {}
+        self._generations = {}
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def is_cacheable(self, path):
+        return self._ttls.get(path, 0) > 0
+
+    @staticmethod
+    def make_key(method, url, data, get_version=False,
+                 get_system_time=False):
+        # The flags pick the URL prefix, so the same url may be another
+        # API with another response.
+        return (method.upper(), url, json.dumps(data, sort_keys=True),
+                bool(get_version), bool(get_system_time))
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[1] > time.time():
+                self.hits += 1
+                return entry[2], None
+
+            self._entries.pop(key, None)
+            self.misses += 1
+            return None, self._generations.get(key[1].split("?")[0], 0)
+
+    def put(self, key, generation, result):
+        path = key[1].split("?")[0]
+        with self._lock:
+            if self._generations.get(path, 0) != generation:
+                return
+            self._entries[key] = (path, time.time() + self._ttls[path],
+                                  result)
+
+    def invalidate(self, paths):
+        with self._lock:
+            for path in paths:
+                self._generations[path] = self._generations.get(path, 0) + 1
+            stale = [key for key, entry in self._entries.items()
+                     if entry[0] in paths]
+            for key in stale:
+                del self._entries[key]
+            self.invalidations += len(stale)
+
+    def to_dict(self):
+        with self._lock:
+            return {"hits": self.hits,
+                    "misses": self.misses,
+                    "invalidations": self.invalidations,
+                    "entries": len(self._entries)}
+
+
+class _InflightCall(object):
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.exc_info = None
+
+
+class RequestCoalescer(object):
+    """Share one round trip between identical concurrent queries.
+
+    The first caller of a key sends the request, later callers arriving
+    while it is in flight wait for it and get the same parsed result.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self.requests = 0
+        self.coalesced = 0
+
+    def run(self, key, func):
+        with self._lock:
+            inflight = self._inflight.get(key)
+            if inflight is None:
+                inflight = self._inflight[key] = _InflightCall()
+                self.requests += 1
+                is_leader = True
+            else:
+                self.coalesced += 1
+                is_leader = False
+
+        if not is_leader:
+            if not inflight.event.wait(get_remaining_time()):
+                return _get_deadline_error()
+            if inflight.exc_info:
+                six.reraise(*inflight.exc_info)
+            return inflight.result
+
+        try:
+            inflight.result = func()
+        except Exception:
+            inflight.exc_info = sys.exc_info()
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            inflight.event.set()
+        return inflight.result
+
+    def to_dict(self):
+        with self._lock:
+            return {"requests": self.requests,
+                    "coalesced": self.coalesced}
+
+
+class AdaptiveTimeout(object):
+    """Learn the timeout of each URL template from its recent latencies.
+
+    The timeout is a multiple of a percentile of the last window
+    latencies, bounded by floor and ceiling. Until min_samples latencies
+    are known the timeout given by the caller is used.
+    """
+
+    def __init__(self, enabled=True,
+                 percentile=constants.ADAPTIVE_TIMEOUT_PERCENTILE,
+                 multiplier=constants.ADAPTIVE_TIMEOUT_MULTIPLIER,
+                 floor=constants.ADAPTIVE_TIMEOUT_FLOOR,
+                 ceiling=constants.DEFAULT_TIMEOUT,
+                 window=constants.ADAPTIVE_TIMEOUT_WINDOW,
+                 min_samples=constants.ADAPTIVE_TIMEOUT_MIN_SAMPLES):
+        self._lock = threading.Lock()
+        self._samples = {}
+        self.enabled = enabled
+        self.percentile = percentile
+        self.multiplier = multiplier
+        self.floor = floor
+        self.ceiling = ceiling
+        self.window = window
+        self.min_samples = min_samples
+
+    def observe(self, url, elapsed):
+        if not self.enabled:
+            return
+        template = url.split("?")[0]
+        with self._lock:
+            samples = self._samples.get(template)
+            if samples is None:
+                samples = self._samples[template] = collections.deque(
+                    maxlen=self.window)
+            samples.append(elapsed)
+
+    def get_timeout(self, url, default):
+        if not self.enabled:
+            return default
+        with self._lock:
+            samples = self._samples.get(url.split("?")[0])
+            if not samples or len(samples) < self.min_samples:
+                return default
+            samples = sorted(samples)
+
+        index = min(len(samples) - 1,
+                    int(len(samples) * self.percentile / 100.0))
+        timeout = samples[index] * self.multiplier
+        return min(default, max(self.floor, min(self.ceiling, timeout)))
+
+    def to_dict(self):
+        with self._lock:
+            templates = list(self._samples)
+        return dict((template, self.get_timeout(template, self.ceiling))
+                    for template in templates)
+
+
+class _Batch(object):
+    def __init__(self):
+        self.items = []
+        self.event = threading.Event()
+        self.result = None
+        self.exc_info = None
+
+
+class RequestBatcher(object):
+    """Merge compatible single item calls into one multi item request.
+
+    The first caller of a key waits for window seconds, collecting the
+    items of the callers arriving meanwhile, then sends one request for
+    all of them. Every caller gets the shared result together with the
+    items of the batch. A window of 0 disables batching.
+    """
+
+    def __init__(self, window=0, max_items=constants.REST_BATCH_MAX_ITEMS):
+        self._lock = threading.Lock()
+        self._batches = {}
+        self.window = window
+        self.max_items = max_items
+        self.requests = 0
+        self.items = 0
+
+    def submit(self, key, item, send):
+        if self.window <= 0:
+            with self._lock:
+                self.requests += 1
+                self.items += 1
+            return send([item]), [item]
+
+        with self._lock:
+            self.items += 1
+            batch = self._batches.get(key)
+            if batch is None or len(batch.items) >= self.max_items:
+                batch = self._batches[key] = _Batch()
+                self.requests += 1
+                is_leader = True
+            else:
+                is_leader = False
+            if item not in batch.items:
+                batch.items.append(item)
+
+        if not is_leader:
+            batch.event.wait()
+            if batch.exc_info:
+                six.reraise(*batch.exc_info)
+            return batch.result, batch.items
+
+        time.sleep(self.window)
+        with self._lock:
+            if self._batches.get(key) is batch:
+                del self._batches[key]
+
+        try:
+            batch.result = send(list(batch.items))
+        except Exception:
+            batch.exc_info = sys.exc_info()
+            raise
+        finally:
+            batch.event.set()
+        return batch.result, batch.items
+
+    def to_dict(self):
+        with self._lock:
+            return {"requests": self.requests,
+                    "items": self.items}
+
+
+class RetryPolicy(object):
+    """Decide whether and when a failed REST call is sent again.
+
+    Error codes meaning the array rejected the request without running it
+    are retried for every call, while connection and gateway errors are
+    only retried for idempotent calls. Intervals grow exponentially up to
+    max_interval with full jitter, and no attempt starts after the
+    deadline of the call.
+    """
+
+    def __init__(self, max_attempts=constants.REST_RETRY_MAX_ATTEMPTS,
+                 base_interval=constants.REST_RETRY_BASE_INTERVAL,
+                 max_interval=constants.REST_RETRY_MAX_INTERVAL,
+                 deadline=constants.REST_RETRY_DEADLINE,
+                 busy_codes=()):
+        self.max_attempts = max_attempts
+        self.base_interval = base_interval
+        self.max_interval = max_interval
+        self.deadline = deadline
+        self.busy_codes = set(six.text_type(code) for code in
+                              constants.REST_BUSY_ERROR_CODES + tuple(
+                                  busy_codes))
+        self.idempotent_codes = set(six.text_type(code) for code in
+                                    constants.REST_IDEMPOTENT_RETRY_CODES)
+        self._lock = threading.Lock()
+        self.retries = 0
+
+    @staticmethod
+    def is_connect_error(result):
+        error = result.get("error")
+        return isinstance(error, dict) and bool(error.get("connect_error"))
+
+    @staticmethod
+    def get_error_codes(result):
+        codes = [result.get("errorCode")]
+        for key in ("result", "error"):
+            if isinstance(result.get(key), dict):
+                codes.append(result[key].get("code"))
+        return set(six.text_type(code) for code in codes
+                   if code not in (None, 0, "0"))
+
+    def is_retryable(self, result, idempotent):
+        if not isinstance(result, dict):
+            return False
+        codes = self.get_error_codes(result)
+        return bool(codes & self.busy_codes or
+                    idempotent and (codes & self.idempotent_codes or
+                                    self.is_connect_error(result)))
+
+    def get_interval(self, attempt):
+        return random.uniform(0, min(self.max_interval,
+                                     self.base_interval * 2 ** (attempt - 1)))
+
+    def record_retry(self):
+        with self._lock:
+            self.retries += 1
+
+
+class CircuitBreaker(object):
+    """Fail fast while the FusionStorage management plane is unreachable.
+
+    The breaker opens after failure_threshold consecutive connection or
+    server errors. While open, calls are rejected without touching the
+    network. After reset_timeout one probe call is let through
+    (half-open): its success closes the breaker, its failure opens it
+    again.
+    """
+
+    def __init__(self, failure_threshold=constants.CIRCUIT_FAILURE_THRESHOLD,
+                 reset_timeout=constants.CIRCUIT_RESET_TIMEOUT):
+        self._lock = threading.Lock()
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = constants.CIRCUIT_CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.rejected = 0
+
+    def allow(self):
+        with self._lock:
+            if self.state == constants.CIRCUIT_CLOSED:
+                return True
+
+            if (self.state == constants.CIRCUIT_OPEN and
+                    time.time() - self.opened_at >= self.reset_timeout):
+                self.state = constants.CIRCUIT_HALF_OPEN
+                self.probing = False
+
+            if self.state == constants.CIRCUIT_HALF_OPEN and not self.probing:
+                self.probing = True
+                return True
+
+            self.rejected += 1
+            return False
+
+    def release(self):
+        # The call ended without telling whether the array is reachable,
+        # let another call probe it.
+        with self._lock:
+            self.probing = False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != constants.CIRCUIT_CLOSED:
+                LOG.info("The FusionStorage management plane is reachable "
+                         "again, close the circuit breaker.")
+            self.state = constants.CIRCUIT_CLOSED
+            self.failures = 0
+            self.probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if (self.state == constants.CIRCUIT_HALF_OPEN or
+                    self.failures >= self.failure_threshold):
+                if self.state != constants.CIRCUIT_OPEN:
+                    LOG.error("The FusionStorage management plane is "
+                              "unreachable, open the circuit breaker for "
+                              "%s seconds.", self.reset_timeout)
+                self.state = constants.CIRCUIT_OPEN
+                self.opened_at = time.time()
+                self.probing = False
+
+    def is_open(self):
+        with self._lock:
+            return self.state != constants.CIRCUIT_CLOSED
+
+    def to_dict(self):
+        with self._lock:
+            return {"state": self.state,
+                    "failures": self.failures,
+                    "rejected": self.rejected}
+
+
+class Paginator(object):
+    """Iterate the records of a paged FusionStorage list API lazily.
+
+    fetch_page(page_num, page_size) returns the records of one page and
+    the total number of records when the API reports it. Only the pages
+    being fetched are held and the iteration stops as soon as the
+    consumer stops. With prefetch the next page is requested on the
+    executor while the current one is consumed. Once the total is known,
+    up to concurrency pages are requested on the executor at a time and
+    yielded in page order. A page may also be an iterator of records
+    streamed from the response, it is then counted while it is consumed.
+    Records are converted to record_type one at a time as they are
+    yielded.
+    """
+
+    def __init__(self, fetch_page, page_size, first_page=1, total=None,
+                 prefetch=False, executor=None, concurrency=1,
+                 record_type=None):
+        self.fetch_page = fetch_page
+        self.record_type = record_type
+        self.page_size = page_size
+        self.first_page = first_page
+        self.total = total
+        self.executor = executor
+        self.prefetch = prefetch and executor is not None
+        self.concurrency = concurrency if executor is not None else 1
+
+    def _is_last_page(self, page_num, count, total):
+        if count < self.page_size:
+            return True
+        return (total is not None and
+                (page_num - self.first_page + 1) * self.page_size >= total)
+
+    def _convert(self, record):
+        if self.record_type is None:
+            return record
+        return self.record_type.from_dict(record)
+
+    def _get_window(self, total):
+        if total is not None and self.concurrency > 1:
+            return self.concurrency
+        return 1 if self.prefetch else 0
+
+    def _schedule(self, pending, page_num, total):
+        """Request the pages following those already pending."""
+        window = self._get_window(total)
+        last_page = None
+        if total is not None:
+            last_page = self.first_page + (total - 1) // self.page_size
+
+        deadline = getattr(_deadline_local, "deadline", None)
+        page_num += len(pending)
+        while len(pending) < window and (
+                last_page is None or page_num <= last_page):
+            pending.append(self.executor.submit(
+                _run_with_deadline, deadline, self.fetch_page, page_num,
+                self.page_size))
+            page_num += 1
+
+    def __iter__(self):
+        page_num = self.first_page
+        total = self.total
+        # Futures of the pages page_num, page_num + 1 and so on.
+        pending = collections.deque()
+        try:
+            while True:
+                self._schedule(pending, page_num, total)
+                if pending:
+                    records, page_total = pending.popleft().result()
+                else:
+                    records, page_total = self.fetch_page(page_num,
+                                                          self.page_size)
+                if page_total is not None:
+                    total = page_total
+                records = records or []
+
+                if isinstance(records, list):
+                    last_page = self._is_last_page(page_num, len(records),
+                                                   total)
+                    if not last_page:
+                        self._schedule(pending, page_num + 1, total)
+                    for record in records:
+                        yield self._convert(record)
+                else:
+                    count = 0
+                    for record in records:
+                        count += 1
+                        yield self._convert(record)
+                    last_page = self._is_last_page(page_num, count, total)
+
+                if last_page:
+                    return
+                page_num += 1
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+class VolumeIndex(object):
+    """Per pool index of the volume names by volId.
+
+    The index is filled by inventory scans and kept up to date by the
+    volume create and delete calls of the driver. The create calls do not
+    return the volId, so the created names are pending until a lookup
+    misses and queries them. The volIds a complete scan did not find are
+    remembered as missing until they are indexed, a create of the driver
+    or miss_ttl, since volumes are also created outside of the driver,
+    such as the LUNs to manage.
+    """
+
+    def __init__(self, miss_ttl=constants.VOLUME_INDEX_MISS_TTL):
+        self._lock = threading.Lock()
+        self.miss_ttl = miss_ttl
+        self._pools = {}
+        self._names = {}
+        self._pending = set()
+        self._misses = {}
+
+    @staticmethod
+    def _pool_key(pool_id):
+        # The array returns the poolId as a number, the callers may give
+        # it as a string.
+        return six.text_type(pool_id)
+
+    def get(self, pool_id, vol_id):
+        pool_id = self._pool_key(pool_id)
+        with self._lock:
+            return self._pools.get(pool_id, {}).get(int(vol_id))
+
+    def add(self, pool_id, vol_info):
+        pool_id = self._pool_key(pool_id)
+        vol_id = int(vol_info.get('volId'))
+        vol_name = vol_info.get('volName')
+        with self._lock:
+            old = self._names.get(vol_name)
+            if old:
+                self._pools.get(old[0], {}).pop(old[1], None)
+            self._pools.setdefault(pool_id, {})[vol_id] = vol_name
+            self._names[vol_name] = (pool_id, vol_id)
+            self._pending.discard(vol_name)
+            self._misses.get(pool_id, {}).pop(vol_id, None)
+
+    def add_created(self, vol_name):
+        with self._lock:
+            self._pending.add(vol_name)
+            # The new volume may take a volId known to be missing.
+            self._misses.clear()
+
+    def pop_pending(self):
+        with self._lock:
+            pending, self._pending = self._pending, set()
+        return pending
+
+    def remove(self, vol_name):
+        with self._lock:
+            self._pending.discard(vol_name)
+            old = self._names.pop(vol_name, None)
+            if old:
+                self._pools.get(old[0], {}).pop(old[1], None)
+
+    def is_missing(self, pool_id, vol_id):
+        pool_id = self._pool_key(pool_id)
+        with self._lock:
+            expires_at = self._misses.get(pool_id, {}).get(int(vol_id))
+        return expires_at is not None and expires_at > time.time()
+
+    def mark_scanned(self, pool_id, vol_ids, missing_vol_id):
+        """Record a complete scan which did not find missing_vol_id.
+
+        The volumes deleted meanwhile are dropped, and the volIds known
+        to be missing which the scan found are forgotten.
+        """
+        pool_id = self._pool_key(pool_id)
+        with self._lock:
+            volumes = self._pools.setdefault(pool_id, {})
+            for vol_id in set(volumes) - vol_ids:
+                self._names.pop(volumes.pop(vol_id), None)
+            misses = self._misses.setdefault(pool_id, {})
+            for vol_id in set(misses) & vol_ids:
+                del misses[vol_id]
+            misses[missing_vol_id] = time.time() + self.miss_ttl
+
+    def to_dict(self):
+        with self._lock:
+            return {"volumes": len(self._names),
+                    "pools": len(self._pools),
+                    "pending": len(self._pending),
+                    "misses": sum(len(m) for m in self._misses.values())}
+
+
+class TopologyIndex(object):
+    """Index of the hosts, host groups and initiators of the array.
+
+    The host, host group and initiator names are loaded from one listing
+    of each, the hosts of a host group and the initiators of a host on
+    first use. The mapping calls of the driver keep the index up to date
+    and the listings are compared with it again after refresh_interval,
+    so that changes made outside of the driver are picked up. A
+    refresh_interval of 0 disables the index.
+    """
+
+    def __init__(self, refresh_interval=constants.TOPOLOGY_REFRESH_INTERVAL):
+        self._lock = threading.Lock()
+        self.refresh_interval = refresh_interval
+        self._hosts = None
+        self._host_groups = None
+        self._initiators = None
+        self._group_hosts = {}
+        self._host_initiators = {}
+        self._loaded_at = None
+        self._generation = 0
+        self.loads = 0
+        self.changes = 0
+
+    @property
+    def enabled(self):
+        return self.refresh_interval > 0
+
+    @property
+    def generation(self):
+        return self._generation
+
+    def is_fresh(self):
+        loaded_at = self._loaded_at
+        return (loaded_at is not None and
+                time.time() - loaded_at < self.refresh_interval)
+
+    def load(self, hosts, host_groups, initiators, generation):
+        """Compare the index with new listings and replace its names.
+
+        The hosts of the host groups and the initiators of the hosts are
+        dropped, they are listed again on next use. The index stays stale
+        when it changed since generation, while the listings were made.
+        """
+        hosts, host_groups = set(hosts), set(host_groups)
+        initiators = set(initiators)
+        with self._lock:
+            if self._hosts is not None:
+                changes = (len(self._hosts ^ hosts) +
+                           len(self._host_groups ^ host_groups) +
+                           len(self._initiators ^ initiators))
+                if changes:
+                    LOG.info("%s hosts, host groups or initiators changed "
+                             "outside of the driver.", changes)
+                self.changes += changes
+            self._hosts = hosts
+            self._host_groups = host_groups
+            self._initiators = initiators
+            self._group_hosts.clear()
+            self._host_initiators.clear()
+            self.loads += 1
+            if self._generation == generation:
+                self._loaded_at = time.time()
+            else:
+                self._loaded_at = None
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = None
+            self._group_hosts.clear()
+            self._host_initiators.clear()
+
+    def has_host(self, host_name):
+        with self._lock:
+            return host_name in (self._hosts or ())
+
+    def has_host_group(self, host_group_name):
+        with self._lock:
+            return host_group_name in (self._host_groups or ())
+
+    def has_initiator(self, initiator_name):
+        with self._lock:
+            return initiator_name in (self._initiators or ())
+
+    def get_group_hosts(self, host_group_name):
+        """Return the hosts of the host group, None when not known."""
+        with self._lock:
+            hosts = self._group_hosts.get(host_group_name)
+            return None if hosts is None else list(hosts)
+
+    def set_group_hosts(self, host_group_name, hosts):
+        with self._lock:
+            self._group_hosts[host_group_name] = set(hosts)
+
+    def get_host_initiators(self, host_name):
+        """Return the initiators of the host, None when not known."""
+        with self._lock:
+            initiators = self._host_initiators.get(host_name)
+            return None if initiators is None else list(initiators)
+
+    def set_host_initiators(self, host_name, initiators):
+        with self._lock:
+            self._host_initiators[host_name] = set(initiators)
+
+    def _update(self, names, name, add):
+        self._generation += 1
+        if names is not None:
+            if add:
+                names.add(name)
+            else:
+                names.discard(name)
+
+    def add_host(self, host_name):
+        with self._lock:
+            self._update(self._hosts, host_name, True)
+
+    def remove_host(self, host_name):
+        with self._lock:
+            self._update(self._hosts, host_name, False)
+            self._host_initiators.pop(host_name, None)
+            for hosts in self._group_hosts.values():
+                hosts.discard(host_name)
+
+    def add_host_group(self, host_group_name):
+        with self._lock:
+            self._update(self._host_groups, host_group_name, True)
+            self._group_hosts.setdefault(host_group_name, set())
+
+    def remove_host_group(self, host_group_name):
+        with self._lock:
+            self._update(self._host_groups, host_group_name, False)
+            self._group_hosts.pop(host_group_name, None)
+
+    def add_host_to_group(self, host_group_name, host_name):
+        with self._lock:
+            self._update(self._group_hosts.get(host_group_name), host_name,
+                         True)
+
+    def remove_host_from_group(self, host_group_name, host_name):
+        with self._lock:
+            self._update(self._group_hosts.get(host_group_name), host_name,
+                         False)
+
+    def add_initiator(self, initiator_name):
+        with self._lock:
+            self._update(self._initiators, initiator_name, True)
+
+    def remove_initiator(self, initiator_name):
+        with self._lock:
+            self._update(self._initiators, initiator_name, False)
+
+    def add_initiator_to_host(self, host_name, initiator_name):
+        with self._lock:
+            self._update(self._host_initiators.get(host_name),
+                         initiator_name, True)
+
+    def remove_initiator_from_host(self, host_name, initiator_name):
+        with self._lock:
+            self._update(self._host_initiators.get(host_name),
+                         initiator_name, False)
+
+    def to_dict(self):
+        with self._lock:
+            return {"hosts": len(self._hosts or ()),
+                    "host_groups": len(self._host_groups or ()),
+                    "initiators": len(self._initiators or ()),
+                    "loads": self.loads,
+                    "changes": self.changes}
+
+
+class ArrayCapabilities(object):
+    """What the array supports, probed once after each login.
+
+    fsm_version is the FSM version of /version and api_families tells for
+    each REST API family whether the array serves it. A capability that
+    could not be probed is None, the caller then tries the API as it did
+    before the registry.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.rest_version = None
+        self.fsm_version = None
+        self.new_iscsi = None
+        self.api_families = {}
+        self.probed_at = None
+
+    def update(self, **capabilities):
+        with self._lock:
+            api_families = capabilities.pop("api_families", {})
+            for key, value in capabilities.items():
+                setattr(self, key, value)
+            self.api_families.update(api_families)
+            self.probed_at = time.time()
+
+    def supports_api(self, family):
+        return self.api_families.get(family)
+
+    def supports_schedule_qos(self):
+        if self.fsm_version is None:
+            return None
+        return self.fsm_version >= constants.QOS_SUPPORT_SCHEDULE_VERSION
+
+    def to_dict(self):
+        with self._lock:
+            return {"rest_version": self.rest_version,
+                    "fsm_version": self.fsm_version,
+                    "new_iscsi": self.new_iscsi,
+                    "api_families": dict(self.api_families),
+                    "probed_at": self.probed_at}
+
+
+class SystemTimeCache(object):
+    """Time zone and DST configuration of the array.
+
+    Each entry is loaded on first use and kept for ttl seconds, or until
+    the expiry time returned by its loader, such as the next DST change
+    of the array, if that comes first. A ttl of 0 disables the cache.
+    """
+
+    def __init__(self, ttl=constants.SYSTEM_TIME_CACHE_TTL):
+        self._lock = threading.Lock()
+        self.ttl = ttl
+        self._entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, load):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > now:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        value, expires_at = load()
+        if self.ttl > 0:
+            expires_at = min(now + self.ttl, expires_at or now + self.ttl)
+            with self._lock:
+                self._entries[key] = (expires_at, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def to_dict(self):
+        with self._lock:
+            return {"hits": self.hits,
+                    "misses": self.misses,
+                    "entries": len(self._entries)}
+
 
 class RestCommon(object):
     def __init__(self, fs_address, fs_user, fs_password, **extend_conf):
-        self.address = fs_address
+        if isinstance(fs_address, six.string_types):
+            fs_address = [fs_address]
+        self.endpoints = RestEndpointGroup(
+            fs_address, extend_conf.get("failure_threshold",
+                                        constants.ENDPOINT_FAILURE_THRESHOLD))
         self.user = fs_user
         self.password = fs_password
 
         self.session = None
+        self.adapter = None
         self.token = None
+        self._login_lock = threading.Lock()
+        self._relogin_failure = None
+        self._keep_alive_timer = None
         self.version = None
         self.esn = None
+        self.capabilities = ArrayCapabilities()
+        self.system_time_cache = SystemTimeCache(extend_conf.get(
+            "time_config_ttl", constants.SYSTEM_TIME_CACHE_TTL))
+        self.pool_stats = ConnectionPoolStats()
+        self.cache = RestCache(extend_conf.get("cache_ttl", {}))
+        self.coalescer = RequestCoalescer()
+        self.retry_policy = RetryPolicy(**extend_conf.get("retry", {}))
+        self.circuit_breaker = CircuitBreaker(
+            **extend_conf.get("circuit_breaker", {}))
+        self.metrics = fs_metrics.RestMetrics()
+        self.codec = fs_json.get_codec(extend_conf.get("json_codec", "auto"))
+        self.adaptive_timeout = AdaptiveTimeout(
+            **extend_conf.get("adaptive_timeout", {}))
+        pagination = extend_conf.get("pagination", {})
+        self.page_size = pagination.get("page_size",
+                                        constants.GET_VOLUME_PAGE_SIZE)
+        self.page_prefetch = pagination.get("prefetch", False)
+        self.page_concurrency = pagination.get("concurrency", 1)
+        self.list_streaming = pagination.get("streaming", False)
+        self.page_executor = None
+        self.volume_index = VolumeIndex()
+        self.topology = TopologyIndex(extend_conf.get(
+            "topology_refresh_interval", constants.TOPOLOGY_REFRESH_INTERVAL))
+        self.batcher = RequestBatcher(**extend_conf.get("batch", {}))
+        if self.page_prefetch or self.page_concurrency > 1:
+            # The executor is shared by all listings, so that its size
+            # caps the number of pages requested from the array at a time.
+            self.page_executor = futurist.ThreadPoolExecutor(
+                max_workers=max(self.page_concurrency, 1))
         mutual_authentication = extend_conf.get("mutual_authentication", {})
-        self.init_http_head(mutual_authentication)
+        connection_pool = extend_conf.get("connection_pool", {})
+        self.init_http_head(mutual_authentication, connection_pool)
 
         LOG.warning("Suppressing requests library SSL Warnings")
         requests.packages.urllib3.disable_warnings(
@@ -53,13 +1199,25 @@ class RestCommon(object):
         requests.packages.urllib3.disable_warnings(
             requests.packages.urllib3.exceptions.InsecurePlatformWarning)
 
-    def init_http_head(self, mutual_authentication=None):
+    def init_http_head(self, mutual_authentication=None,
+                       connection_pool=None):
+        connection_pool = connection_pool or {}
         self.session = requests.Session()
         self.session.headers.update({
             "Content-Type": "application/json;charset=UTF-8",
         })
         self.session.verify = False
-        self.session.mount(self.address, HostNameIgnoringAdapter())
+        self.adapter = HostNameIgnoringAdapter(
+            pool_stats=self.pool_stats,
+            idle_timeout=connection_pool.get("idle_timeout", 0),
+            pool_connections=connection_pool.get(
+                "pool_connections", requests.adapters.DEFAULT_POOLSIZE),
+            pool_maxsize=connection_pool.get(
+                "pool_maxsize", requests.adapters.DEFAULT_POOLSIZE),
+            pool_block=connection_pool.get(
+                "pool_block", requests.adapters.DEFAULT_POOLBLOCK))
+        for endpoint in self.endpoints.endpoints:
+            self.session.mount(endpoint.address, self.adapter)
 
         if mutual_authentication.get("storage_ssl_two_way_auth"):
             self.session.verify = \
@@ -68,16 +1226,74 @@ class RestCommon(object):
                 (mutual_authentication.get("storage_cert_filepath"),
                  mutual_authentication.get("storage_key_filepath"))
 
-    def _construct_url(self, url, get_version, get_system_time):
+    def prewarm_connections(self, count):
+        if count <= 0:
+            return
+        self.adapter.prewarm(count)
+
+    def get_connection_pool_stats(self):
+        return self.pool_stats.to_dict()
+
+    def get_endpoint_stats(self):
+        return self.endpoints.to_dict()
+
+    def get_cache_stats(self):
+        return self.cache.to_dict()
+
+    def get_coalesce_stats(self):
+        return self.coalescer.to_dict()
+
+    def get_circuit_breaker_stats(self):
+        return self.circuit_breaker.to_dict()
+
+    def is_circuit_open(self):
+        return self.circuit_breaker.is_open()
+
+    def get_metrics(self):
+        return {"calls": self.metrics.to_dict(),
+                "connection_pool": self.get_connection_pool_stats(),
+                "cache": self.get_cache_stats(),
+                "volume_index": self.volume_index.to_dict(),
+                "topology": self.topology.to_dict(),
+                "batch": self.batcher.to_dict(),
+                "coalesce": self.get_coalesce_stats(),
+                "circuit_breaker": self.get_circuit_breaker_stats(),
+                "timeouts": self.adaptive_timeout.to_dict(),
+                "capabilities": self.capabilities.to_dict(),
+                "system_time_cache": self.system_time_cache.to_dict(),
+                "retry": {"retries": self.retry_policy.retries}}
+
+    @property
+    def address(self):
+        return self.endpoints.active.address
+
+    @staticmethod
+    def _construct_url(address, url, get_version, get_system_time):
         if get_system_time:
-            return self.address + url
+            return address + url
         elif get_version:
-            return self.address + constants.BASIC_URI + url
+            return address + constants.BASIC_URI + url
         else:
-            return self.address + constants.BASIC_URI + "v1.2" + url
+            return address + constants.BASIC_URI + "v1.2" + url
 
     @staticmethod
-    def _deal_call_result(result, filter_flag, json_flag, req_dict):
+    def _is_read_only(url, method):
+        return (method.upper() == "GET" or
+                url.split("?")[0] in constants.READ_ONLY_POST_URLS)
+
+    def _is_idempotent(self, url, method):
+        return (self._is_read_only(url, method) or
+                url.split("?")[0] in constants.IDEMPOTENT_WRITE_URLS)
+
+    def _deal_call_result(self, result, filter_flag, json_flag, req_dict,
+                          stream_key=None):
+        # The body is decoded once, for the log and for the caller.
+        res_json = None
+        if stream_key:
+            res_json = fs_json.JsonListStream(result, stream_key)
+        elif json_flag or not filter_flag:
+            res_json = self.codec.loads(result.content)
+
         if not filter_flag:
             LOG.info('''
             Request URL: %(url)s,
@@ -88,41 +1304,279 @@ class RestCommon(object):
                                            'method': req_dict.get("method"),
                                            'data': req_dict.get("data"),
                                            'res': result,
-                                           'res_json': result.json()})
+                                           'res_json': res_json})
 
-        return result.json() if json_flag else result
+        return res_json if json_flag else result
+
+    def _send(self, endpoint, func, url, call_url, kwargs, truncated=False):
+        self.endpoints.begin(endpoint)
+        start = time.time()
+        try:
+            result = func(call_url, **kwargs)
+        except Exception as err:
+            LOG.error('Bad response from server: %(url)s. '
+                      'Error: %(err)s', {'url': call_url, 'err': err})
+            if truncated and isinstance(err, requests.Timeout):
+                # The operation deadline cut the call, not the endpoint.
+                self.endpoints.release(endpoint)
+                self.metrics.observe(func.__name__, url, time.time() - start,
+                                     constants.DEADLINE_EXCEEDED_ERROR)
+                return None
+
+            self.endpoints.finish(endpoint, success=False)
+            self.metrics.observe(func.__name__, url, time.time() - start,
+                                 constants.CONNECT_ERROR)
+            if isinstance(err, requests.Timeout):
+                # Remember the timeout so that the learned timeout grows
+                # when the array becomes slower.
+                self.adaptive_timeout.observe(url, time.time() - start)
+            return None
+
+        elapsed = time.time() - start
+        self.endpoints.finish(endpoint, elapsed,
+                              success=result.status_code < 500)
+        self.adaptive_timeout.observe(url, elapsed)
+        self.metrics.observe(
+            func.__name__, url, elapsed,
+            result.status_code if result.status_code >= 400 else None)
+        if kwargs.get('stream'):
+            # The body of a stream is not read yet.
+            received = int(result.headers.get('Content-Length') or 0)
+        else:
+            received = len(result.content or b'')
+        self.metrics.record_bytes(
+            func.__name__, url, len(kwargs.get('data') or ''), received)
+        return result
+
+    @staticmethod
+    def _get_error_code(result):
+        if not isinstance(result, dict):
+            return None
+        error = result.get('error')
+        if isinstance(error, dict) and error.get('code'):
+            return error.get('code')
+        code = result.get('result')
+        if isinstance(code, dict):
+            code = code.get('code')
+        if code:
+            return result.get('errorCode') or code
+        return None
+
+    @staticmethod
+    def _is_call_success(result):
+        code = result.get('result')
+        if isinstance(code, dict):
+            code = code.get('code')
+        return code == 0
+
+    def paginate(self, fetch_page, page_size=None, total=None, stream=False,
+                 record_type=None):
+        # Streamed pages are read from their connection while they are
+        # consumed, so they are not requested ahead.
+        executor = None if stream else self.page_executor
+        return Paginator(fetch_page, page_size or self.page_size,
+                         first_page=constants.GET_VOLUME_PAGE_NUM,
+                         total=total, prefetch=self.page_prefetch,
+                         executor=executor,
+                         concurrency=self.page_concurrency,
+                         record_type=record_type)
 
     def call(self, url, method, data=None,
              call_timeout=constants.DEFAULT_TIMEOUT, **input_kwargs):
+        path = url.split("?")[0]
+        read_only = self._is_read_only(url, method)
+        if not read_only:
+            try:
+                return self._call_with_retry(url, method, data, call_timeout,
+                                             **input_kwargs)
+            finally:
+                self.cache.invalidate(
+                    constants.REST_CACHE_INVALIDATION.get(path, ()))
+
+        # A response stream can only be consumed once, it is neither
+        # cached nor shared.
+        if (not input_kwargs.get("json_flag", True) or
+                input_kwargs.get("stream_key")):
+            return self._call_with_retry(url, method, data, call_timeout,
+                                         **input_kwargs)
+
+        def _query():
+            sent = []
+
+            def _send():
+                sent.append(True)
+                return self._call_with_retry(url, method, data, call_timeout,
+                                             **input_kwargs)
+
+            result = self.coalescer.run(key, _send)
+            if not sent:
+                self.metrics.record_coalesced(method, url)
+            return result
+
+        key = self.cache.make_key(method, url, data,
+                                  input_kwargs.get("get_version"),
+                                  input_kwargs.get("get_system_time"))
+        if not self.cache.is_cacheable(path):
+            return _query()
+
+        result, generation = self.cache.get(key)
+        if result is not None:
+            self.metrics.record_cache_hit(method, url)
+        else:
+            result = _query()
+            if self._is_call_success(result):
+                self.cache.put(key, generation, result)
+        return result
+
+    def _call_with_retry(self, url, method, data=None,
+                         call_timeout=constants.DEFAULT_TIMEOUT,
+                         **input_kwargs):
+        policy = self.retry_policy
+        idempotent = self._is_idempotent(url, method)
+        deadline = time.time() + policy.deadline
+        remaining = get_remaining_time()
+        if remaining is not None:
+            deadline = min(deadline, time.time() + remaining)
+        attempt = 1
+        while True:
+            result = self._call(url, method, data, call_timeout,
+                                **input_kwargs)
+            if (attempt >= policy.max_attempts or
+                    not policy.is_retryable(result, idempotent)):
+                return result
+
+            interval = policy.get_interval(attempt)
+            if time.time() + interval >= deadline:
+                return result
+
+            LOG.warning("Retry %(method)s %(url)s in %(interval).2f seconds, "
+                        "attempt %(attempt)s failed with %(result)s.",
+                        {"method": method, "url": url, "interval": interval,
+                         "attempt": attempt, "result": result})
+            policy.record_retry()
+            self.metrics.record_retry(method, url)
+            time.sleep(interval)
+            attempt += 1
+
+    def _call(self, url, method, data=None,
+              call_timeout=constants.DEFAULT_TIMEOUT, **input_kwargs):
         filter_flag = input_kwargs.get("filter_flag")
         json_flag = input_kwargs.get("json_flag", True)
         get_version = input_kwargs.get("get_version")
         get_system_time = input_kwargs.get("get_system_time")
+        relogin = input_kwargs.get("relogin", True)
+        stream_key = input_kwargs.get("stream_key")
+        token = self.token
+
+        # Only queries use the learned timeout, a write that times out
+        # may still be applied by the array.
+        if self._is_read_only(url, method):
+            call_timeout = self.adaptive_timeout.get_timeout(
+                url, call_timeout)
+        remaining = get_remaining_time()
+        truncated = remaining is not None and remaining < call_timeout
+        if truncated:
+            if remaining <= 0:
+                self.metrics.record_error(
+                    method, url, constants.DEADLINE_EXCEEDED_ERROR)
+                return _get_deadline_error()
+            call_timeout = remaining
 
         kwargs = {'timeout': call_timeout}
         if data is not None:
-            kwargs['data'] = json.dumps(data)
+            kwargs['data'] = self.codec.dumps(data)
+        if stream_key:
+            kwargs['stream'] = True
+
+        if not self.circuit_breaker.allow():
+            self.metrics.record_error(method, url,
+                                      constants.CIRCUIT_OPEN_ERROR)
+            return {"error": {
+                "code": constants.CIRCUIT_OPEN_ERROR,
+                "description": "The FusionStorage management plane is "
+                               "unavailable, the request is rejected."}}
 
-        call_url = self._construct_url(url, get_version, get_system_time)
         func = getattr(self.session, method.lower())
+        result = None
+        # Read-only calls move on to the next endpoint when one fails.
+        for endpoint in self.endpoints.select(self._is_read_only(url, method)):
+            call_url = self._construct_url(endpoint.address, url,
+                                           get_version, get_system_time)
+            result = self._send(endpoint, func, url, call_url, kwargs,
+                                truncated)
+            if result is not None and result.status_code < 500:
+                break
 
-        try:
-            result = func(call_url, **kwargs)
-        except Exception as err:
-            LOG.error('Bad response from server: %(url)s. '
-                      'Error: %(err)s'), {'url': call_url, 'err': err}
-            return {"error": {
-                "code": constants.CONNECT_ERROR,
-                "description": "Connect to server error."}}
+        if result is None and truncated and get_remaining_time() <= 0:
+            self.circuit_breaker.release()
+            return _get_deadline_error()
+
+        if result is None or result.status_code >= 500:
+            self.circuit_breaker.record_failure()
+        else:
+            self.circuit_breaker.record_success()
+
+        if result is None:
+            return _get_connect_error()
 
         try:
             result.raise_for_status()
         except requests.HTTPError as exc:
-            return {"error": {"code": exc.response.status_code,
-                              "description": six.text_type(exc)}}
+            if stream_key:
+                exc.response.close()
+            result = {"error": {"code": exc.response.status_code,
+                                "description": six.text_type(exc)}}
+        else:
+            req_dict = {"url": call_url, "method": method, "data": data}
+            result = self._deal_call_result(
+                result, filter_flag, json_flag, req_dict, stream_key)
+            # The HTTP request succeeded, the array may still have
+            # answered with an error.
+            self.metrics.record_error(method, url,
+                                      self._get_error_code(result))
+
+        if (relogin and isinstance(result, dict) and
+                self._is_session_expired(result) and self._relogin(token)):
+            input_kwargs["relogin"] = False
+            return self._call(url, method, data, call_timeout,
+                              **input_kwargs)
+        return result
 
-        req_dict = {"url": call_url, "method": method, "data": data}
-        return self._deal_call_result(result, filter_flag, json_flag, req_dict)
+    @staticmethod
+    def _is_session_expired(result):
+        code = result.get('result')
+        if isinstance(code, dict):
+            code = code.get('code')
+        error = result.get('error')
+        return (code == constants.ERROR_UNAUTHORIZED or
+                result.get("errorCode") == constants.ERROR_USER_OFFLINE or
+                (isinstance(error, dict) and
+                 error.get('code') == constants.HTTP_UNAUTHORIZED))
+
+    def _relogin(self, expired_token):
+        # Only one greenthread logs in again, the others wait for it and
+        # then replay their request with the new token.
+        with self._login_lock:
+            if self.token != expired_token:
+                return True
+
+            failure = self._relogin_failure
+            if (failure and failure[0] == expired_token and
+                    time.time() - failure[1] < constants.RELOGIN_INTERVAL):
+                return False
+
+            LOG.warning("The session of FusionStorage %s has expired, "
+                        "log in again.", self.address)
+            try:
+                self.login()
+            except Exception as err:
+                LOG.error("Log in FusionStorage again failed. Reason: %s",
+                          err)
+                self._relogin_failure = (expired_token, time.time())
+                return False
+
+            self._relogin_failure = None
+            return True
 
     @staticmethod
     def _assert_rest_result(result, err_str):
@@ -143,14 +1597,15 @@ class RestCommon(object):
         self.session.headers.update({
             "Referer": self.address + constants.BASIC_URI
         })
-        result = self.call(url=url, method='GET', get_version=True)
+        result = self.call(url=url, method='GET', get_version=True,
+                           relogin=False)
         self._assert_rest_result(result, _('Get version session error.'))
         if result.get("currentVersion"):
             self.version = result["currentVersion"]
 
     def get_esn(self):
         url = "/cluster/sn"
-        result = self.call(url, "get")
+        result = self.call(url, "get", relogin=False)
         self._assert_rest_result(result, _('Get cluster esn error.'))
         self.esn = result.get("sn")
         return self.esn
@@ -161,36 +1616,116 @@ class RestCommon(object):
         data = {"userName": self.user, "password": self.password}
         result = self.call(url, 'POST', data=data,
                            call_timeout=constants.LOGIN_SOCKET_TIMEOUT,
-                           filter_flag=True, json_flag=False)
-        self._assert_rest_result(result.json(), _('Login session error.'))
+                           filter_flag=True, json_flag=False, relogin=False)
+        self._assert_rest_result(self.codec.loads(result.content),
+                                 _('Login session error.'))
         self.token = result.headers['X-Auth-Token']
 
         self.session.headers.update({
             "x-auth-token": self.token
         })
         self.get_esn()
+        self.system_time_cache.clear()
+        self.probe_capabilities()
+
+    def _probe_api(self, url, **kwargs):
+        """Whether the array serves url, None when it can not be told."""
+        result = self.call(url, "GET", relogin=False, **kwargs)
+        if constants.URL_NOT_FOUND in six.text_type(result):
+            return False
+        error = result.get("error")
+        if isinstance(error, dict) and error.get("code"):
+            # The array could not be reached.
+            return None
+        return True
+
+    def _probe_new_iscsi(self):
+        url = "/dsware/service/iscsi/queryIscsiHostRelation"
+        params = [{"key": "get_newiscsi", "flag": 0}]
+        result = self.call(url, "POST", params, get_system_time=True,
+                           relogin=False)
+        if constants.URL_NOT_FOUND in six.text_type(result):
+            return False, False
+        self._assert_rest_result(
+            result, _("Get iscsi host relation session error."))
+        return True, bool(result.get("newIscsi"))
+
+    def probe_capabilities(self):
+        # Called within login, so that the probes must not log in again.
+        capabilities = {"rest_version": self.version, "api_families": {}}
+        try:
+            result = self.call("/version", "GET", relogin=False)
+            self._assert_rest_result(
+                result, _("Get FSM version session error."))
+            capabilities["fsm_version"] = result.get("version")
+        except Exception as err:
+            LOG.warning("Probe FSM version failed. Reason: %s", err)
+
+        try:
+            relation, new_iscsi = self._probe_new_iscsi()
+            capabilities["api_families"]["iscsi_host_relation"] = relation
+            capabilities["new_iscsi"] = new_iscsi
+        except Exception as err:
+            LOG.warning("Probe new iscsi interface failed. Reason: %s", err)
+
+        for family, url, kwargs in constants.API_FAMILY_PROBES:
+            try:
+                capabilities["api_families"][family] = self._probe_api(
+                    url, **kwargs)
+            except Exception as err:
+                LOG.warning("Probe REST API %(family)s failed. Reason: "
+                            "%(err)s", {"family": family, "err": err})
+
+        self.capabilities.update(**capabilities)
+        LOG.info("FusionStorage %(addr)s capabilities: %(cap)s",
+                 {"addr": self.address, "cap": self.capabilities.to_dict()})
+
+    def is_support_schedule_qos(self):
+        supported = self.capabilities.supports_schedule_qos()
+        if supported is None:
+            fsm_version = self.get_fsm_version()
+            self.capabilities.update(fsm_version=fsm_version)
+            supported = self.capabilities.supports_schedule_qos()
+        return bool(supported)
 
     def logout(self):
         url = '/sec/logout'
         if self.address:
-            result = self.call(url, 'POST')
+            result = self.call(url, 'POST', relogin=False)
             self._assert_rest_result(result, _('Logout session error.'))
 
     def keep_alive(self):
         url = '/sec/keepAlive'
-        result = self.call(url, 'POST', filter_flag=True)
+        token = self.token
+        result = self.call(url, 'POST', filter_flag=True, relogin=False)
 
         if (result.get('result') == constants.ERROR_UNAUTHORIZED or
                 result.get("errorCode") == constants.ERROR_USER_OFFLINE):
-            try:
-                self.login()
-            except Exception:
-                LOG.error('The FusionStorage may have been powered off. '
-                          'Power on the FusionStorage and then log in.')
-                raise
+            # Log in through the same single flight as the expired calls.
+            if not self._relogin(token):
+                msg = _('The FusionStorage may have been powered off. '
+                        'Power on the FusionStorage and then log in.')
+                LOG.error(msg)
+                raise exception.VolumeBackendAPIException(data=msg)
         else:
             self._assert_rest_result(result, _('Keep alive session error.'))
 
+    def start_keep_alive_timer(self, interval):
+        if interval <= 0 or self._keep_alive_timer:
+            return
+
+        def _keep_alive():
+            try:
+                self.keep_alive()
+            except Exception as err:
+                LOG.warning("Keep alive FusionStorage session failed. "
+                            "Reason: %s", err)
+
+        self._keep_alive_timer = loopingcall.FixedIntervalLoopingCall(
+            _keep_alive)
+        self._keep_alive_timer.start(interval=interval,
+                                     initial_delay=interval)
+
     def query_pool_info(self, pool_id=None):
         pool_id = str(pool_id)
         if pool_id != 'None':
@@ -205,63 +1740,113 @@ class RestCommon(object):
         pool_info = self.query_pool_info(pool_id)
         return pool_info[0].get('volumeNum', 0)
 
+    def _call_list(self, url, params, list_key):
+        """Query a list, streaming its records when list_streaming is on.
+
+        Return the result and the records of list_key, which are a list
+        or an iterator decoding them from the response.
+        """
+        if not self.list_streaming:
+            result = self.call(url, "POST", params)
+            return result, result.get(list_key) or []
+
+        result = self.call(url, "POST", params, stream_key=list_key)
+        if not isinstance(result, fs_json.JsonListStream):
+            return result, []
+        if 'result' not in result:
+            # The status follows the list, decode the whole list so that
+            # the status is known before the records are used.
+            return result, list(result.iter_records())
+        return result, result.iter_records()
+
     def _query_volumes_by_batch(self, pool_id, page_num, page_size=1000):
         url = '/volume/list'
         params = {'poolId': pool_id,
                   'pageNum': page_num, 'pageSize': page_size}
 
-        result = self.call(url, 'POST', params)
+        result, volumes = self._call_list(url, params, 'volumeList')
         if result.get('errorCode') in constants.VOLUME_NOT_EXIST:
             return None
         self._assert_rest_result(
             result, "Query all volume session error")
-        return result.get('volumeList')
+        return volumes
 
-    def get_volume_by_id(self, pool_id, vol_id):
+    def iter_volumes(self, pool_id, page_size=None):
         vol_cnt = self._get_volume_num_by_pool(pool_id)
-        page_num = constants.GET_VOLUME_PAGE_NUM
-        page_size = constants.GET_VOLUME_PAGE_SIZE
-        while vol_cnt > 0:
-            vol_list = self._query_volumes_by_batch(pool_id, page_num,
-                                                    page_size)
-            for vol_info in vol_list:
-                if int(vol_info.get('volId')) == int(vol_id):
-                    return vol_info
-
-            vol_cnt -= page_size
-            page_num += 1
+        if vol_cnt <= 0:
+            return iter([])
+
+        def _fetch_page(page_num, page_size):
+            return (self._query_volumes_by_batch(
+                pool_id, page_num, page_size), vol_cnt)
+
+        return iter(self.paginate(_fetch_page, page_size, total=vol_cnt,
+                                  stream=self.list_streaming,
+                                  record_type=fs_records.VolumeRecord))
+
+    def get_volume_by_id(self, pool_id, vol_id):
+        vol_id = int(vol_id)
+        vol_name = self.volume_index.get(pool_id, vol_id)
+        if vol_name is None:
+            # The volumes created by the driver since the last lookup are
+            # cheaper to query one by one than the pool to scan.
+            for pending_name in self.volume_index.pop_pending():
+                vol_info = self.query_volume_by_name(pending_name)
+                if vol_info:
+                    self.volume_index.add(vol_info.get('poolId'), vol_info)
+            vol_name = self.volume_index.get(pool_id, vol_id)
+
+        if vol_name:
+            # The index only knows the name, the volume details such as
+            # its size are always queried from the array.
+            vol_info = self.query_volume_by_name(vol_name)
+            if vol_info and int(vol_info.get('volId')) == vol_id:
+                return fs_records.VolumeRecord.from_dict(vol_info)
+            self.volume_index.remove(vol_name)
+
+        if self.volume_index.is_missing(pool_id, vol_id):
+            return None
+        return self._scan_volume_by_id(pool_id, vol_id)
+
+    def _scan_volume_by_id(self, pool_id, vol_id):
+        # Index every volume seen on the way, so that the following
+        # lookups of an adoption batch are answered from the index.
+        vol_ids = set()
+        for vol_info in self.iter_volumes(pool_id):
+            self.volume_index.add(pool_id, vol_info)
+            vol_ids.add(int(vol_info.get('volId')))
+            if int(vol_info.get('volId')) == vol_id:
+                return vol_info
+        self.volume_index.mark_scanned(pool_id, vol_ids, vol_id)
         return None
 
     def _query_snapshot_of_volume_batch(self, vol_name, snapshot_name,
                                         batch_num=1, batch_limit=1000):
         url = '/volume/snapshot/list'
         params = {"volName": vol_name, "batchLimit": batch_limit,
-                  "batchNum": batch_num,
-                  "filters": {"volumeName": snapshot_name}}
-        result = self.call(url, "POST", params)
+                  "batchNum": batch_num}
+        if snapshot_name:
+            params["filters"] = {"volumeName": snapshot_name}
+        result, snapshots = self._call_list(url, params, 'snapshotList')
         self._assert_rest_result(
             result, 'Query snapshots of volume session error.')
-        return result
+        return snapshots, result.get('totalNum')
 
-    @staticmethod
-    def _get_snapshot_from_result(batch_result, snapshot_key, snapshot_name):
-        for res in batch_result.get('snapshotList', []):
-            if res.get(snapshot_key) == snapshot_name:
-                return res
+    def iter_snapshots_of_volume(self, vol_name, snapshot_name=None,
+                                 page_size=None):
+        def _fetch_page(batch_num, batch_limit):
+            return self._query_snapshot_of_volume_batch(
+                vol_name, snapshot_name, batch_num, batch_limit)
+
+        return iter(self.paginate(_fetch_page, page_size,
+                                  stream=self.list_streaming,
+                                  record_type=fs_records.SnapshotRecord))
 
     def query_snapshots_of_volume(self, vol_name, snapshot_name):
-        batch_num = constants.GET_SNAPSHOT_PAGE_NUM
-        batch_size = constants.GET_SNAPSHOT_PAGE_SIZE
-        while True:
-            batch_result = self._query_snapshot_of_volume_batch(
-                vol_name, snapshot_name, batch_num, batch_size)
-            snapshot_info = self._get_snapshot_from_result(
-                batch_result, 'snapshotName', snapshot_name)
-            if snapshot_info:
+        for snapshot_info in self.iter_snapshots_of_volume(
+                vol_name, snapshot_name):
+            if snapshot_info.get('snapshotName') == snapshot_name:
                 return snapshot_info
-            if batch_result.get('totalNum') < batch_size:
-                break
-            batch_num += 1
         return None
 
     def query_volume_by_name(self, vol_name):
@@ -296,11 +1881,12 @@ class RestCommon(object):
         params = {"volName": vol_name, "volSize": vol_size, "poolId": pool_id}
         result = self.call(url, "POST", params)
         self._assert_rest_result(result, _('Create volume session error.'))
+        self.volume_index.add_created(vol_name)
 
     def delete_volume(self, vol_name):
         url = '/volume/delete'
-        params = {"volNames": [vol_name]}
-        result = self.call(url, "POST", params)
+        result = self._call_batched(url, {}, "volNames", vol_name)
+        self.volume_index.remove(vol_name)
         if result.get('errorCode') in constants.VOLUME_NOT_EXIST:
             return None
         self._assert_rest_result(result, _('Delete volume session error.'))
@@ -333,27 +1919,28 @@ class RestCommon(object):
                                       batch_num=1, batch_size=1000):
         url = '/snapshot/list'
         params = {"poolId": pool_id, "pageNum": batch_num,
-                  "pageSize": batch_size,
-                  "filters": {"volumeName": snapshot_name}}
+                  "pageSize": batch_size}
+        if snapshot_name:
+            params["filters"] = {"volumeName": snapshot_name}
 
-        result = self.call(url, "POST", params)
+        result, snapshots = self._call_list(url, params, 'snapshotList')
         self._assert_rest_result(
             result, _('query snapshot list session error.'))
-        return result
+        return snapshots, result.get('totalNum')
 
-    def query_snapshot_by_name(self, pool_id, snapshot_name):
-        batch_num = constants.GET_SNAPSHOT_PAGE_NUM
-        batch_size = constants.GET_SNAPSHOT_PAGE_SIZE
-        while True:
-            batch_result = self._query_snapshot_by_name_batch(
+    def iter_snapshots(self, pool_id, snapshot_name=None, page_size=None):
+        def _fetch_page(batch_num, batch_size):
+            return self._query_snapshot_by_name_batch(
                 pool_id, snapshot_name, batch_num, batch_size)
-            snapshot_info = self._get_snapshot_from_result(
-                batch_result, 'snapName', snapshot_name)
-            if snapshot_info:
+
+        return iter(self.paginate(_fetch_page, page_size,
+                                  stream=self.list_streaming,
+                                  record_type=fs_records.SnapshotRecord))
+
+    def query_snapshot_by_name(self, pool_id, snapshot_name):
+        for snapshot_info in self.iter_snapshots(pool_id, snapshot_name):
+            if snapshot_info.get('snapName') == snapshot_name:
                 return snapshot_info
-            if batch_result.get('totalNum') < batch_size:
-                break
-            batch_num += 1
         return None
 
     def create_snapshot(self, snapshot_name, vol_name):
@@ -377,6 +1964,7 @@ class RestCommon(object):
         result = self.call(url, "POST", params)
         self._assert_rest_result(
             result, _('Create volume from snapshot session error.'))
+        self.volume_index.add_created(vol_name)
 
     def create_volume_from_volume(self, vol_name, vol_size, src_vol_name):
         temp_snapshot_name = "temp" + src_vol_name + "clone" + vol_name
@@ -389,6 +1977,64 @@ class RestCommon(object):
 
         self.delete_snapshot(snapshot_name=temp_snapshot_name)
 
+    @staticmethod
+    def _get_item_result(result, item, items):
+        """Pick the outcome of one item out of a multi item result.
+
+        Return None when the failure can not be attributed to the items.
+        """
+        if len(items) == 1 or not isinstance(result, dict):
+            return result
+
+        code = result.get('result')
+        if isinstance(code, dict):
+            code = code.get('code')
+        if code == 0:
+            return result
+
+        detail = result.get('detail')
+        if code != constants.DSWARE_MULTI_ERROR or not detail:
+            return None
+
+        def _is_item_error(err, name):
+            return isinstance(err, dict) and name in [
+                value for value in err.values()
+                if isinstance(value, six.string_types)]
+
+        if not all(any(_is_item_error(err, name) for name in items)
+                   for err in detail):
+            return None
+
+        own_detail = [err for err in detail if _is_item_error(err, item)]
+        if not own_detail:
+            return {"result": 0}
+        return {"result": constants.DSWARE_MULTI_ERROR,
+                "errorCode": own_detail[0].get("errorCode"),
+                "detail": own_detail}
+
+    def _call_batched(self, url, params, list_key, item):
+        """Send a single item call, merged with compatible ones.
+
+        params holds the parameters shared by the merged calls, list_key
+        is the parameter taking the list of items.
+        """
+        def _send(items):
+            batch_params = dict(params)
+            batch_params[list_key] = items
+            return self.call(url, "POST", batch_params)
+
+        key = (url, json.dumps(params, sort_keys=True))
+        result, items = self.batcher.submit(key, item, _send)
+        item_result = self._get_item_result(result, item, items)
+        if item_result is None:
+            # The merged request failed as a whole, find out the outcome
+            # of this item alone.
+            LOG.warning("Batched request %(url)s for %(items)s failed, "
+                        "send it again for %(item)s alone.",
+                        {"url": url, "items": items, "item": item})
+            item_result = _send([item])
+        return item_result
+
     @staticmethod
     def _is_detail_error(result, detail_error_code):
         if result.get("result", "") == constants.DSWARE_MULTI_ERROR:
@@ -398,10 +2044,33 @@ class RestCommon(object):
             return False
         return True
 
+    @classmethod
+    def _is_done(cls, result, detail_error_code=None):
+        """Whether the call succeeded or its change was already made."""
+        if result.get("result") == 0:
+            return True
+        return (detail_error_code is not None and
+                result.get("result") == constants.DSWARE_MULTI_ERROR and
+                cls._is_detail_error(result, detail_error_code))
+
+    def get_topology(self):
+        """Return the topology index, listing the array when stale."""
+        if not self.topology.is_fresh():
+            generation = self.topology.generation
+            hosts = [host.get("hostName") for host in self.get_all_host()]
+            host_groups = [group.get("hostGroupName")
+                           for group in self.get_all_hostgroup()]
+            initiators = [initiator.get("portName")
+                          for initiator in self.get_all_initiator_on_array()]
+            self.topology.load(hosts, host_groups, initiators, generation)
+        return self.topology
+
     def create_host(self, host_name):
         url = '/host/create'
         params = {"hostName": host_name}
         result = self.call(url, "POST", params)
+        if self._is_done(result, constants.HOST_ALREADY_EXIST):
+            self.topology.add_host(host_name)
         if self._is_detail_error(result, constants.HOST_ALREADY_EXIST):
             return None
 
@@ -411,6 +2080,8 @@ class RestCommon(object):
         url = '/host/delete'
         params = {"hostName": host_name}
         result = self.call(url, "POST", params)
+        if self._is_done(result):
+            self.topology.remove_host(host_name)
         if self._is_detail_error(result, constants.HOST_MAPPING_EXIST):
             return None
 
@@ -420,7 +2091,7 @@ class RestCommon(object):
         url = '/host/list'
         result = self.call(url, "GET")
         self._assert_rest_result(result, _('Get all host session error'))
-        return result.get("hostList", [])
+        return fs_records.HostRecord.from_list(result.get("hostList"))
 
     def get_host_by_volume(self, vol_name):
         url = '/lun/host/list'
@@ -428,15 +2099,54 @@ class RestCommon(object):
         result = self.call(url, "POST", params)
         self._assert_rest_result(
             result, _("Get host by volume name session error"))
-        return result.get("hostList", [])
+        return fs_records.LunMappingRecord.from_list(result.get("hostList"))
+
+    def iter_hosts_by_volume(self, vol_name):
+        url = '/lun/host/list'
+        params = {"lunName": vol_name}
+        result, hosts = self._call_list(url, params, 'hostList')
+        self._assert_rest_result(
+            result, _("Get host by volume name session error"))
+        return (fs_records.LunMappingRecord.from_dict(host) for host in hosts)
 
     def map_volume_to_host(self, host_name, vol_name):
         url = '/host/lun/add'
-        params = {"hostName": host_name, "lunNames": [vol_name]}
-        result = self.call(url, "POST", params)
+        params = {"hostName": host_name}
+        result = self._call_batched(url, params, "lunNames", vol_name)
         self._assert_rest_result(
             result, _("Map volumes to host session error"))
 
+    def _call_for_volumes(self, url, host_name, vol_names, err_str):
+        """Send one host LUN request for all the volumes.
+
+        Return the exception of each volume the request failed for. A
+        volume whose outcome can not be told from the result of the whole
+        request is sent again alone.
+        """
+        params = {"hostName": host_name, "lunNames": list(vol_names)}
+        result = self.call(url, "POST", params)
+        failures = {}
+        for vol_name in vol_names:
+            vol_result = self._get_item_result(result, vol_name, vol_names)
+            if vol_result is None:
+                vol_result = self.call(url, "POST", {"hostName": host_name,
+                                                     "lunNames": [vol_name]})
+            try:
+                self._assert_rest_result(vol_result, err_str)
+            except exception.VolumeBackendAPIException as err:
+                failures[vol_name] = err
+        return failures
+
+    def map_volumes_to_host(self, host_name, vol_names):
+        return self._call_for_volumes(
+            '/host/lun/add', host_name, vol_names,
+            _("Map volumes to host session error"))
+
+    def unmap_volumes_from_host(self, host_name, vol_names):
+        return self._call_for_volumes(
+            '/host/lun/delete', host_name, vol_names,
+            _("Unmap volumes from host session error"))
+
     def unmap_volume_from_host(self, host_name, vol_name):
         url = '/host/lun/delete'
         params = {"hostName": host_name, "lunNames": [vol_name]}
@@ -450,7 +2160,8 @@ class RestCommon(object):
         result = self.call(url, "POST", params)
         self._assert_rest_result(
             result, "Get host mapped lun info session error")
-        return result.get("hostLunList", [])
+        return fs_records.LunMappingRecord.from_list(
+            result.get("hostLunList"))
 
     def get_associate_initiator_by_host_name(self, host_name):
         url = '/port/host/list'
@@ -464,6 +2175,8 @@ class RestCommon(object):
         url = '/hostGroup/add'
         params = {"hostGroupName": host_group_name}
         result = self.call(url, "POST", params)
+        if self._is_done(result, constants.HOSTGROUP_ALREADY_EXIST):
+            self.topology.add_host_group(host_group_name)
         if self._is_detail_error(result, constants.HOSTGROUP_ALREADY_EXIST):
             return None
         self._assert_rest_result(
@@ -475,6 +2188,7 @@ class RestCommon(object):
         result = self.call(url, "POST", params)
         self._assert_rest_result(
             result, _("Delete HostGroup session error"))
+        self.topology.remove_host_group(host_group_name)
 
     def get_all_hostgroup(self):
         url = '/hostGroup/list'
@@ -486,6 +2200,8 @@ class RestCommon(object):
         url = '/hostGroup/host/add'
         params = {"hostGroupName": host_group_name, "hostList": [host_name]}
         result = self.call(url, "POST", params)
+        if self._is_done(result, constants.HOST_MAPPING_GROUP_EXIST):
+            self.topology.add_host_to_group(host_group_name, host_name)
         if self._is_detail_error(result, constants.HOST_MAPPING_GROUP_EXIST):
             return None
 
@@ -498,6 +2214,7 @@ class RestCommon(object):
         result = self.call(url, "POST", params)
         self._assert_rest_result(
             result, _("Delete host from HostGroup session error"))
+        self.topology.remove_host_from_group(host_group_name, host_name)
 
     def get_host_in_hostgroup(self, host_group_name):
         url = '/hostGroup/host/list'
@@ -513,12 +2230,14 @@ class RestCommon(object):
         result = self.call(url, "POST", params)
         self._assert_rest_result(
             result, _("Get all initiator on array session error"))
-        return result.get("portList", [])
+        return fs_records.InitiatorRecord.from_list(result.get("portList"))
 
     def add_initiator_to_array(self, initiator_name):
         url = 'iscsi/createPort'
         params = {"portName": initiator_name}
         result = self.call(url, "POST", params, get_version=True)
+        if self._is_done(result, constants.INITIATOR_ALREADY_EXIST):
+            self.topology.add_initiator(initiator_name)
         if self._is_detail_error(result, constants.INITIATOR_ALREADY_EXIST):
             return None
         self._assert_rest_result(
@@ -530,6 +2249,7 @@ class RestCommon(object):
         result = self.call(url, "POST", params, get_version=True)
         self._assert_rest_result(
             result, _("Remove initiator from array session error"))
+        self.topology.remove_initiator(initiator_name)
 
     def add_initiator_to_host(self, host_name, initiator):
         url = '/host/port/add'
@@ -539,9 +2259,11 @@ class RestCommon(object):
             associate_host_ini = self.get_associate_initiator_by_host_name(
                 host_name)
             if initiator in associate_host_ini:
+                self.topology.add_initiator_to_host(host_name, initiator)
                 return None
         self._assert_rest_result(
             result, _("Add initiator to host session error"))
+        self.topology.add_initiator_to_host(host_name, initiator)
 
     def delete_initiator_from_host(self, host_name, initiator):
         url = '/host/port/delete'
@@ -549,11 +2271,11 @@ class RestCommon(object):
         result = self.call(url, "POST", params)
         self._assert_rest_result(
             result, _("Delete initiator from host session error"))
+        self.topology.remove_initiator_from_host(host_name, initiator)
 
     def get_host_associate_initiator(self, initiator):
         url = '/host/port/list'
-        params = {"portName": [initiator]}
-        result = self.call(url, "POST", params)
+        result = self._call_batched(url, {}, "portName", initiator)
         self._assert_rest_result(
             result, _("Get host by initiator session error"))
         return result['portHostMap'].get(initiator, [])
@@ -589,8 +2311,8 @@ class RestCommon(object):
 
     def associate_qos_with_volume(self, vol_name, qos_name):
         url = "/qos/volume/associate"
-        params = {"keyNames": [vol_name], "qosName": qos_name}
-        result = self.call(url, "POST", params)
+        params = {"qosName": qos_name}
+        result = self._call_batched(url, params, "keyNames", vol_name)
         self._assert_rest_result(
             result, _("Associate QoS with volume session error"))
 
@@ -623,6 +2345,13 @@ class RestCommon(object):
             result, _("Get QoS info session error"))
         return result.get("volumes", [])
 
+    def iter_qos_volumes(self, pool_id, qos_name, page_size=None):
+        def _fetch_page(batch_num, batch_size):
+            return self.get_qos_volume_info(
+                pool_id, qos_name, batch_num, batch_size), None
+
+        return iter(self.paginate(_fetch_page, page_size))
+
     def get_fsm_version(self):
         url = "/version"
         result = self.call(url, "GET")
@@ -694,6 +2423,8 @@ class RestCommon(object):
     def add_iscsi_host_relation(self, host_name, ip_list):
         if not ip_list:
             return
+        if self.capabilities.supports_api("iscsi_host_relation") is False:
+            return None
         url = "/dsware/service/iscsi/addIscsiHostRelation"
         ip_strings = ";".join(ip_list)
         params = [{"content": ip_strings, "key": host_name, "flag": 0}]
@@ -712,6 +2443,8 @@ class RestCommon(object):
                 raise
 
     def _get_iscsi_host_relation(self, key):
+        if self.capabilities.supports_api("iscsi_host_relation") is False:
+            return {}
         url = "/dsware/service/iscsi/queryIscsiHostRelation"
         params = [{"key": key, "flag": 0}]
         try:
@@ -738,6 +2471,8 @@ class RestCommon(object):
         if not ip_list:
             return
 
+        if self.capabilities.supports_api("iscsi_host_relation") is False:
+            return None
         url = "/dsware/service/iscsi/deleteIscsiHostRelation"
         ip_strings = ";".join(ip_list)
         params = [{"content": ip_strings, "key": host_name, "flag": 0}]
@@ -800,15 +2535,11 @@ class RestCommon(object):
         self._assert_rest_result(result,
                                  _("Delete lun migration task error."))
 
-    def get_volume_snapshot(self, volume_name):
-        url = "/volume/snapshot/list"
-        params = {
-            'volName': volume_name,
-            'batchNum': 1,
-            'batchLimit': 10
-        }
-        result = self.call(url, "POST", params)
-        return result.get('snapshotList', [])
+    def volume_has_snapshot(self, volume_name):
+        for _snapshot in self.iter_snapshots_of_volume(
+                volume_name, page_size=1):
+            return True
+        return False
 
     def create_consistent_snapshot_by_name(self, snapshot_group_list):
         url = "/api/v2/block_service/consistency_snapshots"
@@ -822,13 +2553,17 @@ class RestCommon(object):
         result = self.call(url, "POST", params, get_system_time=True)
         self._assert_rest_result(
             result, _("create full volume from snap fails"))
+        self.volume_index.add_created(vol_name)
 
     def is_support_links_balance_by_pool(self):
-        result = self._get_iscsi_host_relation('get_newiscsi')
-        if result.get("newIscsi"):
-            LOG.info("Support new iscsi interface to get iscsi ip.")
-            return True
-        return False
+        new_iscsi = self.capabilities.new_iscsi
+        if new_iscsi is None:
+            result = self._get_iscsi_host_relation('get_newiscsi')
+            new_iscsi = bool(result.get("newIscsi"))
+            self.capabilities.update(new_iscsi=new_iscsi)
+            if new_iscsi:
+                LOG.info("Support new iscsi interface to get iscsi ip.")
+        return new_iscsi
 
     def get_iscsi_links_by_pool(self, iscsi_link_count, pool_name, host_name):
         url = "/dsware/service/iscsi/queryIscsiLinks"
@@ -0,0 +1,238 @@
+# Copyright (c) 2018 Huawei Technologies Co., Ltd.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import codecs
+import json
+
+from oslo_log import log as logging
+from oslo_utils import importutils
+
+LOG = logging.getLogger(__name__)
+
+orjson = importutils.try_import('orjson')
+ujson = importutils.try_import('ujson')
+
+_DECODER = json.JSONDecoder()
+_WHITESPACE = ' \t\n\r'
+_DELIMITERS = ',:]}' + _WHITESPACE
+
+
+class JsonCodec(object):
+    """Encode the REST request bodies and decode the responses.
+
+    loads takes the raw response content and raises ValueError when it
+    is not JSON, whatever the library.
+    """
+
+    name = "json"
+
+    @staticmethod
+    def is_available():
+        return True
+
+    def dumps(self, obj):
+        return json.dumps(obj)
+
+    def loads(self, content):
+        if isinstance(content, bytes):
+            content = content.decode('utf-8')
+        return json.loads(content)
+
+
+class OrjsonCodec(JsonCodec):
+    name = "orjson"
+
+    @staticmethod
+    def is_available():
+        return orjson is not None
+
+    def dumps(self, obj):
+        try:
+            return orjson.dumps(obj)
+        except TypeError:
+            # orjson refuses some objects json handles, such as integers
+            # over 64 bits or non string keys.
+            return super(OrjsonCodec, self).dumps(obj)
+
+    def loads(self, content):
+        return orjson.loads(content)
+
+
+class UjsonCodec(JsonCodec):
+    name = "ujson"
+
+    @staticmethod
+    def is_available():
+        return ujson is not None
+
+    def dumps(self, obj):
+        try:
+            return ujson.dumps(obj, escape_forward_slashes=False)
+        except (TypeError, OverflowError):
+            return super(UjsonCodec, self).dumps(obj)
+
+    def loads(self, content):
+        return ujson.loads(content)
+
+
+CODECS = {
+    "json": JsonCodec,
+    "orjson": OrjsonCodec,
+    "ujson": UjsonCodec,
+}
+
+# The codecs tried by "auto", fastest first.
+AUTO_CODECS = ("orjson", "ujson", "json")
+
+
+def get_codec(name="auto"):
+    """Return the JSON codec, falling back to json when it is missing."""
+    if name == "auto":
+        for codec_name in AUTO_CODECS:
+            if CODECS[codec_name].is_available():
+                return CODECS[codec_name]()
+
+    codec = CODECS.get(name, JsonCodec)
+    if not codec.is_available():
+        LOG.warning("The JSON library %s is not installed, use json "
+                    "instead.", name)
+        codec = JsonCodec
+    return codec()
+
+
+class JsonListStream(dict):
+    """A JSON object response whose list member is decoded lazily.
+
+    The members of the object are decoded into the dict as soon as the
+    stream is created, up to the list member list_key. iter_records then
+    decodes the list one record at a time from the response stream and
+    adds the members following the list to the dict, so that a lookup
+    can stop early without the whole document being held in memory. The
+    response is closed when the document ends or the iteration stops.
+    """
+
+    def __init__(self, response, list_key, chunk_size=64 * 1024):
+        super(JsonListStream, self).__init__()
+        self.list_key = list_key
+        self._response = response
+        self._chunks = response.iter_content(chunk_size)
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        self._buffer = ''
+        self._pos = 0
+        self._eof = False
+        self._in_list = False
+        try:
+            if self._skip_whitespace() != '{':
+                raise ValueError("The response is not a JSON object.")
+            self._pos += 1
+            self._read_members()
+        except Exception:
+            self.close()
+            raise
+
+    def _fill(self):
+        if self._eof:
+            return False
+        chunk = next(self._chunks, None)
+        if chunk is None:
+            self._eof = True
+            text = self._decoder.decode(b'', final=True)
+        else:
+            text = self._decoder.decode(chunk)
+        # Drop the decoded text, only the current token is kept.
+        self._buffer = self._buffer[self._pos:] + text
+        self._pos = 0
+        return True
+
+    def _skip_whitespace(self):
+        """Return the next significant character, None at the end."""
+        while True:
+            while (self._pos < len(self._buffer) and
+                   self._buffer[self._pos] in _WHITESPACE):
+                self._pos += 1
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._fill():
+                return None
+
+    def _decode_value(self):
+        self._skip_whitespace()
+        while True:
+            try:
+                value, end = _DECODER.raw_decode(self._buffer, self._pos)
+            except ValueError:
+                if not self._fill():
+                    raise
+                continue
+            # A number cut by the end of the buffer, such as "1." of
+            # "1.5", goes on in the next chunk.
+            if (end == len(self._buffer) or
+                    self._buffer[end] not in _DELIMITERS) and self._fill():
+                continue
+            self._pos = end
+            return value
+
+    def _expect(self, char):
+        if self._skip_whitespace() != char:
+            raise ValueError("Invalid JSON response, %s is expected at %s."
+                             % (char, self._buffer[self._pos:][:20]))
+        self._pos += 1
+
+    def _read_members(self):
+        while True:
+            char = self._skip_whitespace()
+            if char == ',':
+                self._pos += 1
+                continue
+            if char == '}':
+                self._pos += 1
+                self.close()
+                return
+            if char != '"':
+                raise ValueError("Invalid JSON response, a member name is "
+                                 "expected.")
+
+            key = self._decode_value()
+            self._expect(':')
+            if key == self.list_key and self._skip_whitespace() == '[':
+                self._pos += 1
+                self._in_list = True
+                return
+            self[key] = self._decode_value()
+
+    def iter_records(self):
+        if not self._in_list:
+            return
+        try:
+            while True:
+                char = self._skip_whitespace()
+                if char == ',':
+                    self._pos += 1
+                    continue
+                if char == ']':
+                    self._pos += 1
+                    break
+                if char is None:
+                    raise ValueError("The JSON response is truncated.")
+                yield self._decode_value()
+
+            self._in_list = False
+            self._read_members()
+        finally:
+            self.close()
+
+    def close(self):
+        self._in_list = False
+        self._response.close()
@@ -21,8 +21,92 @@ GET_SNAPSHOT_PAGE_NUM = 1
 GET_SNAPSHOT_PAGE_SIZE = 1000
 GET_QOS_PAGE_NUM = 1
 GET_QOS_PAGE_SIZE = 100
+QOS_ASSOCIATE_PAGE_SIZE = 5
+VOLUME_INDEX_MISS_TTL = 60
+TOPOLOGY_REFRESH_INTERVAL = 300
+REST_BATCH_MAX_ITEMS = 100
+
+ENDPOINT_FAILURE_THRESHOLD = 3
+ENDPOINT_LATENCY_EWMA_ALPHA = 0.3
+ENDPOINT_RETRY_INTERVAL = 30
+READ_ONLY_POST_URLS = (
+    '/volume/list', '/volume/snapshot/list', '/snapshot/list',
+    '/lun/host/list', '/host/lun/list', '/port/host/list',
+    '/hostGroup/host/list', '/port/list', '/host/port/list',
+    '/iscsi/port/list', '/qos/volume/list',
+    '/dsware/service/cluster/dswareclient/queryIscsiPortal',
+    '/dsware/service/iscsi/queryIscsiHostRelation',
+    '/dsware/service/iscsi/queryVbsIscsiLinks')
+
+# Query results which may be cached, with their default TTL in seconds.
+REST_CACHE_TTL = {
+    '/storagePool': 10,
+    '/host/list': 60,
+    '/hostGroup/list': 60,
+    '/port/list': 60,
+    '/dsware/service/cluster/dswareclient/queryIscsiPortal': 60,
+}
+# Cached query paths which are invalidated by each mutating call.
+REST_CACHE_INVALIDATION = {
+    '/host/create': ('/host/list',),
+    '/host/delete': ('/host/list',),
+    '/hostGroup/add': ('/hostGroup/list',),
+    '/hostGroup/delete': ('/hostGroup/list',),
+    'iscsi/createPort': ('/port/list',),
+    'iscsi/deletePort': ('/port/list',),
+    '/host/port/add': ('/port/list',),
+    '/host/port/delete': ('/port/list',),
+    '/volume/create': ('/storagePool',),
+    '/volume/delete': ('/storagePool',),
+    '/volume/expand': ('/storagePool',),
+    '/snapshot/create': ('/storagePool',),
+    '/snapshot/delete': ('/storagePool',),
+    '/snapshot/volume/create': ('/storagePool',),
+    '/api/v2/block_service/createFullVolumeFromSnap': ('/storagePool',),
+    '/api/v2/block_service/consistency_snapshots': ('/storagePool',),
+    '/api/v2/block_service/lun_migration': ('/storagePool',),
+}
+# Mutating calls which are safe to send again, either because they set an
+# absolute state or because the driver tolerates "already exists" and
+# "does not exist" answers for them.
+IDEMPOTENT_WRITE_URLS = (
+    '/sec/login', '/sec/keepAlive', '/host/create', '/hostGroup/add',
+    '/hostGroup/host/add', 'iscsi/createPort', '/host/port/add',
+    '/volume/delete', '/snapshot/delete', '/qos/modify',
+    '/dsware/service/iscsi/addIscsiHostRelation')
+
+REST_RETRY_MAX_ATTEMPTS = 3
+REST_RETRY_BASE_INTERVAL = 1
+REST_RETRY_MAX_INTERVAL = 10
+REST_RETRY_DEADLINE = 120
+# The array rejected the request without running it.
+REST_BUSY_ERROR_CODES = (429, 503, 1077949006)
+# The request may or may not have reached the array. The connect error of
+# the driver is retried too, but not an HTTP 403 which shares its code.
+REST_IDEMPOTENT_RETRY_CODES = (500, 502, 504)
+
+CIRCUIT_STATES = (
+    CIRCUIT_CLOSED,
+    CIRCUIT_OPEN,
+    CIRCUIT_HALF_OPEN) = ('closed', 'open', 'half-open')
+CIRCUIT_FAILURE_THRESHOLD = 5
+CIRCUIT_RESET_TIMEOUT = 30
+
+REST_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                        1, 2.5, 5, 10, 25, 50)
+REST_METRICS_LOG_TOP = 10
+
+ADAPTIVE_TIMEOUT_PERCENTILE = 99
+ADAPTIVE_TIMEOUT_MULTIPLIER = 3
+ADAPTIVE_TIMEOUT_FLOOR = 5
+ADAPTIVE_TIMEOUT_WINDOW = 200
+ADAPTIVE_TIMEOUT_MIN_SAMPLES = 20
 
 CONNECT_ERROR = 403
+DEADLINE_EXCEEDED_ERROR = 408001
+CIRCUIT_OPEN_ERROR = 503001
+HTTP_UNAUTHORIZED = 401
+RELOGIN_INTERVAL = 10
 ERROR_UNAUTHORIZED = 10000003
 ERROR_USER_OFFLINE = '1077949069'
 VOLUME_NOT_EXIST = (31000000, 50150005, 32150005)
@@ -61,6 +145,9 @@ QOS_PREFIX = "OpenStack_"
 QOS_SCHEDULER_DEFAULT_TYPE = "0"
 QOS_SCHEDULER_WEEK_TYPE = "3"
 QOS_SUPPORT_SCHEDULE_VERSION = "8.0"
+# Seconds the time zone and DST configuration of the array are cached.
+SYSTEM_TIME_CACHE_TTL = 3600
+DST_TIME_FORMAT = "%m-%d %H:%M:%S"
 QOS_MAX_INTERCEPT_LENGTH = 36
 SECONDS_OF_DAY = 24 * 60 * 60
 SECONDS_OF_HOUR = 60 * 60
@@ -95,3 +182,10 @@ REST_VOLUME_CREATING_STATUS = 15
 REST_VOLUME_DUPLICATE_VOLUME = 6
 REST_VOLUME_CREATE_SUCCESS_STATUS = 0
 CLONE_VOLUME_TIMEOUT = 3600 * 24 * 30
+
+# The REST API families probed after login, with a read only URL of each
+# family and the call arguments that build its full URL.
+API_FAMILY_PROBES = (
+    ("v1.3", "v1.3/volume/queryById?volId=0", {"get_version": True}),
+    ("v2", "/api/v2/common/time_config", {"get_system_time": True}),
+)
@@ -43,13 +43,12 @@ class FusionStorageQoS(object):
 
     def _is_qos_associate_to_volume(self, qos_name):
         all_pools = self.client.query_pool_info()
-        volumes = None
         for pool in all_pools:
-            volumes = self.client.get_qos_volume_info(
-                pool.get('poolId'), qos_name)
-            if volumes:
-                break
-        return volumes
+            for _volume in self.client.iter_qos_volumes(
+                    pool.get('poolId'), qos_name,
+                    page_size=constants.QOS_ASSOCIATE_PAGE_SIZE):
+                return True
+        return False
 
     def remove(self, vol_name):
         vol_qos = self.client.get_qos_by_vol_name(vol_name)
@@ -0,0 +1,400 @@
+# Copyright (c) 2018 Huawei Technologies Co., Ltd.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Attach and detach benchmark of the FusionStorage iSCSI driver.
+
+Drives DSWAREISCSIDriver.initialize_connection and terminate_connection
+from eventlet greenthreads, the way cinder-volume runs them, against a
+local FusionStorage simulator (tools/fs_simulator.py) started in a
+subprocess. It needs an environment where cinder and the FusionStorage
+driver are installed:
+
+    python tools/fs_benchmark.py --concurrency 1,10,100,500 --hosts 50 \\
+        --volumes-per-host 4 --latency 0.005 --output results.json
+
+Every combination of target discovery mode and concurrency runs on an
+empty array, first attaching every volume to its host and then
+detaching them. For each phase it reports the ops/sec, the latency
+percentiles, the REST calls per operation seen by the client and the
+requests per operation received by the simulator. The results are
+written as JSON and can be compared with the results of a previous
+release with --baseline.
+"""
+
+import eventlet
+eventlet.monkey_patch()
+
+import argparse  # noqa: E402
+import base64  # noqa: E402
+import json  # noqa: E402
+import os  # noqa: E402
+import platform  # noqa: E402
+import random  # noqa: E402
+import shutil  # noqa: E402
+import socket  # noqa: E402
+import subprocess  # noqa: E402
+import sys  # noqa: E402
+import tempfile  # noqa: E402
+import time  # noqa: E402
+from urllib import request as urlrequest  # noqa: E402
+
+from oslo_config import cfg  # noqa: E402
+
+from cinder.common import config  # noqa: E402,F401
+from cinder import coordination  # noqa: E402
+from cinder.volume import configuration  # noqa: E402
+from cinder.volume import driver  # noqa: E402
+from cinder.volume.drivers.fusionstorage import dsware  # noqa: E402
+
+CONF = cfg.CONF
+SIMULATOR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         "fs_simulator.py")
+POOL_NAME = "pool0"
+MODES = ("iscsi_manager_groups", "target_ips", "links_balance_by_pool",
+         "storage_links")
+PERCENTILES = (50, 90, 95, 99)
+
+
+class BenchmarkVolume(dict):
+    """The attributes of a cinder Volume that the driver reads."""
+
+    def __init__(self, name, backend):
+        super(BenchmarkVolume, self).__init__(provider_location=None)
+        self.id = self.name = name
+        self.host = "%s@%s#%s" % (socket.gethostname(), backend, POOL_NAME)
+        self.multiattach = False
+        self.volume_attachment = []
+
+
+def _get_free_port():
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def _encode(text):
+    return "!&&&" + base64.b64encode(text.encode("utf-8")).decode()
+
+
+def _get_mode_conf(mode, node_ips):
+    if mode == "iscsi_manager_groups":
+        groups = [";".join(node_ips[i:i + 2])
+                  for i in range(0, len(node_ips), 2)]
+        return {"iscsi_manager_groups": ",".join(groups)}
+    if mode == "target_ips":
+        return {"target_ips": ",".join(node_ips)}
+    return {}
+
+
+class Simulator(object):
+    """A fs_simulator.py subprocess and its control API."""
+
+    def __init__(self, args):
+        self.port = _get_free_port()
+        self.address = "http://127.0.0.1:%s" % self.port
+        self.node_ips = ["10.0.0.%s" % (i + 1) for i in range(args.nodes)]
+        self.process = subprocess.Popen(
+            [sys.executable, SIMULATOR, "--port", str(self.port),
+             "--nodes", str(args.nodes), "--latency", str(args.latency),
+             "--jitter", str(args.jitter)])
+        self._wait_ready()
+
+    def _control(self, path, body=None):
+        data = json.dumps(body).encode("utf-8") if body is not None else None
+        req = urlrequest.Request(self.address + path, data=data,
+                                 method="POST" if data else "GET")
+        with urlrequest.urlopen(req, timeout=60) as response:
+            return json.loads(response.read().decode("utf-8"))
+
+    def _wait_ready(self, timeout=30):
+        deadline = time.time() + timeout
+        while True:
+            try:
+                return self._control("/simulator/stats")
+            except (IOError, OSError):
+                if time.time() > deadline or self.process.poll() is not None:
+                    raise RuntimeError("The simulator did not start.")
+                time.sleep(0.1)
+
+    def reset(self, volumes, new_iscsi):
+        return self._control("/simulator/reset", {"volumes": volumes,
+                                                  "new_iscsi": new_iscsi})
+
+    def get_request_count(self):
+        return self._control("/simulator/stats")["total"]
+
+    def stop(self):
+        self.process.terminate()
+        self.process.wait()
+
+
+def write_config(path, simulator, state_path):
+    lines = ["[DEFAULT]",
+             "state_path = %s" % state_path,
+             "enabled_backends = %s" % ",".join(
+                 "fs_bench_%s" % mode for mode in MODES),
+             "",
+             "[coordination]",
+             "backend_url = file://%s" % os.path.join(state_path, "locks"),
+             ""]
+    for mode in MODES:
+        lines.extend(["[fs_bench_%s]" % mode,
+                      "volume_driver = cinder.volume.drivers.fusionstorage."
+                      "dsware.DSWAREISCSIDriver",
+                      "volume_backend_name = fs_bench_%s" % mode,
+                      "dsware_rest_url = %s" % simulator.address,
+                      "san_login = %s" % _encode("admin"),
+                      "san_password = %s" % _encode("admin"),
+                      "dsware_storage_pools = %s" % POOL_NAME])
+        for key, value in _get_mode_conf(mode, simulator.node_ips).items():
+            lines.append("%s = %s" % (key, value))
+        lines.append("")
+
+    with open(path, "w") as f:
+        f.write("\n".join(lines))
+
+
+def create_driver(backend):
+    conf = configuration.Configuration(driver.volume_opts,
+                                       config_group=backend)
+    iscsi_driver = dsware.DSWAREISCSIDriver(
+        configuration=conf, host="%s@%s" % (socket.gethostname(), backend))
+    iscsi_driver.do_setup(None)
+    iscsi_driver.check_for_setup_error()
+    return iscsi_driver
+
+
+def percentile(sorted_values, percent):
+    if not sorted_values:
+        return 0.0
+    index = int(round(percent / 100.0 * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+
+def get_rest_call_count(client):
+    return sum(call["count"] for call in client.get_metrics()["calls"].values())
+
+
+def run_phase(name, func, operations, concurrency, client, simulator):
+    latencies = []
+    errors = {}
+
+    def _run(operation):
+        volume, connector = operation
+        start = time.time()
+        try:
+            func(volume, connector)
+        except Exception as err:
+            key = "%s: %s" % (err.__class__.__name__, err)
+            errors[key] = errors.get(key, 0) + 1
+        latencies.append(time.time() - start)
+
+    calls_before = get_rest_call_count(client)
+    requests_before = simulator.get_request_count()
+    pool = eventlet.GreenPool(concurrency)
+    start = time.time()
+    for _ in pool.imap(_run, operations):
+        pass
+    elapsed = time.time() - start
+    calls = get_rest_call_count(client) - calls_before
+    requests = simulator.get_request_count() - requests_before
+
+    latencies.sort()
+    count = len(operations)
+    result = {
+        "operation": name,
+        "ops": count,
+        "errors": sum(errors.values()),
+        "error_samples": dict(sorted(errors.items(),
+                                     key=lambda item: -item[1])[:5]),
+        "elapsed": elapsed,
+        "ops_per_sec": count / elapsed if elapsed else 0.0,
+        "latency": dict(("p%s" % p, percentile(latencies, p))
+                        for p in PERCENTILES),
+        "rest_calls_per_op": float(calls) / count if count else 0.0,
+        "simulator_requests_per_op":
+            float(requests) / count if count else 0.0,
+    }
+    result["latency"]["mean"] = (sum(latencies) / count if count else 0.0)
+    result["latency"]["max"] = latencies[-1] if latencies else 0.0
+    return result
+
+
+def run(mode, concurrency, args, simulator):
+    backend = "fs_bench_%s" % mode
+    volume_count = args.hosts * args.volumes_per_host
+    simulator.reset(volume_count, mode == "links_balance_by_pool")
+    iscsi_driver = create_driver(backend)
+
+    # Volume i of the array goes to host i % hosts, so that consecutive
+    # operations hit different hosts the way a batch of boots does.
+    operations = []
+    for index in range(volume_count):
+        host_index = index % args.hosts
+        connector = {
+            "host": "bench-host-%s" % host_index,
+            "initiator": "iqn.1994-05.com.redhat:bench-%s" % host_index,
+            "multipath": args.multipath,
+        }
+        operations.append((BenchmarkVolume("sim_volume_%s" % index, backend),
+                           connector))
+    if args.shuffle:
+        random.shuffle(operations)
+
+    results = []
+    for name, func in (("initialize_connection",
+                        iscsi_driver.initialize_connection),
+                       ("terminate_connection",
+                        iscsi_driver.terminate_connection)):
+        result = run_phase(name, func, operations, concurrency,
+                           iscsi_driver.client, simulator)
+        result.update({"mode": mode, "concurrency": concurrency,
+                       "hosts": args.hosts,
+                       "volumes_per_host": args.volumes_per_host})
+        results.append(result)
+        print_result(result)
+    return results
+
+
+def print_result(result):
+    sys.stderr.write(
+        "%(mode)-22s %(operation)-22s c=%(concurrency)-4s ops=%(ops)-6s "
+        "err=%(errors)-4s %(ops_per_sec)9.1f ops/s p50=%(p50).4fs "
+        "p99=%(p99).4fs calls/op=%(calls).1f\n" % {
+            "mode": result["mode"], "operation": result["operation"],
+            "concurrency": result["concurrency"], "ops": result["ops"],
+            "errors": result["errors"],
+            "ops_per_sec": result["ops_per_sec"],
+            "p50": result["latency"]["p50"],
+            "p99": result["latency"]["p99"],
+            "calls": result["rest_calls_per_op"]})
+
+
+def compare(results, baseline_path, tolerance):
+    """Return the runs whose throughput dropped more than tolerance."""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+
+    def _key(result):
+        return (result["mode"], result["operation"], result["concurrency"],
+                result["hosts"], result["volumes_per_host"])
+
+    previous = dict((_key(result), result) for result in baseline["results"])
+    regressions = []
+    for result in results:
+        old = previous.get(_key(result))
+        if not old or not old["ops_per_sec"]:
+            continue
+        change = result["ops_per_sec"] / old["ops_per_sec"] - 1
+        result["baseline_ops_per_sec"] = old["ops_per_sec"]
+        result["ops_per_sec_change"] = change
+        if change < -tolerance:
+            regressions.append(result)
+    return regressions
+
+
+def _int_list(value):
+    values = [int(v) for v in value.split(",") if v.strip()]
+    if not values or any(v < 1 or v > 500 for v in values):
+        raise argparse.ArgumentTypeError(
+            "concurrency values must be between 1 and 500")
+    return values
+
+
+def _mode_list(value):
+    modes = [v.strip() for v in value.split(",") if v.strip()]
+    unknown = set(modes) - set(MODES)
+    if unknown:
+        raise argparse.ArgumentTypeError(
+            "unknown modes %s, the modes are %s" % (sorted(unknown),
+                                                    ", ".join(MODES)))
+    return modes
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Benchmark iSCSI initialize/terminate_connection of "
+                    "the FusionStorage driver against a local simulator.")
+    parser.add_argument("--concurrency", type=_int_list, default=[1, 10, 100],
+                        help="comma separated greenthread counts, 1 to 500")
+    parser.add_argument("--hosts", type=int, default=20)
+    parser.add_argument("--volumes-per-host", type=int, default=5)
+    parser.add_argument("--modes", type=_mode_list, default=list(MODES),
+                        help="comma separated target discovery modes: %s"
+                             % ", ".join(MODES))
+    parser.add_argument("--nodes", type=int, default=4,
+                        help="storage nodes of the simulated array")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="seconds the simulator adds to every request")
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--multipath", action="store_true")
+    parser.add_argument("--shuffle", action="store_true",
+                        help="run the operations in random order")
+    parser.add_argument("--output", help="JSON result file, default stdout")
+    parser.add_argument("--baseline",
+                        help="JSON result file of a previous run to compare")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="ops/sec drop reported as a regression")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    state_path = tempfile.mkdtemp(prefix="fs_benchmark_")
+    simulator = Simulator(args)
+    try:
+        config_file = os.path.join(state_path, "cinder.conf")
+        write_config(config_file, simulator, state_path)
+        CONF(["--config-file", config_file], project="cinder",
+             default_config_files=[])
+        coordination.COORDINATOR.start()
+
+        results = []
+        for mode in args.modes:
+            for concurrency in args.concurrency:
+                results.extend(run(mode, concurrency, args, simulator))
+    finally:
+        simulator.stop()
+        shutil.rmtree(state_path, ignore_errors=True)
+
+    regressions = []
+    if args.baseline:
+        regressions = compare(results, args.baseline, args.tolerance)
+
+    report = {
+        "driver_version": dsware.DSWAREBaseDriver.VERSION,
+        "python": platform.python_version(),
+        "timestamp": int(time.time()),
+        "config": {"hosts": args.hosts,
+                   "volumes_per_host": args.volumes_per_host,
+                   "nodes": args.nodes, "latency": args.latency,
+                   "jitter": args.jitter, "multipath": args.multipath},
+        "results": results,
+        "regressions": [(r["mode"], r["operation"], r["concurrency"])
+                        for r in regressions],
+    }
+    data = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(data)
+    else:
+        print(data)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
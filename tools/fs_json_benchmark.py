@@ -0,0 +1,94 @@
+# Copyright (c) 2018 Huawei Technologies Co., Ltd.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""CPU cost of decoding large FusionStorage list responses.
+
+Compares the former handling of a logged REST response, which decoded
+the body with requests twice, with RestCommon decoding it once through
+each installed JSON codec of fs_json:
+
+    python tools/fs_json_benchmark.py --records 1000,10000,50000
+"""
+
+import argparse
+import json
+import sys
+import time
+
+import requests
+
+from cinder.volume.drivers.fusionstorage import fs_json
+
+
+def make_response(records):
+    body = {"result": 0, "totalNum": records, "volumeList": [
+        {"volName": "volume-%08d-0000-0000-0000-000000000000" % i,
+         "volId": i, "poolId": 0, "volSize": 10240, "status": 0,
+         "wwn": "6%031x" % i, "createTime": 1600000000 + i}
+        for i in range(records)]}
+    response = requests.Response()
+    response.status_code = 200
+    response._content = json.dumps(body).encode("utf-8")
+    response.headers["Content-Type"] = "application/json;charset=UTF-8"
+    return response
+
+
+def measure(func, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.process_time()
+        func()
+        elapsed = time.process_time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--records", default="1000,10000,50000",
+                        help="comma separated numbers of list records")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    codecs = [name for name in sorted(fs_json.CODECS)
+              if fs_json.CODECS[name].is_available()]
+    results = []
+    for records in [int(r) for r in args.records.split(",")]:
+        response = make_response(records)
+        # Logged calls used to decode the body for the log and again
+        # for the caller.
+        baseline = measure(lambda: (response.json(), response.json()),
+                           args.repeat)
+        result = {"records": records, "bytes": len(response.content),
+                  "requests_json_twice": baseline}
+        for name in codecs:
+            codec = fs_json.get_codec(name)
+            elapsed = measure(lambda: codec.loads(response.content),
+                              args.repeat)
+            result[name] = elapsed
+            result["%s_saved" % name] = 1 - elapsed / baseline
+        results.append(result)
+
+        sys.stderr.write("%8d records %9d bytes: requests x2 %.4fs, %s\n" % (
+            records, result["bytes"], baseline, ", ".join(
+                "%s %.4fs (-%.0f%%)" % (name, result[name],
+                                        result["%s_saved" % name] * 100)
+                for name in codecs)))
+
+    print(json.dumps({"codecs": codecs, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1153 @@
+# Copyright (c) 2018 Huawei Technologies Co., Ltd.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Local FusionStorage REST simulator.
+
+Stands in for the FusionStorage management plane (FSM) so that
+fs_client, fs_flow and dsware.py can be exercised without an array. It
+implements the REST APIs used by the driver on top of a stateful in
+memory model, and can inject latency and errors.
+
+Run it as a localhost server:
+
+    python tools/fs_simulator.py --port 28443 --volumes 100000
+
+and point the backend at it with "dsware_rest_url = http://127.0.0.1:28443"
+and "manager_ips" / "pools_name" matching the simulated nodes and pools.
+Or use it in process:
+
+    simulator = FusionStorageSimulator(volumes=1000)
+    simulator.start()
+    ... simulator.address ...
+    simulator.stop()
+
+Besides the FusionStorage APIs the server offers a control API:
+
+    POST   /simulator/reset     start over with an empty array, for example
+                                {"volumes": 1000, "new_iscsi": false}
+    GET    /simulator/stats     request counters and object counts
+    POST   /simulator/stats     reset the request counters
+    GET    /simulator/faults    the configured faults
+    POST   /simulator/faults    add a fault, for example
+                                {"path": "/host/lun/add", "latency": 0.5,
+                                 "error_rate": 0.1, "http_status": 503}
+    DELETE /simulator/faults    remove all faults
+
+The paths of faults and counters are the driver URLs, such as
+"/volume/list" or "/api/v2/block_service/lun_migration".
+"""
+
+import argparse
+import collections
+import itertools
+import json
+import random
+import ssl
+import sys
+import threading
+import time
+import uuid
+from http import server
+from urllib import parse
+
+BASIC_URI = '/dsware/service/'
+V12_URI = BASIC_URI + 'v1.2'
+
+DSWARE_MULTI_ERROR = 1
+ERROR_UNAUTHORIZED = 10000003
+VOLUME_NOT_EXIST = 50150005
+SNAPSHOT_NOT_EXIST = 50150006
+VOLUME_ALREADY_EXIST = 50150019
+HOST_ALREADY_EXIST = 50157019
+HOST_NOT_EXIST = 50157020
+INITIATOR_IN_HOST = 50157021
+HOST_MAPPING_EXIST = 50157027
+HOSTGROUP_ALREADY_EXIST = 50157044
+HOST_MAPPING_GROUP_EXIST = 50157058
+INITIATOR_ALREADY_EXIST = 50155102
+QOS_NOT_EXIST = 50156002
+HOST_ISCSI_RELATION_EXIST = 540157748
+
+VOLUME_CREATE_SUCCESS_STATUS = 0
+STATUS_HEALTH = 1
+STATUS_VOLUME_READY = 27
+SNAPSHOT_RUNNING_STATUS_ONLINE = 27
+MIGRATION_COMPLETE = 76
+ISCSI_PORT = 3260
+
+
+class SimulatorError(Exception):
+    def __init__(self, error_code, description=None, detail=None):
+        super(SimulatorError, self).__init__(description or str(error_code))
+        self.error_code = error_code
+        self.description = description or ""
+        self.detail = detail
+
+    def to_dict(self):
+        if self.detail is not None:
+            return {"result": DSWARE_MULTI_ERROR, "detail": self.detail}
+        return {"result": 1, "errorCode": self.error_code,
+                "description": self.description}
+
+
+class SimulatedArray(object):
+    """In memory model of the objects of one FusionStorage cluster.
+
+    All the objects are kept in dicts keyed by name, with the reverse
+    maps the APIs need, so that every call is independent of the number
+    of objects except the paged listings.
+    """
+
+    def __init__(self, pools=1, nodes=3, pool_capacity=100 * 1024 ** 2,
+                 new_iscsi=True):
+        self.lock = threading.RLock()
+        self.esn = "SIMULATOR%s" % uuid.uuid4().hex[:8].upper()
+        self.new_iscsi = new_iscsi
+        self._ids = itertools.count(1)
+
+        self.pools = collections.OrderedDict()
+        for pool_id in range(pools):
+            self.pools[pool_id] = {
+                "poolId": pool_id,
+                "poolName": "pool%s" % pool_id,
+                "totalCapacity": pool_capacity,
+                "volumes": collections.OrderedDict(),
+            }
+
+        self.nodes = []
+        for index in range(nodes):
+            self.nodes.append({
+                "nodeMgrIp": "10.0.0.%s" % (index + 1),
+                "iscsiPortalList": [{
+                    "iscsiPortal": "192.168.0.%s:%s" % (index + 1,
+                                                        ISCSI_PORT),
+                    "targetName": "iqn.2006-08.com.huawei:fs:%s:%s" % (
+                        self.esn.lower(), index + 1),
+                    "iscsiStatus": "active"}],
+                "status": "successful"})
+
+        self.volumes = {}
+        self.volumes_by_id = {}
+        self.snapshots = collections.OrderedDict()
+        self.hosts = collections.OrderedDict()
+        self.host_groups = collections.OrderedDict()
+        self.initiators = collections.OrderedDict()
+        self.qos = {}
+        self.migrations = {}
+        self.iscsi_relations = {}
+
+    # Volumes and snapshots.
+
+    def create_volume(self, vol_name, vol_size, pool_id, status=None):
+        if vol_name in self.volumes:
+            raise SimulatorError(VOLUME_ALREADY_EXIST,
+                                 "volume %s already exists" % vol_name)
+        pool = self.pools.get(int(pool_id))
+        if pool is None:
+            raise SimulatorError(1, "pool %s does not exist" % pool_id)
+
+        vol_id = next(self._ids)
+        volume = {
+            "volName": vol_name,
+            "volId": vol_id,
+            "poolId": pool["poolId"],
+            "volSize": int(vol_size),
+            "wwn": "6%031x" % vol_id,
+            "status": (VOLUME_CREATE_SUCCESS_STATUS if status is None
+                       else status),
+            "hosts": {},
+            "snapshots": collections.OrderedDict(),
+            "qosName": None,
+        }
+        self.volumes[vol_name] = volume
+        self.volumes_by_id[vol_id] = volume
+        pool["volumes"][vol_name] = volume
+        return volume
+
+    def get_volume(self, vol_name):
+        volume = self.volumes.get(vol_name)
+        if volume is None:
+            raise SimulatorError(VOLUME_NOT_EXIST,
+                                 "volume %s does not exist" % vol_name)
+        return volume
+
+    def delete_volume(self, vol_name):
+        volume = self.get_volume(vol_name)
+        if volume["hosts"]:
+            raise SimulatorError(HOST_MAPPING_EXIST,
+                                 "volume %s is mapped" % vol_name)
+        for snapshot_name in list(volume["snapshots"]):
+            self.snapshots.pop(snapshot_name, None)
+        if volume["qosName"]:
+            self.qos[volume["qosName"]]["volumes"].discard(vol_name)
+        del self.volumes[vol_name]
+        del self.volumes_by_id[volume["volId"]]
+        del self.pools[volume["poolId"]]["volumes"][vol_name]
+
+    @staticmethod
+    def volume_info(volume):
+        return dict((key, value) for key, value in volume.items()
+                    if key not in ("hosts", "snapshots", "qosName"))
+
+    def create_snapshot(self, snapshot_name, vol_name):
+        volume = self.get_volume(vol_name)
+        if snapshot_name in self.snapshots:
+            raise SimulatorError(1, "snapshot %s already exists"
+                                 % snapshot_name)
+        snapshot = {
+            "snapName": snapshot_name,
+            "snapshotName": snapshot_name,
+            "snapSize": volume["volSize"],
+            "volName": vol_name,
+            "poolId": volume["poolId"],
+            "id": next(self._ids),
+        }
+        self.snapshots[snapshot_name] = snapshot
+        volume["snapshots"][snapshot_name] = snapshot
+        return snapshot
+
+    def get_snapshot(self, snapshot_name):
+        snapshot = self.snapshots.get(snapshot_name)
+        if snapshot is None:
+            raise SimulatorError(SNAPSHOT_NOT_EXIST,
+                                 "snapshot %s does not exist" % snapshot_name)
+        return snapshot
+
+    def delete_snapshot(self, snapshot_name):
+        snapshot = self.get_snapshot(snapshot_name)
+        del self.snapshots[snapshot_name]
+        volume = self.volumes.get(snapshot["volName"])
+        if volume:
+            volume["snapshots"].pop(snapshot_name, None)
+
+    # Hosts, host groups and initiators.
+
+    def get_host(self, host_name):
+        host = self.hosts.get(host_name)
+        if host is None:
+            raise SimulatorError(HOST_NOT_EXIST,
+                                 "host %s does not exist" % host_name)
+        return host
+
+    def create_host(self, host_name):
+        if host_name in self.hosts:
+            raise SimulatorError(None, detail=[{
+                "hostName": host_name, "errorCode": HOST_ALREADY_EXIST}])
+        self.hosts[host_name] = {"hostName": host_name,
+                                 "luns": collections.OrderedDict(),
+                                 "ports": set(),
+                                 "groups": set(),
+                                 "next_lun_id": 1}
+
+    def delete_host(self, host_name):
+        host = self.get_host(host_name)
+        if host["luns"]:
+            raise SimulatorError(None, detail=[{
+                "hostName": host_name, "errorCode": HOST_MAPPING_EXIST}])
+        for port_name in host["ports"]:
+            self.initiators[port_name]["hosts"].discard(host_name)
+        for group_name in host["groups"]:
+            self.host_groups[group_name].discard(host_name)
+        del self.hosts[host_name]
+
+    def map_volume(self, host_name, vol_name):
+        host = self.get_host(host_name)
+        volume = self.get_volume(vol_name)
+        if vol_name not in host["luns"]:
+            lun_id = host["next_lun_id"]
+            host["next_lun_id"] += 1
+            host["luns"][vol_name] = lun_id
+            volume["hosts"][host_name] = lun_id
+
+    def unmap_volume(self, host_name, vol_name):
+        host = self.get_host(host_name)
+        volume = self.get_volume(vol_name)
+        host["luns"].pop(vol_name, None)
+        volume["hosts"].pop(host_name, None)
+
+    def get_initiator(self, port_name):
+        initiator = self.initiators.get(port_name)
+        if initiator is None:
+            raise SimulatorError(1, "initiator %s does not exist" % port_name)
+        return initiator
+
+
+class FaultInjector(object):
+    """Latency and errors injected into the simulated REST calls."""
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0,
+                 http_status=500, error_code=None):
+        self.lock = threading.Lock()
+        self.default = {"latency": latency, "jitter": jitter,
+                        "error_rate": error_rate, "http_status": http_status,
+                        "error_code": error_code}
+        self.faults = {}
+
+    def add(self, path=None, latency=None, jitter=None, error_rate=None,
+            http_status=None, error_code=None, count=None):
+        """Add a fault to one path, or to all paths without a path.
+
+        count limits the number of requests the fault applies to.
+        """
+        fault = {"latency": latency, "jitter": jitter,
+                 "error_rate": error_rate, "http_status": http_status,
+                 "error_code": error_code, "count": count}
+        fault = dict((key, value) for key, value in fault.items()
+                     if value is not None)
+        with self.lock:
+            if path is None:
+                self.default.update(fault)
+            else:
+                self.faults[path] = fault
+
+    def clear(self):
+        with self.lock:
+            self.faults.clear()
+            self.default.update({"latency": 0.0, "jitter": 0.0,
+                                 "error_rate": 0.0, "error_code": None})
+
+    def get(self, path):
+        with self.lock:
+            fault = dict(self.default)
+            specific = self.faults.get(path)
+            if specific:
+                fault.update(specific)
+                if "count" in specific:
+                    specific["count"] -= 1
+                    if specific["count"] <= 0:
+                        del self.faults[path]
+            return fault
+
+    def to_dict(self):
+        with self.lock:
+            return {"default": dict(self.default),
+                    "faults": dict((path, dict(fault)) for path, fault
+                                   in self.faults.items())}
+
+
+def _page(items, page_num, page_size):
+    start = (max(int(page_num), 1) - 1) * int(page_size)
+    return list(itertools.islice(items, start, start + int(page_size)))
+
+
+class FusionStorageAPI(object):
+    """The FusionStorage REST APIs used by the driver.
+
+    Every handler takes the query parameters and the decoded JSON body
+    and returns the response body, or raises SimulatorError.
+    """
+
+    def __init__(self, array, session_ttl=0):
+        self.array = array
+        self.session_ttl = session_ttl
+        self.tokens = {}
+        self.routes = {}
+        for name in dir(self):
+            handler = getattr(self, name)
+            for route in getattr(handler, "routes", ()):
+                self.routes[route] = handler
+
+    def route(*routes):
+        def decorator(func):
+            func.routes = routes
+            return func
+        return decorator
+
+    def login(self):
+        token = uuid.uuid4().hex
+        self.tokens[token] = time.time()
+        return token
+
+    def is_authorized(self, token):
+        login_at = self.tokens.get(token)
+        if login_at is None:
+            return False
+        if self.session_ttl and time.time() - login_at > self.session_ttl:
+            del self.tokens[token]
+            return False
+        return True
+
+    # Session and cluster.
+
+    @route(("GET", "/dsware/service/rest/version"))
+    def get_version(self, query, body):
+        return {"result": 0, "currentVersion": "v1.2"}
+
+    @route(("POST", "/sec/logout"), ("POST", "/sec/keepAlive"))
+    def session(self, query, body):
+        return {"result": 0}
+
+    @route(("GET", "/cluster/sn"))
+    def get_esn(self, query, body):
+        return {"result": 0, "sn": self.array.esn}
+
+    @route(("GET", "/version"))
+    def get_fsm_version(self, query, body):
+        return {"result": 0, "version": "8.1.0"}
+
+    @route(("GET", "/time/querytimezone"))
+    def get_time_zone(self, query, body):
+        return {"result": 0, "timeZone": "UTC"}
+
+    @route(("GET", "/api/v2/common/time_config"))
+    def get_time_config(self, query, body):
+        return {"result": {"code": 0, "description": ""},
+                "data": [{"time_zone_name": "UTC", "time_zone": "UTC+00:00",
+                          "use_dst": 0}]}
+
+    @route(("GET", "/storagePool"))
+    def get_pools(self, query, body):
+        pools = self.array.pools.values()
+        if "poolId" in query:
+            pools = [p for p in pools if p["poolId"] == int(query["poolId"])]
+        result = []
+        for pool in pools:
+            used = sum(v["volSize"] for v in pool["volumes"].values())
+            result.append({"poolId": pool["poolId"],
+                           "poolName": pool["poolName"],
+                           "totalCapacity": pool["totalCapacity"],
+                           "usedCapacity": used,
+                           "allocatedCapacity": used,
+                           "volumeNum": len(pool["volumes"])})
+        return {"result": 0, "storagePools": result}
+
+    # Volumes.
+
+    @route(("POST", "/volume/list"))
+    def list_volumes(self, query, body):
+        pool = self.array.pools.get(int(body.get("poolId", 0)))
+        if pool is None:
+            raise SimulatorError(VOLUME_NOT_EXIST, "pool does not exist")
+        volumes = _page(pool["volumes"].values(), body.get("pageNum", 1),
+                        body.get("pageSize", 1000))
+        return {"result": 0, "totalNum": len(pool["volumes"]),
+                "volumeList": [self.array.volume_info(v) for v in volumes]}
+
+    @route(("GET", "/volume/queryByName"))
+    def query_volume_by_name(self, query, body):
+        volume = self.array.get_volume(query.get("volName"))
+        return {"result": 0, "lunDetailInfo": self.array.volume_info(volume)}
+
+    @route(("GET", "/dsware/service/v1.3/volume/queryById"))
+    def query_volume_by_id(self, query, body):
+        volume = self.array.volumes_by_id.get(int(query.get("volId", 0)))
+        if volume is None:
+            raise SimulatorError(VOLUME_NOT_EXIST, "volume does not exist")
+        return {"result": 0, "lunDetailInfo": self.array.volume_info(volume)}
+
+    @route(("GET", "/api/v2/block_service/volumes"))
+    def query_volume_by_name_v2(self, query, body):
+        volume = self.array.get_volume(query.get("name"))
+        return {"result": {"code": 0, "description": ""},
+                "data": {"id": volume["volId"], "name": volume["volName"],
+                         "wwn": volume["wwn"],
+                         "health_status": STATUS_HEALTH,
+                         "running_status": STATUS_VOLUME_READY}}
+
+    @route(("POST", "/volume/create"))
+    def create_volume(self, query, body):
+        self.array.create_volume(body["volName"], body["volSize"],
+                                 body["poolId"])
+        return {"result": 0}
+
+    @route(("POST", "/volume/delete"))
+    def delete_volumes(self, query, body):
+        vol_names = body.get("volNames", [])
+        if len(vol_names) == 1:
+            self.array.delete_volume(vol_names[0])
+            return {"result": 0}
+
+        detail = []
+        for vol_name in vol_names:
+            try:
+                self.array.delete_volume(vol_name)
+            except SimulatorError as err:
+                detail.append({"volName": vol_name,
+                               "errorCode": err.error_code})
+        if detail:
+            raise SimulatorError(None, detail=detail)
+        return {"result": 0}
+
+    @route(("POST", "/volume/expand"))
+    def expand_volume(self, query, body):
+        volume = self.array.get_volume(body["volName"])
+        volume["volSize"] = int(body["newVolSize"])
+        return {"result": 0}
+
+    @route(("POST", "/volume/attach"), ("POST", "/volume/detach"))
+    def attach_volume(self, query, body):
+        result = {"result": 0}
+        for vol_name in body.get("volName", []):
+            volume = self.array.get_volume(vol_name)
+            result[vol_name] = [{"errorCode": "0",
+                                 "devName": "/dev/vd%s" % volume["volId"],
+                                 "ip": ip} for ip in body.get("ipList", [])]
+        return result
+
+    @route(("POST", "/volume/snapshot/list"))
+    def list_snapshots_of_volume(self, query, body):
+        volume = self.array.get_volume(body["volName"])
+        snapshots = list(volume["snapshots"].values())
+        name = body.get("filters", {}).get("volumeName")
+        if name:
+            snapshots = [s for s in snapshots if name in s["snapName"]]
+        page = _page(snapshots, body.get("batchNum", 1),
+                     body.get("batchLimit", 1000))
+        return {"result": 0, "totalNum": len(snapshots),
+                "snapshotList": page}
+
+    # Snapshots.
+
+    @route(("POST", "/snapshot/list"))
+    def list_snapshots(self, query, body):
+        pool_id = int(body.get("poolId", 0))
+        name = body.get("filters", {}).get("volumeName")
+        snapshots = [s for s in self.array.snapshots.values()
+                     if s["poolId"] == pool_id and
+                     (not name or name in s["snapName"])]
+        page = _page(snapshots, body.get("pageNum", 1),
+                     body.get("pageSize", 1000))
+        return {"result": 0, "totalNum": len(snapshots),
+                "snapshotList": page}
+
+    @route(("POST", "/snapshot/create"))
+    def create_snapshot(self, query, body):
+        self.array.create_snapshot(body["snapshotName"], body["volName"])
+        return {"result": 0}
+
+    @route(("POST", "/snapshot/delete"))
+    def delete_snapshot(self, query, body):
+        self.array.delete_snapshot(body["snapshotName"])
+        return {"result": 0}
+
+    @route(("POST", "/snapshot/volume/create"))
+    def create_volume_from_snapshot(self, query, body):
+        snapshot = self.array.get_snapshot(body["src"])
+        self.array.create_volume(body["volName"], body["volSize"],
+                                 snapshot["poolId"])
+        return {"result": 0}
+
+    @route(("POST", "/snapshot/rollback"))
+    def rollback_snapshot(self, query, body):
+        self.array.get_snapshot(body["snapshotName"])
+        return {"result": 0}
+
+    @route(("GET", "/api/v2/block_service/snapshots"),
+           ("POST", "/api/v2/block_service/snapshots"))
+    def snapshot_v2(self, query, body):
+        snapshot = self.array.get_snapshot(body.get("name"))
+        return {"result": {"code": 0, "description": ""},
+                "data": {"name": snapshot["snapName"],
+                         "running_status": SNAPSHOT_RUNNING_STATUS_ONLINE,
+                         "health_status": STATUS_HEALTH,
+                         "rollback_progress": 100,
+                         "rollback_endtime": int(time.time())}}
+
+    @route(("POST", "/api/v2/block_service/consistency_snapshots"))
+    def create_consistency_snapshots(self, query, body):
+        data = []
+        for item in body.get("snapshot_list", body if isinstance(
+                body, list) else []):
+            snapshot = self.array.create_snapshot(item["name"],
+                                                  item["volume_name"])
+            data.append({"name": snapshot["snapName"], "id": snapshot["id"]})
+        return {"result": {"code": 0, "description": ""}, "data": data}
+
+    @route(("POST", "/api/v2/block_service/createFullVolumeFromSnap"))
+    def create_full_volume_from_snapshot(self, query, body):
+        self.array.get_snapshot(body["snap_name_src"])
+        self.array.get_volume(body["volume_name_dst"])
+        return {"result": {"code": 0, "description": ""}}
+
+    @route(("POST", "/api/v2/block_service/lun_migration"),
+           ("GET", "/api/v2/block_service/lun_migration"),
+           ("DELETE", "/api/v2/block_service/lun_migration"))
+    def lun_migration(self, query, body):
+        if "parent_id" in body:
+            self.array.migrations[str(body["parent_id"])] = {
+                "parent_id": str(body["parent_id"]),
+                "target_lun_id": str(body["target_lun_id"]),
+                "running_status": MIGRATION_COMPLETE}
+            return {"result": {"code": 0, "description": ""}}
+
+        migration_id = str(body.get("id"))
+        if self.handler_method == "DELETE":
+            self.array.migrations.pop(migration_id, None)
+            return {"result": {"code": 0, "description": ""}}
+        return {"result": {"code": 0, "description": ""},
+                "data": self.array.migrations.get(migration_id, {})}
+
+    # Hosts and host groups.
+
+    @route(("POST", "/host/create"))
+    def create_host(self, query, body):
+        self.array.create_host(body["hostName"])
+        return {"result": 0}
+
+    @route(("POST", "/host/delete"))
+    def delete_host(self, query, body):
+        self.array.delete_host(body["hostName"])
+        return {"result": 0}
+
+    @route(("GET", "/host/list"))
+    def list_hosts(self, query, body):
+        return {"result": 0, "hostList": [
+            {"hostName": name} for name in self.array.hosts]}
+
+    @route(("POST", "/lun/host/list"))
+    def list_hosts_of_volume(self, query, body):
+        volume = self.array.get_volume(body["lunName"])
+        return {"result": 0, "hostList": [
+            {"hostName": name, "lunId": lun_id}
+            for name, lun_id in volume["hosts"].items()]}
+
+    @route(("POST", "/host/lun/add"))
+    def map_volumes(self, query, body):
+        detail = []
+        for lun_name in body.get("lunNames", []):
+            try:
+                self.array.map_volume(body["hostName"], lun_name)
+            except SimulatorError as err:
+                detail.append({"lunName": lun_name,
+                               "errorCode": err.error_code})
+        if detail:
+            raise SimulatorError(None, detail=detail)
+        return {"result": 0}
+
+    @route(("POST", "/host/lun/delete"))
+    def unmap_volumes(self, query, body):
+        for lun_name in body.get("lunNames", []):
+            self.array.unmap_volume(body["hostName"], lun_name)
+        return {"result": 0}
+
+    @route(("POST", "/host/lun/list"))
+    def list_volumes_of_host(self, query, body):
+        host = self.array.get_host(body["hostName"])
+        return {"result": 0, "hostLunList": [
+            {"lunName": name, "lunId": lun_id}
+            for name, lun_id in host["luns"].items()]}
+
+    @route(("POST", "/hostGroup/add"))
+    def create_host_group(self, query, body):
+        name = body["hostGroupName"]
+        if name in self.array.host_groups:
+            raise SimulatorError(None, detail=[{
+                "hostGroupName": name, "errorCode": HOSTGROUP_ALREADY_EXIST}])
+        self.array.host_groups[name] = set()
+        return {"result": 0}
+
+    @route(("POST", "/hostGroup/delete"))
+    def delete_host_group(self, query, body):
+        name = body["hostGroupName"]
+        for host_name in self.array.host_groups.pop(name, ()):
+            self.array.hosts[host_name]["groups"].discard(name)
+        return {"result": 0}
+
+    @route(("GET", "/hostGroup/list"))
+    def list_host_groups(self, query, body):
+        return {"result": 0, "groupList": [
+            {"hostGroupName": name} for name in self.array.host_groups]}
+
+    @route(("POST", "/hostGroup/host/add"))
+    def add_hosts_to_group(self, query, body):
+        name = body["hostGroupName"]
+        group = self.array.host_groups.get(name)
+        if group is None:
+            raise SimulatorError(1, "host group %s does not exist" % name)
+        detail = []
+        for host_name in body.get("hostList", []):
+            host = self.array.get_host(host_name)
+            if host_name in group:
+                detail.append({"hostName": host_name,
+                               "errorCode": HOST_MAPPING_GROUP_EXIST})
+            group.add(host_name)
+            host["groups"].add(name)
+        if detail:
+            raise SimulatorError(None, detail=detail)
+        return {"result": 0}
+
+    @route(("POST", "/hostGroup/host/delete"))
+    def remove_hosts_from_group(self, query, body):
+        name = body["hostGroupName"]
+        group = self.array.host_groups.get(name, set())
+        for host_name in body.get("hostList", []):
+            group.discard(host_name)
+            if host_name in self.array.hosts:
+                self.array.hosts[host_name]["groups"].discard(name)
+        return {"result": 0}
+
+    @route(("POST", "/hostGroup/host/list"))
+    def list_hosts_of_group(self, query, body):
+        group = self.array.host_groups.get(body["hostGroupName"], set())
+        return {"result": 0, "hostList": sorted(group)}
+
+    # Initiators.
+
+    @route(("POST", "/port/list"))
+    def list_initiators(self, query, body):
+        return {"result": 0, "portList": [
+            {"portName": name} for name in self.array.initiators]}
+
+    @route(("POST", "/dsware/service/iscsi/createPort"))
+    def create_initiator(self, query, body):
+        name = body["portName"]
+        if name in self.array.initiators:
+            raise SimulatorError(None, detail=[{
+                "portName": name, "errorCode": INITIATOR_ALREADY_EXIST}])
+        self.array.initiators[name] = {"portName": name, "hosts": set()}
+        return {"result": 0}
+
+    @route(("POST", "/dsware/service/iscsi/deletePort"))
+    def delete_initiator(self, query, body):
+        initiator = self.array.get_initiator(body["portName"])
+        if initiator["hosts"]:
+            raise SimulatorError(INITIATOR_IN_HOST, "initiator is in host")
+        del self.array.initiators[body["portName"]]
+        return {"result": 0}
+
+    @route(("POST", "/host/port/add"))
+    def add_initiators_to_host(self, query, body):
+        host = self.array.get_host(body["hostName"])
+        detail = []
+        for port_name in body.get("portNames", []):
+            initiator = self.array.get_initiator(port_name)
+            if initiator["hosts"]:
+                detail.append({"portName": port_name,
+                               "errorCode": INITIATOR_IN_HOST})
+                continue
+            initiator["hosts"].add(host["hostName"])
+            host["ports"].add(port_name)
+        if detail:
+            raise SimulatorError(None, detail=detail)
+        return {"result": 0}
+
+    @route(("POST", "/host/port/delete"))
+    def remove_initiators_from_host(self, query, body):
+        host = self.array.get_host(body["hostName"])
+        for port_name in body.get("portNames", []):
+            host["ports"].discard(port_name)
+            if port_name in self.array.initiators:
+                self.array.initiators[port_name]["hosts"].discard(
+                    host["hostName"])
+        return {"result": 0}
+
+    @route(("POST", "/port/host/list"))
+    def list_initiators_of_host(self, query, body):
+        host = self.array.get_host(body["hostName"])
+        return {"result": 0, "portList": sorted(host["ports"])}
+
+    @route(("POST", "/host/port/list"))
+    def list_hosts_of_initiators(self, query, body):
+        port_host_map = {}
+        for port_name in body.get("portName", []):
+            initiator = self.array.initiators.get(port_name)
+            port_host_map[port_name] = (sorted(initiator["hosts"])
+                                        if initiator else [])
+        return {"result": 0, "portHostMap": port_host_map}
+
+    # iSCSI.
+
+    @route(("POST", "/iscsi/port/list"))
+    def list_iscsi_ports(self, query, body):
+        node_ips = body.get("nodeMgrIps", [])
+        return {"result": 0, "nodeResultList": [
+            node for node in self.array.nodes
+            if node["nodeMgrIp"] in node_ips]}
+
+    @route(("POST", "/dsware/service/cluster/dswareclient/queryIscsiPortal"))
+    def query_iscsi_portal(self, query, body):
+        return {"result": 0, "nodeResultList": self.array.nodes}
+
+    def _get_iscsi_ips(self, amount):
+        ips = [node["iscsiPortalList"][0]["iscsiPortal"].rsplit(":", 1)[0]
+               for node in self.array.nodes]
+        random.shuffle(ips)
+        return ips[:int(amount)]
+
+    def _get_node_ips(self, amount):
+        ips = [node["nodeMgrIp"] for node in self.array.nodes]
+        random.shuffle(ips)
+        return ips[:int(amount)]
+
+    @route(("GET", "/api/v2/block_service/iscsi_sessions"))
+    def list_iscsi_sessions(self, query, body):
+        host_name = body.get("host_name")
+        return {"result": {"code": 0, "description": ""}, "data": [
+            {"iscsi_service_ip": ip}
+            for ip in self.array.iscsi_relations.get(host_name, [])]}
+
+    @route(("POST", "/dsware/service/iscsi/addIscsiHostRelation"))
+    def add_iscsi_host_relation(self, query, body):
+        for relation in body:
+            key = relation["key"]
+            if key in self.array.iscsi_relations:
+                return {"result": 1, "errorCode": HOST_ISCSI_RELATION_EXIST}
+            self.array.iscsi_relations[key] = [
+                ip for ip in relation["content"].split(";") if ip]
+        return {"result": 0}
+
+    @route(("POST", "/dsware/service/iscsi/queryIscsiHostRelation"))
+    def query_iscsi_host_relation(self, query, body):
+        result = {"result": 0, "hostList": []}
+        for relation in body:
+            key = relation["key"]
+            if key == "get_newiscsi":
+                result["newIscsi"] = self.array.new_iscsi
+            elif key in self.array.iscsi_relations:
+                result["hostList"].append({
+                    "key": key, "flag": 0,
+                    "content": ";".join(self.array.iscsi_relations[key])})
+        return result
+
+    @route(("POST", "/dsware/service/iscsi/deleteIscsiHostRelation"))
+    def delete_iscsi_host_relation(self, query, body):
+        for relation in body:
+            self.array.iscsi_relations.pop(relation["key"], None)
+        return {"result": 0}
+
+    @route(("POST", "/dsware/service/iscsi/queryVbsIscsiLinks"))
+    def query_vbs_iscsi_links(self, query, body):
+        return {"result": 0, "iscsiLinks": [
+            {"ip": ip} for ip in self._get_node_ips(body.get("amount", 4))]}
+
+    @route(("POST", "/dsware/service/iscsi/queryIscsiLinks"))
+    def query_iscsi_links(self, query, body):
+        host_key = body.get("hostKey")
+        ips = self.array.iscsi_relations.get(host_key)
+        if not ips:
+            ips = self._get_iscsi_ips(body.get("amount", 4))
+            self.array.iscsi_relations[host_key] = ips
+        portals = dict(
+            (node["iscsiPortalList"][0]["iscsiPortal"].rsplit(":", 1)[0],
+             node["iscsiPortalList"][0]) for node in self.array.nodes)
+        return {"result": 0, "iscsiLinks": [
+            {"iscsiPortal": portals[ip]["iscsiPortal"],
+             "targetName": portals[ip]["targetName"]}
+            for ip in ips if ip in portals]}
+
+    # QoS.
+
+    @route(("POST", "/qos/create"))
+    def create_qos(self, query, body):
+        self.array.qos[body["qosName"]] = {
+            "qosName": body["qosName"],
+            "qosSpecInfo": body.get("qosSpecInfo", {}),
+            "volumes": set()}
+        return {"result": 0}
+
+    @route(("POST", "/qos/delete"))
+    def delete_qos(self, query, body):
+        for qos_name in body.get("qosNames", []):
+            self.array.qos.pop(qos_name, None)
+        return {"result": 0}
+
+    @route(("POST", "/qos/modify"))
+    def modify_qos(self, query, body):
+        qos = self.array.qos.get(body["qosName"])
+        if qos is None:
+            raise SimulatorError(QOS_NOT_EXIST, "QoS does not exist")
+        qos["qosSpecInfo"].update(body.get("qosSpecInfo", {}))
+        return {"result": 0}
+
+    @route(("POST", "/qos/volume/associate"),
+           ("POST", "/qos/volume/disassociate"))
+    def associate_qos(self, query, body):
+        qos = self.array.qos.get(body["qosName"])
+        if qos is None:
+            raise SimulatorError(QOS_NOT_EXIST, "QoS does not exist")
+        associate = self.handler_path.endswith("/associate")
+        for vol_name in body.get("keyNames", []):
+            volume = self.array.get_volume(vol_name)
+            if associate:
+                qos["volumes"].add(vol_name)
+                volume["qosName"] = qos["qosName"]
+            else:
+                qos["volumes"].discard(vol_name)
+                volume["qosName"] = None
+        return {"result": 0}
+
+    @route(("GET", "/volume/qos"))
+    def get_qos_of_volume(self, query, body):
+        volume = self.array.get_volume(query.get("volName"))
+        qos = self.array.qos.get(volume["qosName"])
+        if not qos:
+            return {"result": 0}
+        result = {"result": 0, "qosName": qos["qosName"]}
+        result.update(qos["qosSpecInfo"])
+        return result
+
+    @route(("POST", "/qos/volume/list"))
+    def list_qos_volumes(self, query, body):
+        qos = self.array.qos.get(body.get("qosName"))
+        volumes = sorted(qos["volumes"]) if qos else []
+        pool_id = body.get("poolId")
+        if pool_id is not None:
+            volumes = [v for v in volumes
+                       if self.array.volumes[v]["poolId"] == int(pool_id)]
+        page = _page(volumes, body.get("pageNum", 1),
+                     body.get("pageSize", 100))
+        return {"result": 0, "totalNum": len(volumes),
+                "volumes": [{"volName": v} for v in page]}
+
+    del route
+
+
+class RequestHandler(server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    @property
+    def simulator(self):
+        return self.server.simulator
+
+    def log_message(self, fmt, *args):
+        if self.simulator.verbose:
+            server.BaseHTTPRequestHandler.log_message(self, fmt, *args)
+
+    def _send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json;charset=UTF-8")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if not length:
+            return {}
+        return json.loads(self.rfile.read(length).decode("utf-8") or "{}")
+
+    @staticmethod
+    def _normalize(path):
+        if path.startswith(V12_URI + "/"):
+            return path[len(V12_URI):]
+        return path
+
+    def _handle(self):
+        url = parse.urlsplit(self.path)
+        path = self._normalize(url.path)
+        query = dict(parse.parse_qsl(url.query))
+        body = self._read_body()
+
+        if path.startswith("/simulator/"):
+            return self._send_json(200, self.simulator.control(
+                self.command, path, body))
+
+        self.simulator.count(self.command, path)
+        fault = self.simulator.faults.get(path)
+        latency = fault["latency"] + random.uniform(0, fault["jitter"])
+        if latency > 0:
+            time.sleep(latency)
+        if fault["error_rate"] and random.random() < fault["error_rate"]:
+            if fault["error_code"]:
+                return self._send_json(200, {
+                    "result": 1, "errorCode": fault["error_code"],
+                    "description": "Injected error."})
+            return self._send_json(fault["http_status"], {
+                "result": 1, "description": "Injected error."})
+
+        self.simulator.handle(self, path, query, body)
+
+    do_GET = do_POST = do_PUT = do_DELETE = _handle
+
+
+class _ThreadingHTTPServer(server.ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+    def handle_error(self, request, client_address):
+        # Clients stop reading streamed lists early by closing the
+        # connection.
+        if isinstance(sys.exc_info()[1], (BrokenPipeError,
+                                          ConnectionResetError)):
+            return
+        server.ThreadingHTTPServer.handle_error(self, request,
+                                                client_address)
+
+
+class FusionStorageSimulator(object):
+    def __init__(self, host="127.0.0.1", port=0, volumes=0, pools=1,
+                 nodes=3, session_ttl=0, latency=0.0, jitter=0.0,
+                 error_rate=0.0, certfile=None, keyfile=None, verbose=False,
+                 new_iscsi=True):
+        self.pools = pools
+        self.nodes = nodes
+        self.array = SimulatedArray(pools=pools, nodes=nodes,
+                                    new_iscsi=new_iscsi)
+        self.api = FusionStorageAPI(self.array, session_ttl=session_ttl)
+        self.faults = FaultInjector(latency=latency, jitter=jitter,
+                                    error_rate=error_rate)
+        self.verbose = verbose
+        self._counter_lock = threading.Lock()
+        self.counters = collections.Counter()
+        self.populate(volumes)
+
+        self.httpd = _ThreadingHTTPServer((host, port), RequestHandler)
+        self.httpd.simulator = self
+        self.scheme = "http"
+        if certfile:
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(certfile, keyfile)
+            self.httpd.socket = context.wrap_socket(self.httpd.socket,
+                                                    server_side=True)
+            self.scheme = "https"
+        self._thread = None
+
+    @property
+    def address(self):
+        host, port = self.httpd.server_address[:2]
+        return "%s://%s:%s" % (self.scheme, host, port)
+
+    def populate(self, volumes, prefix="sim_volume_", size=1024):
+        """Spread pre-existing volumes across the pools."""
+        pool_ids = list(self.array.pools)
+        with self.array.lock:
+            for index in range(volumes):
+                self.array.create_volume(
+                    "%s%s" % (prefix, index), size,
+                    pool_ids[index % len(pool_ids)])
+
+    def count(self, method, path):
+        with self._counter_lock:
+            self.counters["%s %s" % (method, path)] += 1
+
+    def get_stats(self):
+        with self._counter_lock:
+            requests = dict(self.counters)
+        with self.array.lock:
+            objects = {"volumes": len(self.array.volumes),
+                       "snapshots": len(self.array.snapshots),
+                       "hosts": len(self.array.hosts),
+                       "host_groups": len(self.array.host_groups),
+                       "initiators": len(self.array.initiators),
+                       "qos": len(self.array.qos)}
+        return {"requests": requests, "total": sum(requests.values()),
+                "objects": objects}
+
+    def reset_stats(self):
+        with self._counter_lock:
+            self.counters.clear()
+
+    def reset(self, volumes=0, new_iscsi=True):
+        """Replace the array by an empty one, keeping the sessions."""
+        array = SimulatedArray(pools=self.pools, nodes=self.nodes,
+                               new_iscsi=new_iscsi)
+        with self.array.lock:
+            self.array = self.api.array = array
+        self.populate(volumes)
+        self.reset_stats()
+
+    def control(self, method, path, body):
+        if path == "/simulator/reset" and method == "POST":
+            self.reset(**body)
+            return self.get_stats()
+        if path == "/simulator/stats":
+            if method == "POST":
+                self.reset_stats()
+            return self.get_stats()
+        if path == "/simulator/faults":
+            if method == "POST":
+                self.faults.add(**body)
+            elif method == "DELETE":
+                self.faults.clear()
+            return self.faults.to_dict()
+        return {"error": "unknown control path %s" % path}
+
+    def handle(self, handler, path, query, body):
+        if path == "/sec/login":
+            token = self.api.login()
+            return handler._send_json(200, {"result": 0},
+                                      {"X-Auth-Token": token})
+
+        route = self.api.routes.get((handler.command, path))
+        if route is None:
+            return handler._send_json(404, {
+                "result": 1, "description": "Not Found for url %s" % path})
+
+        token = handler.headers.get("X-Auth-Token")
+        if (path != "/dsware/service/rest/version" and
+                not self.api.is_authorized(token)):
+            return handler._send_json(200, {
+                "result": ERROR_UNAUTHORIZED,
+                "description": "The session is unauthorized."})
+
+        with self.array.lock:
+            self.api.handler_method = handler.command
+            self.api.handler_path = path
+            try:
+                result = route(query, body)
+            except SimulatorError as err:
+                result = err.to_dict()
+            except (KeyError, TypeError, ValueError) as err:
+                result = {"result": 1, "errorCode": 1,
+                          "description": "Invalid request: %r" % err}
+        return handler._send_json(200, result)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self.address
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self._thread:
+            self._thread.join()
+
+    def serve_forever(self):
+        self.httpd.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Local FusionStorage REST simulator.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=28443)
+    parser.add_argument("--volumes", type=int, default=0,
+                        help="number of volumes created at start up")
+    parser.add_argument("--pools", type=int, default=1)
+    parser.add_argument("--nodes", type=int, default=3,
+                        help="number of storage nodes with an iSCSI portal")
+    parser.add_argument("--session-ttl", type=float, default=0,
+                        help="seconds after which a session expires")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="seconds added to every request")
+    parser.add_argument("--jitter", type=float, default=0.0,
+                        help="maximum random seconds added to the latency")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="probability of an injected HTTP 500 error")
+    parser.add_argument("--certfile")
+    parser.add_argument("--keyfile")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    simulator = FusionStorageSimulator(
+        host=args.host, port=args.port, volumes=args.volumes,
+        pools=args.pools, nodes=args.nodes, session_ttl=args.session_ttl,
+        latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+        certfile=args.certfile, keyfile=args.keyfile, verbose=args.verbose)
+    print("FusionStorage simulator listening on %s, ESN %s" % (
+        simulator.address, simulator.array.esn))
+    try:
+        simulator.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()